@@ -0,0 +1,415 @@
+"""
+Emotion report generation for many users at once.
+
+build_reports() turns daily and hourly rollup rows of any number of users
+into their reports with grouped pandas/NumPy operations; the API uses it
+for a single user and the nightly job for everyone.
+
+Nightly job (from the backend directory):
+    python -m analytics.batch_reports --days 30 --workers 4
+
+The job streams the rollups of every user, ordered by user, through two
+server-side cursors, cuts the stream into chunks of ``--chunk-users``
+users, builds each chunk's reports (in worker processes when
+``--workers`` > 1) and upserts them into emotion_report_snapshots, where
+EmotionTracker.get_emotion_report() serves them until the user records a
+new emotion or they are SNAPSHOT_MAX_AGE old.
+"""
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import argparse
+import json
+import math
+import resource
+import time
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import extract, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+
+logger = logging.getLogger(__name__)
+
+DAILY_COLUMNS = ["user_id", "date", "record_count", "sentiment_sum", "sentiment_sq_sum", "emotion_counts"]
+HOURLY_COLUMNS = ["user_id", "hour", "record_count", "sentiment_sum"]
+
+NO_RECORDS = {"error": "No emotion records found for the specified period"}
+
+# A snapshot's window ends when it was generated, so it is only served while
+# that lags the clock by less than a nightly run's interval
+SNAPSHOT_MAX_AGE = timedelta(hours=24)
+
+def report_window(days: int, end_date: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    """Report period: rollups are bucketed by day, so it starts at midnight."""
+    end_date = end_date or datetime.utcnow()
+    start_date = datetime.combine((end_date - timedelta(days=days)).date(), datetime.min.time())
+    return start_date, end_date
+
+def _number(value) -> Optional[float]:
+    # NaN is not valid JSON (nor accepted by JSONB), report it as null
+    value = float(value)
+    return None if math.isnan(value) else value
+
+def build_reports(
+    daily: pd.DataFrame,
+    hourly: pd.DataFrame,
+    start_date: datetime,
+    end_date: datetime
+) -> Dict[int, Dict]:
+    """
+    Build emotion reports for every user in ``daily``.
+
+    ``daily`` has DAILY_COLUMNS (one row per user and day) and ``hourly``
+    has HOURLY_COLUMNS (one row per user and hour of day). All statistics
+    are computed for every user together; only the final dicts are
+    assembled per user.
+    """
+    daily = daily[daily["record_count"] > 0].sort_values(["user_id", "date"], kind="stable").reset_index(drop=True)
+    if daily.empty:
+        return {}
+
+    user_ids = daily["user_id"].to_numpy()
+    counts = daily["record_count"].to_numpy(dtype=np.float64)
+    sums = daily["sentiment_sum"].to_numpy(dtype=np.float64)
+    sq_sums = daily["sentiment_sq_sum"].to_numpy(dtype=np.float64)
+
+    # Daily mean and sample standard deviation from count, sum and sum of squares
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+        variance = (sq_sums - sums * means) / (counts - 1)
+    stds = np.where(counts > 1, np.sqrt(np.clip(variance, 0, None)), np.nan)
+
+    # Emotion histograms as a matrix; columns sorted so ties resolve alphabetically
+    histograms = pd.DataFrame.from_records([counts or {} for counts in daily["emotion_counts"]], index=daily.index)
+    histograms = histograms.reindex(columns=sorted(histograms.columns)).fillna(0)
+    has_emotions = histograms.sum(axis=1).to_numpy() > 0
+    dominant = np.where(has_emotions, histograms.idxmax(axis=1) if len(histograms.columns) else None, None)
+
+    # Users are contiguous segments of the sorted rows
+    boundaries = np.flatnonzero(np.diff(user_ids)) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(daily)]))
+    users = user_ids[starts]
+    segment = np.repeat(np.arange(len(users)), stops - starts)
+    user_histograms = np.add.reduceat(histograms.to_numpy(), starts, axis=0) if len(histograms.columns) else None
+
+    # Segment sums as differences of running sums: whole period, last 7 days
+    # and the 7-day rolling window (mean weighted by entries)
+    sum_cs = np.concatenate(([0.0], np.cumsum(sums)))
+    count_cs = np.concatenate(([0.0], np.cumsum(counts)))
+    total_records = count_cs[stops] - count_cs[starts]
+    average_sentiment = (sum_cs[stops] - sum_cs[starts]) / total_records
+    recent_start = np.maximum(starts, stops - 7)
+    recent_sentiment = (sum_cs[stops] - sum_cs[recent_start]) / (count_cs[stops] - count_cs[recent_start])
+    rows = np.arange(len(daily))
+    window_start = np.maximum(rows - 6, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trend = (sum_cs[rows + 1] - sum_cs[window_start]) / (count_cs[rows + 1] - count_cs[window_start])
+    trend[rows - starts[segment] < 6] = np.nan
+
+    # Best/worst hour of day from a users x 24 matrix of hourly means
+    best_hours = worst_hours = None
+    if not hourly.empty:
+        hourly = hourly[hourly["user_id"].isin(users)]
+        cells = np.searchsorted(users, hourly["user_id"].to_numpy()) * 24 + hourly["hour"].to_numpy().astype(np.int64)
+        hour_sums = np.bincount(cells, hourly["sentiment_sum"].to_numpy(dtype=np.float64), len(users) * 24)
+        hour_counts = np.bincount(cells, hourly["record_count"].to_numpy(dtype=np.float64), len(users) * 24)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hour_means = (hour_sums / hour_counts).reshape(len(users), 24)
+        has_hours = ~np.all(np.isnan(hour_means), axis=1)
+        best_hours = np.full(len(users), -1)
+        worst_hours = np.full(len(users), -1)
+        best_hours[has_hours] = np.nanargmax(hour_means[has_hours], axis=1)
+        worst_hours[has_hours] = np.nanargmin(hour_means[has_hours], axis=1)
+
+    daily_stats = [
+        {
+            "date": date,
+            "record_count": int(count),
+            "sentiment_mean": _number(mean),
+            "sentiment_std": _number(std),
+            "dominant_emotion": emotion
+        }
+        for date, count, mean, std, emotion in zip(
+            pd.to_datetime(daily["date"]).dt.strftime("%Y-%m-%d").tolist(),
+            counts.tolist(), means.tolist(), stds.tolist(), dominant.tolist()
+        )
+    ]
+    sentiment_trend = [_number(value) for value in trend.tolist()]
+    emotions = histograms.columns.tolist()
+    period = {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat()
+    }
+
+    reports = {}
+    for index, (start, stop) in enumerate(zip(starts.tolist(), stops.tolist())):
+        total = int(total_records[index])
+        average = float(average_sentiment[index])
+
+        order = []
+        if user_histograms is not None:
+            user_counts = user_histograms[index].tolist()
+            order = sorted((i for i, count in enumerate(user_counts) if count > 0), key=lambda i: (-user_counts[i], emotions[i]))
+
+        insights = []
+        if recent_sentiment[index] > average:
+            insights.append({
+                "type": "positive_trend",
+                "message": "Your emotional state has been more positive recently"
+            })
+        elif recent_sentiment[index] < average:
+            insights.append({
+                "type": "negative_trend",
+                "message": "Your emotional state has been more challenging recently"
+            })
+        if len(order) / total < 0.3:
+            insights.append({
+                "type": "emotion_consistency",
+                "message": "You've been experiencing consistent emotions recently"
+            })
+        if best_hours is not None and best_hours[index] >= 0:
+            insights.append({
+                "type": "daily_pattern",
+                "message": f"You tend to feel best around {best_hours[index]}:00 and most challenged around {worst_hours[index]}:00"
+            })
+
+        reports[int(users[index])] = {
+            "period": dict(period),
+            "summary": {
+                "total_records": total,
+                "average_sentiment": average,
+                "most_common_emotion": emotions[order[0]] if order else None,
+                "emotion_distribution": {emotions[i]: user_counts[i] / total for i in order}
+            },
+            "trends": {
+                "daily_stats": daily_stats[start:stop],
+                "sentiment_trend": sentiment_trend[start:stop]
+            },
+            "insights": insights
+        }
+    return reports
+
+def _build_chunk(daily_rows: List[Tuple], hourly_rows: List[Tuple], start_iso: str, end_iso: str) -> List[Tuple[int, str]]:
+    """Worker entry point: build one chunk's reports, returned as JSON text."""
+    reports = build_reports(
+        pd.DataFrame(daily_rows, columns=DAILY_COLUMNS),
+        pd.DataFrame(hourly_rows, columns=HOURLY_COLUMNS),
+        datetime.fromisoformat(start_iso),
+        datetime.fromisoformat(end_iso)
+    )
+    return [(user_id, json.dumps(report)) for user_id, report in reports.items()]
+
+class _UserChunks:
+    """Cuts two user-ordered row streams into aligned chunks of users."""
+
+    def __init__(self, daily_rows: Iterable[Tuple], hourly_rows: Iterable[Tuple], chunk_users: int):
+        self._daily = iter(daily_rows)
+        self._hourly = iter(hourly_rows)
+        self._chunk_users = chunk_users
+        self._daily_next = next(self._daily, None)
+        self._hourly_next = next(self._hourly, None)
+
+    def __iter__(self) -> Iterator[Tuple[List[Tuple], List[Tuple]]]:
+        while self._daily_next is not None:
+            daily_chunk, users, last_user = [], 0, None
+            while self._daily_next is not None:
+                user_id = self._daily_next[0]
+                if user_id != last_user:
+                    if users == self._chunk_users:
+                        break
+                    users, last_user = users + 1, user_id
+                daily_chunk.append(tuple(self._daily_next))
+                self._daily_next = next(self._daily, None)
+
+            hourly_chunk = []
+            while self._hourly_next is not None and self._hourly_next[0] <= last_user:
+                hourly_chunk.append(tuple(self._hourly_next))
+                self._hourly_next = next(self._hourly, None)
+            yield daily_chunk, hourly_chunk
+
+def generate_reports(
+    daily_rows: Iterable[Tuple],
+    hourly_rows: Iterable[Tuple],
+    start_date: datetime,
+    end_date: datetime,
+    sink: Callable[[List[Tuple[int, str]]], None],
+    chunk_users: int = 5000,
+    workers: int = 1
+) -> Dict:
+    """
+    Build reports from user-ordered row streams and pass each chunk's
+    ``(user_id, report_json)`` pairs to ``sink``.
+
+    With ``workers`` > 1 chunks are built in a process pool; at most two
+    chunks per worker are in flight, so memory stays bounded by the chunk
+    size rather than the number of users.
+    """
+    started = time.perf_counter()
+    chunks = _UserChunks(daily_rows, hourly_rows, chunk_users)
+    args = (start_date.isoformat(), end_date.isoformat())
+    users = 0
+
+    if workers <= 1:
+        for daily_chunk, hourly_chunk in chunks:
+            results = _build_chunk(daily_chunk, hourly_chunk, *args)
+            sink(results)
+            users += len(results)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = []
+            for daily_chunk, hourly_chunk in chunks:
+                pending.append(pool.submit(_build_chunk, daily_chunk, hourly_chunk, *args))
+                if len(pending) >= 2 * workers:
+                    results = pending.pop(0).result()
+                    sink(results)
+                    users += len(results)
+            for future in pending:
+                results = future.result()
+                sink(results)
+                users += len(results)
+
+    wall_seconds = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux; children covers the worker processes
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    return {
+        "users": users,
+        "workers": workers,
+        "chunk_users": chunk_users,
+        "wall_seconds": round(wall_seconds, 2),
+        "wall_seconds_per_100k_users": round(wall_seconds * 100000 / users, 2) if users else None,
+        "peak_rss_mb": round(peak_kb / 1024, 1)
+    }
+
+def _daily_query(start_date: datetime, end_date: datetime, user_ids: Optional[List[int]] = None):
+    rollup = models.EmotionDailyRollup
+    stmt = select(
+        rollup.user_id, rollup.day, rollup.record_count,
+        rollup.sentiment_sum, rollup.sentiment_sq_sum, rollup.emotion_counts
+    ).where(rollup.day >= start_date.date(), rollup.day <= end_date.date())
+    if user_ids is not None:
+        stmt = stmt.where(rollup.user_id.in_(user_ids))
+    return stmt.order_by(rollup.user_id, rollup.day)
+
+def _hourly_query(start_date: datetime, end_date: datetime, user_ids: Optional[List[int]] = None):
+    rollup = models.EmotionHourlyRollup
+    hour = extract("hour", rollup.hour).label("hour")
+    stmt = select(
+        rollup.user_id, hour,
+        func.sum(rollup.record_count), func.sum(rollup.sentiment_sum)
+    ).where(rollup.hour >= start_date, rollup.hour <= end_date)
+    if user_ids is not None:
+        stmt = stmt.where(rollup.user_id.in_(user_ids))
+    return stmt.group_by(rollup.user_id, hour).order_by(rollup.user_id, hour)
+
+def build_user_report(db: Session, user_id: int, days: int = 30) -> Dict:
+    """Build one user's report from their rollups."""
+    start_date, end_date = report_window(days)
+    daily = pd.DataFrame(db.execute(_daily_query(start_date, end_date, [user_id])).all(), columns=DAILY_COLUMNS)
+    hourly = pd.DataFrame(db.execute(_hourly_query(start_date, end_date, [user_id])).all(), columns=HOURLY_COLUMNS)
+    return build_reports(daily, hourly, start_date, end_date).get(user_id, NO_RECORDS)
+
+async def build_user_report_async(db: AsyncSession, user_id: int, days: int = 30) -> Dict:
+    """build_user_report() for an AsyncSession."""
+    start_date, end_date = report_window(days)
+    daily = pd.DataFrame((await db.execute(_daily_query(start_date, end_date, [user_id]))).all(), columns=DAILY_COLUMNS)
+    hourly = pd.DataFrame((await db.execute(_hourly_query(start_date, end_date, [user_id]))).all(), columns=HOURLY_COLUMNS)
+    return build_reports(daily, hourly, start_date, end_date).get(user_id, NO_RECORDS)
+
+def _newest_record_query(user_id: int):
+    return select(func.max(models.EmotionRecord.id)).where(models.EmotionRecord.user_id == user_id)
+
+def _snapshot_is_current(snapshot: Optional[models.EmotionReportSnapshot], newest: Optional[int]) -> bool:
+    return (
+        snapshot is not None
+        and datetime.utcnow() - snapshot.generated_at < SNAPSHOT_MAX_AGE
+        and (newest is None or newest <= snapshot.max_record_id)
+    )
+
+def load_snapshot(db: Session, user_id: int, days: int) -> Optional[Dict]:
+    """
+    Return the nightly report for the user if it is still current: built
+    less than SNAPSHOT_MAX_AGE ago and no emotion recorded since the job
+    read the data.
+    """
+    snapshot = db.get(models.EmotionReportSnapshot, (user_id, days))
+    if snapshot is None:
+        return None
+    newest = db.execute(_newest_record_query(user_id)).scalar()
+    return snapshot.report if _snapshot_is_current(snapshot, newest) else None
+
+async def load_snapshot_async(db: AsyncSession, user_id: int, days: int) -> Optional[Dict]:
+    """load_snapshot() for an AsyncSession."""
+    snapshot = await db.get(models.EmotionReportSnapshot, (user_id, days))
+    if snapshot is None:
+        return None
+    newest = (await db.execute(_newest_record_query(user_id))).scalar()
+    return snapshot.report if _snapshot_is_current(snapshot, newest) else None
+
+def run_nightly_job(days: int = 30, workers: int = 1, chunk_users: int = 5000, stream_rows: int = 50000) -> Dict:
+    """Build and store every user's report; returns wall time and peak memory."""
+    from database import engine
+
+    generated_at = datetime.utcnow()
+    start_date, end_date = report_window(days, generated_at)
+    table = models.EmotionReportSnapshot.__table__
+
+    with engine.connect() as daily_conn, engine.connect() as hourly_conn, engine.connect() as write_conn:
+        # Records committed after this point make a user's snapshot stale
+        max_record_id = write_conn.execute(select(func.max(models.EmotionRecord.id))).scalar() or 0
+        write_conn.commit()
+
+        # Server-side cursors: rows arrive in batches of stream_rows
+        daily_rows = daily_conn.execution_options(yield_per=stream_rows).execute(_daily_query(start_date, end_date))
+        hourly_rows = hourly_conn.execution_options(yield_per=stream_rows).execute(_hourly_query(start_date, end_date))
+
+        def store(results: List[Tuple[int, str]]):
+            if not results:
+                return
+            stmt = insert(table).values([
+                {
+                    "user_id": user_id,
+                    "days": days,
+                    "generated_at": generated_at,
+                    "max_record_id": max_record_id,
+                    "report": json.loads(report)
+                }
+                for user_id, report in results
+            ])
+            write_conn.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.user_id, table.c.days],
+                set_={
+                    "generated_at": stmt.excluded.generated_at,
+                    "max_record_id": stmt.excluded.max_record_id,
+                    "report": stmt.excluded.report
+                }
+            ))
+            write_conn.commit()
+
+        metrics = generate_reports(daily_rows, hourly_rows, start_date, end_date, store, chunk_users, workers)
+
+    logger.info(f"Generated {metrics['users']} emotion reports: {metrics}")
+    return metrics
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-users", type=int, default=5000)
+    parser.add_argument("--stream-rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from database import Base, engine
+    Base.metadata.create_all(engine, tables=[models.EmotionReportSnapshot.__table__])
+    print(json.dumps(run_nightly_job(args.days, args.workers, args.chunk_users, args.stream_rows)))
+
+if __name__ == "__main__":
+    main()
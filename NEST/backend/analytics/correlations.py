@@ -0,0 +1,271 @@
+from typing import Dict, List, Optional
+from datetime import datetime
+from sqlalchemy import Select, extract, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import pandas as pd
+import numpy as np
+import models
+from analytics.emotion_queries import to_frame
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+def _cohort(stmt, column, user_ids: Optional[List[int]]):
+    return stmt.where(column.in_(user_ids)) if user_ids is not None else stmt
+
+def source_queries(start: datetime, user_ids: Optional[List[int]] = None) -> Dict[str, Select]:
+    """
+    Queries for the per-user aggregates the correlation engine needs since
+    ``start``.
+
+    ``user_ids=None`` selects every user. Sentiment comes from the emotion
+    rollups, meditation and chat activity are grouped per user and day in
+    the database.
+    """
+    daily = models.EmotionDailyRollup
+    hourly = models.EmotionHourlyRollup
+    hour = extract("hour", hourly.hour).label("hour")
+    # isodow is 1 (Monday) to 7 (Sunday)
+    dow = (extract("isodow", hourly.hour) - 1).label("dow")
+
+    meditation_day = func.date_trunc("day", models.MeditationSession.start_time).label("day")
+    chat_day = func.date_trunc("day", models.ChatMessage.timestamp).label("day")
+
+    return {
+        "daily": _cohort(
+            select(daily.user_id, daily.day, daily.record_count, daily.sentiment_sum)
+            .where(daily.day >= start.date()),
+            daily.user_id, user_ids
+        ),
+        "hourly": _cohort(
+            select(
+                hourly.user_id,
+                hour,
+                dow,
+                func.sum(hourly.record_count).label("record_count"),
+                func.sum(hourly.sentiment_sum).label("sentiment_sum"),
+                func.sum(hourly.sentiment_sq_sum).label("sentiment_sq_sum")
+            ).where(hourly.hour >= start),
+            hourly.user_id, user_ids
+        ).group_by(hourly.user_id, hour, dow),
+        "meditation": _cohort(
+            select(
+                models.MeditationSession.user_id,
+                meditation_day,
+                func.count().label("sessions"),
+                func.coalesce(func.sum(models.MeditationSession.duration), 0).label("duration")
+            ).where(models.MeditationSession.start_time >= start),
+            models.MeditationSession.user_id, user_ids
+        ).group_by(models.MeditationSession.user_id, meditation_day),
+        "chat": _cohort(
+            select(
+                models.ChatSession.user_id,
+                chat_day,
+                func.count().label("messages")
+            ).join(models.ChatSession, models.ChatMessage.session_id == models.ChatSession.id)
+            .where(models.ChatMessage.timestamp >= start, models.ChatMessage.sender_type == "user"),
+            models.ChatSession.user_id, user_ids
+        ).group_by(models.ChatSession.user_id, chat_day)
+    }
+
+def load_sources(db: Session, start: datetime, user_ids: Optional[List[int]] = None) -> Dict[str, pd.DataFrame]:
+    """Load the correlation inputs since ``start``; see source_queries()."""
+    return {name: to_frame(db.execute(stmt)) for name, stmt in source_queries(start, user_ids).items()}
+
+async def load_sources_async(db: AsyncSession, start: datetime, user_ids: Optional[List[int]] = None) -> Dict[str, pd.DataFrame]:
+    """load_sources() for an AsyncSession."""
+    return {name: to_frame(await db.execute(stmt)) for name, stmt in source_queries(start, user_ids).items()}
+
+def grouped_pearson(groups: np.ndarray, x: np.ndarray, y: np.ndarray, n_groups: int, min_count: int = 3) -> np.ndarray:
+    """
+    Pearson correlation of ``x`` and ``y`` within each group, from sums
+    accumulated with np.bincount. Groups with fewer than ``min_count``
+    points or no variance get NaN.
+    """
+    n = np.bincount(groups, minlength=n_groups).astype(np.float64)
+    sx = np.bincount(groups, x, n_groups)
+    sy = np.bincount(groups, y, n_groups)
+    sxx = np.bincount(groups, x * x, n_groups)
+    syy = np.bincount(groups, y * y, n_groups)
+    sxy = np.bincount(groups, x * y, n_groups)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        r = cov / np.sqrt(var_x * var_y)
+    # Variances below rounding noise mean a constant series
+    valid = (n >= min_count) & (var_x > 1e-12 * np.maximum(sxx, 1)) & (var_y > 1e-12 * np.maximum(syy, 1))
+    return np.where(valid, np.clip(r, -1.0, 1.0), np.nan)
+
+def grouped_correlation_ratio(
+    groups: np.ndarray,
+    categories: np.ndarray,
+    n_groups: int,
+    n_categories: int,
+    count: np.ndarray,
+    total: np.ndarray,
+    total_sq: np.ndarray
+):
+    """
+    Correlation ratio (eta) of sentiment on a categorical variable per
+    group, from per-cell count/sum/sum-of-squares.
+
+    Returns ``(eta, cell_means)`` where ``cell_means`` is a
+    ``n_groups x n_categories`` matrix (NaN for empty cells).
+    """
+    cells = groups * n_categories + categories
+    size = n_groups * n_categories
+    cell_n = np.bincount(cells, count, size).reshape(n_groups, n_categories)
+    cell_sum = np.bincount(cells, total, size).reshape(n_groups, n_categories)
+
+    n = cell_n.sum(axis=1)
+    grand_sum = cell_sum.sum(axis=1)
+    sum_sq = np.bincount(groups, total_sq, n_groups)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cell_means = cell_sum / cell_n
+        # SS_between = sum(n_c * mean_c^2) - N * mean^2; SS_total = sum(y^2) - N * mean^2
+        between = np.nansum(cell_sum * cell_means, axis=1) - grand_sum * grand_sum / n
+        ss_total = sum_sq - grand_sum * grand_sum / n
+        eta = np.sqrt(np.clip(between / ss_total, 0.0, 1.0))
+    return np.where(ss_total > 1e-12, eta, np.nan), cell_means
+
+def _nanarg(matrix: np.ndarray, fn) -> np.ndarray:
+    has_data = ~np.all(np.isnan(matrix), axis=1)
+    result = np.full(matrix.shape[0], -1)
+    result[has_data] = fn(matrix[has_data], axis=1)
+    return result
+
+def compute_correlations(sources: Dict[str, pd.DataFrame], min_days: int = 7) -> Dict:
+    """
+    Correlate sentiment with time of day, weekday, meditation and chat
+    activity for every user in ``sources`` (see load_sources()).
+
+    Returns ``{"per_user": DataFrame, "cohort": dict}``. Per-user values
+    are computed for all users at once with grouped array operations; the
+    cohort values pool every user's data.
+    """
+    daily = sources["daily"]
+    hourly = sources["hourly"]
+    if daily.empty:
+        return {"per_user": pd.DataFrame(), "cohort": {"users": 0}}
+
+    users, user_index = np.unique(daily["user_id"].to_numpy(), return_inverse=True)
+    n_users = len(users)
+
+    # Day panel: one row per user-day with entries, activity columns filled with 0
+    panel = pd.DataFrame({
+        "user": user_index,
+        "day": pd.to_datetime(daily["day"]).to_numpy().astype("datetime64[D]"),
+        "sentiment": daily["sentiment_sum"].to_numpy(dtype=np.float64) / daily["record_count"].to_numpy(dtype=np.float64)
+    })
+    for name, columns in (("meditation", ["sessions", "duration"]), ("chat", ["messages"])):
+        previous_columns = [f"previous_{column}" for column in columns]
+        activity = sources.get(name)
+        if activity is None or activity.empty:
+            panel[columns + previous_columns] = 0.0
+            continue
+        activity = activity[activity["user_id"].isin(users)]
+        keyed = pd.DataFrame({
+            "user": np.searchsorted(users, activity["user_id"].to_numpy()),
+            "day": pd.to_datetime(activity["day"]).to_numpy().astype("datetime64[D]"),
+            **{column: activity[column].to_numpy(dtype=np.float64) for column in columns}
+        })
+        # The same activity shifted by a day gives previous-day values
+        previous = keyed.assign(day=keyed["day"] + np.timedelta64(1, "D"))
+        previous.columns = ["user", "day"] + previous_columns
+        panel = panel.merge(keyed, on=["user", "day"], how="left").merge(previous, on=["user", "day"], how="left")
+        panel[columns + previous_columns] = panel[columns + previous_columns].fillna(0.0)
+
+    groups = panel["user"].to_numpy()
+    sentiment = panel["sentiment"].to_numpy()
+    activity_columns = {
+        "meditation_sessions": "sessions",
+        "meditation_duration": "duration",
+        "meditation_next_day": "previous_sessions",
+        "chat_messages": "messages",
+        "chat_next_day": "previous_messages"
+    }
+
+    per_user = pd.DataFrame({"user_id": users})
+    per_user["days"] = np.bincount(groups, minlength=n_users)
+    per_user["records"] = np.bincount(user_index, daily["record_count"].to_numpy(dtype=np.float64), n_users).astype(int)
+    for name, column in activity_columns.items():
+        per_user[f"{name}_r"] = grouped_pearson(groups, panel[column].to_numpy(), sentiment, n_users, min_days)
+
+    cohort = {
+        "users": int(n_users),
+        "user_days": int(len(panel)),
+        "records": int(daily["record_count"].sum())
+    }
+    for name, column in activity_columns.items():
+        values = panel[column].to_numpy()
+        pooled = grouped_pearson(np.zeros(len(panel), dtype=np.int64), values, sentiment, 1, min_days)[0]
+        cohort[f"{name}_r"] = None if np.isnan(pooled) else round(float(pooled), 4)
+
+    # Hour of day and weekday, from the record-level hourly rollups
+    if not hourly.empty:
+        hourly = hourly[hourly["user_id"].isin(users)]
+        hourly_groups = np.searchsorted(users, hourly["user_id"].to_numpy())
+        count = hourly["record_count"].to_numpy(dtype=np.float64)
+        total = hourly["sentiment_sum"].to_numpy(dtype=np.float64)
+        total_sq = hourly["sentiment_sq_sum"].to_numpy(dtype=np.float64)
+        zeros = np.zeros(len(hourly), dtype=np.int64)
+
+        for name, column, n_categories in (("hour", "hour", 24), ("weekday", "dow", 7)):
+            categories = hourly[column].to_numpy().astype(np.int64)
+            eta, means = grouped_correlation_ratio(hourly_groups, categories, n_users, n_categories, count, total, total_sq)
+            per_user[f"{name}_eta"] = eta
+            per_user[f"best_{name}"] = _nanarg(means, np.nanargmax)
+            per_user[f"worst_{name}"] = _nanarg(means, np.nanargmin)
+
+            pooled_eta, pooled_means = grouped_correlation_ratio(zeros, categories, 1, n_categories, count, total, total_sq)
+            cohort[f"{name}_eta"] = None if np.isnan(pooled_eta[0]) else round(float(pooled_eta[0]), 4)
+            cohort[f"mean_sentiment_by_{name}"] = {
+                (WEEKDAYS[index] if name == "weekday" else index): round(float(value), 4)
+                for index, value in enumerate(pooled_means[0])
+                if not np.isnan(value)
+            }
+
+    for column in [c for c in per_user.columns if c.endswith("_r")]:
+        values = per_user[column].dropna()
+        cohort[f"{column[:-2]}_median_user_r"] = round(float(values.median()), 4) if not values.empty else None
+
+    return {"per_user": per_user, "cohort": cohort}
+
+def describe_user(per_user_row: pd.Series) -> Dict:
+    """Readable correlation summary for one row of compute_correlations()['per_user']."""
+    def value(name):
+        result = per_user_row.get(name)
+        return None if result is None or pd.isna(result) else round(float(result), 4)
+
+    def slot(name, labels=None):
+        index = int(per_user_row.get(name, -1))
+        if index < 0:
+            return None
+        return labels[index] if labels else f"{index}:00"
+
+    return {
+        "days": int(per_user_row["days"]),
+        "records": int(per_user_row["records"]),
+        "time_of_day": {
+            "correlation_ratio": value("hour_eta"),
+            "best_hour": slot("best_hour"),
+            "worst_hour": slot("worst_hour")
+        },
+        "day_of_week": {
+            "correlation_ratio": value("weekday_eta"),
+            "best_day": slot("best_weekday", WEEKDAYS),
+            "worst_day": slot("worst_weekday", WEEKDAYS)
+        },
+        "meditation": {
+            "sessions_same_day_r": value("meditation_sessions_r"),
+            "duration_same_day_r": value("meditation_duration_r"),
+            "sessions_previous_day_r": value("meditation_next_day_r")
+        },
+        "chat": {
+            "messages_same_day_r": value("chat_messages_r"),
+            "messages_previous_day_r": value("chat_next_day_r")
+        }
+    }
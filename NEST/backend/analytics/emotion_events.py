@@ -0,0 +1,300 @@
+"""
+Time-series store for high-frequency emotion samples (per chat message,
+per voice segment, ...) kept out of Postgres.
+
+Samples are grouped into one document per user and hour holding the
+count, sum, sum of squares, min and max of the sentiment scores, an
+emotion histogram and the samples themselves. Writing a batch is one
+upsert per touched bucket, and a 30-day range query reads at most 720
+documents per user however many samples they contain.
+
+Backends:
+    MongoEventBackend  - the ``emotion_event_buckets`` collection
+    FileEventBackend   - a local JSON file, for development and tests
+                         without MongoDB
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict
+from datetime import datetime, timezone
+from threading import Lock
+import copy
+import json
+import math
+import os
+import tempfile
+
+RESOLUTIONS = {"hour", "day"}
+
+def to_utc(timestamp: datetime) -> datetime:
+    """
+    Naive UTC, which is what buckets are keyed and stored by; aware
+    timestamps are converted, naive ones are taken to be UTC already.
+    """
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+def bucket_hour(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def bucket_id(user_id: int, hour: datetime) -> str:
+    return f"{user_id}:{hour.strftime('%Y%m%d%H')}"
+
+class _BucketUpdate:
+    """The samples of one batch that fall into one bucket, pre-aggregated."""
+
+    def __init__(self, user_id: int, hour: datetime):
+        self.user_id = user_id
+        self.hour = hour
+        self.count = 0
+        self.sentiment_sum = 0.0
+        self.sentiment_sq_sum = 0.0
+        self.sentiment_min = math.inf
+        self.sentiment_max = -math.inf
+        self.emotions: Dict[str, int] = defaultdict(int)
+        self.samples: List[Dict[str, Any]] = []
+
+    def add(self, timestamp: datetime, score: float, emotion: Optional[str], source: Optional[str]):
+        self.count += 1
+        self.sentiment_sum += score
+        self.sentiment_sq_sum += score * score
+        self.sentiment_min = min(self.sentiment_min, score)
+        self.sentiment_max = max(self.sentiment_max, score)
+        if emotion:
+            self.emotions[emotion] += 1
+        self.samples.append({"t": timestamp, "s": score, "e": emotion, "src": source})
+
+class MongoEventBackend:
+    """Buckets in a MongoDB collection, keyed by ``"<user_id>:<YYYYMMDDHH>"``."""
+
+    name = "mongo"
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexed = False
+
+    def ensure_indexes(self):
+        if not self._indexed:
+            self.collection.create_index([("user_id", 1), ("hour", 1)])
+            self._indexed = True
+
+    def upsert(self, updates: List[_BucketUpdate]):
+        from pymongo import UpdateOne
+
+        self.ensure_indexes()
+        operations = [
+            UpdateOne(
+                {"_id": bucket_id(update.user_id, update.hour)},
+                {
+                    "$setOnInsert": {"user_id": update.user_id, "hour": update.hour},
+                    "$inc": {
+                        "count": update.count,
+                        "sentiment.sum": update.sentiment_sum,
+                        "sentiment.sq_sum": update.sentiment_sq_sum,
+                        **{f"emotions.{emotion}": n for emotion, n in update.emotions.items()}
+                    },
+                    "$min": {"sentiment.min": update.sentiment_min},
+                    "$max": {"sentiment.max": update.sentiment_max},
+                    "$push": {"samples": {"$each": update.samples}}
+                },
+                upsert=True
+            )
+            for update in updates
+        ]
+        # Buckets are independent, so an unordered batch lets the server
+        # apply them in parallel and keep going past a failed one
+        self.collection.bulk_write(operations, ordered=False)
+
+    def find(self, user_id: int, start: datetime, end: datetime, with_samples: bool) -> List[Dict]:
+        self.ensure_indexes()
+        projection = None if with_samples else {"samples": 0}
+        return list(self.collection.find(
+            {"user_id": user_id, "hour": {"$gte": start, "$lt": end}},
+            projection
+        ).sort("hour", 1))
+
+class FileEventBackend:
+    """
+    Buckets kept in memory and saved to a JSON file after every batch
+    (written to a temporary file and renamed, so a crash never leaves a
+    truncated file). Meant for development and offline tests.
+    """
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        self._buckets: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for doc in json.load(f):
+                    doc["hour"] = to_utc(datetime.fromisoformat(doc["hour"]))
+                    for sample in doc["samples"]:
+                        sample["t"] = to_utc(datetime.fromisoformat(sample["t"]))
+                    self._buckets[doc["_id"]] = doc
+
+    def upsert(self, updates: List[_BucketUpdate]):
+        with self._lock:
+            for update in updates:
+                key = bucket_id(update.user_id, update.hour)
+                doc = self._buckets.get(key)
+                if doc is None:
+                    doc = self._buckets[key] = {
+                        "_id": key,
+                        "user_id": update.user_id,
+                        "hour": update.hour,
+                        "count": 0,
+                        "sentiment": {"sum": 0.0, "sq_sum": 0.0, "min": math.inf, "max": -math.inf},
+                        "emotions": {},
+                        "samples": []
+                    }
+                sentiment = doc["sentiment"]
+                doc["count"] += update.count
+                sentiment["sum"] += update.sentiment_sum
+                sentiment["sq_sum"] += update.sentiment_sq_sum
+                sentiment["min"] = min(sentiment["min"], update.sentiment_min)
+                sentiment["max"] = max(sentiment["max"], update.sentiment_max)
+                for emotion, n in update.emotions.items():
+                    doc["emotions"][emotion] = doc["emotions"].get(emotion, 0) + n
+                doc["samples"].extend(update.samples)
+            self._save()
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(list(self._buckets.values()), f, default=lambda value: value.isoformat())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def find(self, user_id: int, start: datetime, end: datetime, with_samples: bool) -> List[Dict]:
+        with self._lock:
+            docs = [
+                copy.deepcopy(doc) if with_samples else {k: copy.deepcopy(v) for k, v in doc.items() if k != "samples"}
+                for doc in self._buckets.values()
+                if doc["user_id"] == user_id and start <= doc["hour"] < end
+            ]
+        return sorted(docs, key=lambda doc: doc["hour"])
+
+def _summarize(time_key: str, time_value: datetime, docs: List[Dict]) -> Dict:
+    count = sum(doc["count"] for doc in docs)
+    total = sum(doc["sentiment"]["sum"] for doc in docs)
+    sq_total = sum(doc["sentiment"]["sq_sum"] for doc in docs)
+    emotions: Dict[str, int] = defaultdict(int)
+    for doc in docs:
+        for emotion, n in doc.get("emotions", {}).items():
+            emotions[emotion] += n
+    mean = total / count
+    std = math.sqrt(max(sq_total - total * mean, 0.0) / (count - 1)) if count > 1 else None
+    return {
+        time_key: time_value.isoformat(),
+        "count": count,
+        "sentiment_mean": mean,
+        "sentiment_std": std,
+        "sentiment_min": min(doc["sentiment"]["min"] for doc in docs),
+        "sentiment_max": max(doc["sentiment"]["max"] for doc in docs),
+        "emotions": dict(sorted(emotions.items(), key=lambda item: (-item[1], item[0])))
+    }
+
+class EmotionEventStore:
+    """Per-user, per-hour buckets of emotion samples; see the module docstring."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def record_events(self, events: Iterable[Dict]) -> Dict[str, int]:
+        """
+        Add samples, each a dict with ``user_id``, ``timestamp``,
+        ``sentiment_score`` and optionally ``dominant_emotion`` and
+        ``source``. Samples without a score are skipped. Timestamps are
+        stored as naive UTC (see to_utc).
+
+        The batch is aggregated per bucket first and written with one bulk
+        upsert, so its cost grows with the buckets touched, not the samples.
+        """
+        updates: Dict[Tuple[int, datetime], _BucketUpdate] = {}
+        recorded = 0
+        for event in events:
+            score = event.get("sentiment_score")
+            if score is None:
+                continue
+            timestamp = to_utc(event.get("timestamp") or datetime.utcnow())
+            key = (int(event["user_id"]), bucket_hour(timestamp))
+            update = updates.get(key)
+            if update is None:
+                update = updates[key] = _BucketUpdate(*key)
+            update.add(timestamp, float(score), event.get("dominant_emotion"), event.get("source"))
+            recorded += 1
+
+        if updates:
+            self.backend.upsert(list(updates.values()))
+        return {"events": recorded, "buckets": len(updates)}
+
+    def get_buckets(
+        self,
+        user_id: int,
+        start: datetime,
+        end: datetime,
+        with_samples: bool = False
+    ) -> List[Dict]:
+        """Bucket documents of the hours overlapping ``[start, end)``, oldest first."""
+        return self.backend.find(user_id, bucket_hour(to_utc(start)), to_utc(end), with_samples)
+
+    def get_samples(self, user_id: int, start: datetime, end: datetime) -> List[Dict]:
+        """Individual samples within ``[start, end)``, oldest first."""
+        start, end = to_utc(start), to_utc(end)
+        samples = [
+            sample
+            for doc in self.get_buckets(user_id, start, end, with_samples=True)
+            for sample in doc["samples"]
+            if start <= sample["t"] < end
+        ]
+        return sorted(samples, key=lambda sample: sample["t"])
+
+    def get_summary(
+        self,
+        user_id: int,
+        start: datetime,
+        end: datetime,
+        resolution: str = "hour"
+    ) -> List[Dict]:
+        """
+        Count, mean, std, min, max and emotion histogram per hour or day,
+        computed from the bucket aggregates alone (samples are not read).
+        Ranges are widened to whole hours.
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {sorted(RESOLUTIONS)}")
+        groups: Dict[datetime, List[Dict]] = defaultdict(list)
+        for doc in self.get_buckets(user_id, start, end):
+            key = doc["hour"] if resolution == "hour" else doc["hour"].replace(hour=0)
+            groups[key].append(doc)
+        return [_summarize(resolution, key, docs) for key, docs in sorted(groups.items())]
+
+_event_store: Optional[EmotionEventStore] = None
+_event_store_lock = Lock()
+
+def get_emotion_event_store() -> EmotionEventStore:
+    """
+    Return the process-wide emotion event store.
+
+    EMOTION_EVENT_BACKEND=file keeps buckets in EMOTION_EVENT_FILE
+    (default ``data/emotion_events.json``) instead of the
+    ``emotion_event_buckets`` MongoDB collection.
+    """
+    global _event_store
+    if _event_store is None:
+        with _event_store_lock:
+            if _event_store is None:
+                if os.getenv("EMOTION_EVENT_BACKEND", "mongo").lower() == "file":
+                    backend = FileEventBackend(os.getenv("EMOTION_EVENT_FILE", "data/emotion_events.json"))
+                else:
+                    from database import get_mongo_db
+                    backend = MongoEventBackend(get_mongo_db()["emotion_event_buckets"])
+                _event_store = EmotionEventStore(backend)
+    return _event_store
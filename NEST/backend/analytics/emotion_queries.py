@@ -0,0 +1,57 @@
+from typing import Optional
+from datetime import datetime
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import pandas as pd
+import models
+
+# Only these typed columns are selected, so the rest of the row
+# (text_content, the full emotion_data blob) is never transferred or
+# hydrated into ORM objects. Together with user_id and timestamp they are
+# covered by ix_emotion_records_user_id_timestamp.
+_record = models.EmotionRecord
+sentiment_score = _record.sentiment_score
+dominant_emotion = _record.dominant_emotion
+
+def _in_range(stmt: Select, user_id: int, start: Optional[datetime], end: Optional[datetime]) -> Select:
+    # Records that were never analysed carry no sentiment and are skipped
+    stmt = stmt.where(_record.user_id == user_id, sentiment_score.is_not(None))
+    if start is not None:
+        stmt = stmt.where(_record.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(_record.timestamp <= end)
+    return stmt
+
+def to_frame(result) -> pd.DataFrame:
+    """DataFrame of a sync or async query result, one column per selected label."""
+    return pd.DataFrame(result.all(), columns=list(result.keys()))
+
+def _frame(db: Session, stmt: Select) -> pd.DataFrame:
+    return to_frame(db.execute(stmt))
+
+def emotion_points_query(user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Select:
+    stmt = select(
+        _record.timestamp.label("timestamp"),
+        dominant_emotion.label("dominant_emotion"),
+        sentiment_score.label("sentiment_score")
+    )
+    return _in_range(stmt, user_id, start, end).order_by(_record.timestamp)
+
+def emotion_points(
+    db: Session,
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> pd.DataFrame:
+    """Timestamp, dominant emotion and sentiment score of each record, oldest first."""
+    return _frame(db, emotion_points_query(user_id, start, end))
+
+async def emotion_points_async(
+    db: AsyncSession,
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> pd.DataFrame:
+    """emotion_points() for an AsyncSession."""
+    return to_frame(await db.execute(emotion_points_query(user_id, start, end)))
@@ -0,0 +1,171 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+from sqlalchemy import literal_column, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Column of each rollup table holding its time bucket, and the matching
+# date_trunc() unit used when rebuilding from emotion_records
+_BUCKETS = {
+    models.EmotionDailyRollup: ("day", "day"),
+    models.EmotionHourlyRollup: ("hour", "hour")
+}
+
+def _bucket_value(model, timestamp: datetime):
+    if model is models.EmotionDailyRollup:
+        return timestamp.date()
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def _aggregate(model, user_id: int, points: List[Tuple[datetime, float, Optional[str]]]) -> List[Dict]:
+    """Sum the points per bucket so each bucket is upserted once."""
+    bucket_column = _BUCKETS[model][0]
+    rows: Dict = {}
+    for timestamp, sentiment, emotion in points:
+        bucket = _bucket_value(model, timestamp)
+        row = rows.get(bucket)
+        if row is None:
+            row = rows[bucket] = {
+                "user_id": user_id,
+                bucket_column: bucket,
+                "record_count": 0,
+                "sentiment_sum": 0.0,
+                "sentiment_sq_sum": 0.0,
+                "emotion_counts": {}
+            }
+        row["record_count"] += 1
+        row["sentiment_sum"] += sentiment
+        row["sentiment_sq_sum"] += sentiment * sentiment
+        if emotion:
+            row["emotion_counts"][emotion] = row["emotion_counts"].get(emotion, 0) + 1
+    return list(rows.values())
+
+def _upsert(model, rows: List[Dict]):
+    table = model.__table__
+    bucket_column = _BUCKETS[model][0]
+    stmt = insert(table).values(rows)
+    excluded = stmt.excluded
+
+    # Add the new histogram to the stored one key by key:
+    # counts || {key: counts[key] + added[key] for key in added}
+    merged = literal_column(
+        "(SELECT COALESCE(jsonb_object_agg(added.key, "
+        f"COALESCE(({table.name}.emotion_counts->>added.key)::int, 0) + added.value::int), '{{}}'::jsonb) "
+        "FROM jsonb_each_text(excluded.emotion_counts) AS added)"
+    )
+
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c[bucket_column]],
+        set_={
+            "record_count": table.c.record_count + excluded.record_count,
+            "sentiment_sum": table.c.sentiment_sum + excluded.sentiment_sum,
+            "sentiment_sq_sum": table.c.sentiment_sq_sum + excluded.sentiment_sq_sum,
+            "emotion_counts": table.c.emotion_counts.op("||")(merged)
+        }
+    )
+
+def rollup_statements(user_id: int, records: Iterable[Tuple[datetime, Optional[Dict]]]) -> List:
+    """
+    Upsert statements adding ``(timestamp, emotion_data)`` pairs of one
+    user to the daily and hourly rollups, one multi-row upsert per table.
+    Records without a sentiment score are not rolled up.
+    """
+    points = [
+        (timestamp, float(emotion_data["sentiment_score"]), emotion_data.get("dominant_emotion"))
+        for timestamp, emotion_data in records
+        if emotion_data and emotion_data.get("sentiment_score") is not None
+    ]
+    if not points:
+        return []
+    return [_upsert(model, _aggregate(model, user_id, points)) for model in _BUCKETS]
+
+def apply_records(db: Session, user_id: int, records: Iterable[Tuple[datetime, Optional[Dict]]]):
+    """
+    Add the records to the rollups (see rollup_statements()) in the
+    caller's transaction, so the rollups commit together with the records.
+    """
+    for stmt in rollup_statements(user_id, records):
+        db.execute(stmt)
+
+async def apply_records_async(db: AsyncSession, user_id: int, records: Iterable[Tuple[datetime, Optional[Dict]]]):
+    """apply_records() for an AsyncSession."""
+    for stmt in rollup_statements(user_id, records):
+        await db.execute(stmt)
+
+def apply_record(db: Session, user_id: int, timestamp: datetime, emotion_data: Optional[Dict]):
+    """Add one emotion record to the rollups; see apply_records()."""
+    apply_records(db, user_id, [(timestamp, emotion_data)])
+
+_REBUILD_SQL = """
+INSERT INTO {table} (user_id, {bucket}, record_count, sentiment_sum, sentiment_sq_sum, emotion_counts)
+SELECT
+    user_id,
+    bucket,
+    SUM(n),
+    SUM(s),
+    SUM(ss),
+    COALESCE(jsonb_object_agg(emotion, n) FILTER (WHERE emotion IS NOT NULL), '{{}}'::jsonb)
+FROM (
+    SELECT
+        user_id,
+        date_trunc('{unit}', timestamp) AS bucket,
+        dominant_emotion AS emotion,
+        COUNT(*) AS n,
+        SUM(sentiment_score) AS s,
+        SUM(sentiment_score * sentiment_score) AS ss
+    FROM emotion_records
+    WHERE sentiment_score IS NOT NULL {user_filter}
+    GROUP BY 1, 2, 3
+) per_emotion
+GROUP BY user_id, bucket
+"""
+
+def rebuild_rollups(db: Session, user_id: Optional[int] = None):
+    """
+    Recompute the rollups from emotion_records, for one user or everyone.
+
+    Used for the initial backfill and to repair rollups after records were
+    edited or deleted outside record_emotion(). Reads the typed
+    sentiment_score/dominant_emotion columns, so run the
+    add_emotion_record_columns migration first on older databases.
+    """
+    params = {}
+    user_filter = ""
+    if user_id is not None:
+        user_filter = "AND user_id = :user_id"
+        params["user_id"] = user_id
+
+    for model, (bucket, unit) in _BUCKETS.items():
+        query = db.query(model)
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        query.delete(synchronize_session=False)
+        db.execute(
+            text(_REBUILD_SQL.format(
+                table=model.__tablename__,
+                bucket=bucket,
+                unit=unit,
+                user_filter=user_filter
+            )),
+            params
+        )
+    db.commit()
+    logger.info(f"Rebuilt emotion rollups for {'user ' + str(user_id) if user_id is not None else 'all users'}")
+
+if __name__ == "__main__":
+    from database import Base, SessionLocal, engine
+
+    logging.basicConfig(level=logging.INFO)
+    Base.metadata.create_all(
+        engine,
+        tables=[model.__table__ for model in _BUCKETS]
+    )
+    db = SessionLocal()
+    try:
+        rebuild_rollups(db)
+    finally:
+        db.close()
@@ -1,15 +1,75 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
+import time
+import asyncio
 import pandas as pd
-import numpy as np
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
 from ml.emotion_analyzer import EmotionAnalyzer
+from analytics.emotion_events import to_utc
+from analytics.emotion_rollups import apply_record, apply_records, apply_records_async
+from analytics import batch_reports, correlations, emotion_queries
+from analytics.report_cache import get_report_cache
+from exercises.recommender import invalidate_recommendations
+
+_BULK_INSERT = insert(models.EmotionRecord).returning(models.EmotionRecord.id, sort_by_parameter_order=True)
+
+def _emotion_columns(emotion_data: Optional[Dict]) -> Dict:
+    return {
+        "dominant_emotion": emotion_data.get("dominant_emotion") if emotion_data else None,
+        "sentiment_score": emotion_data.get("sentiment_score") if emotion_data else None
+    }
+
+def _analyze_texts(emotion_analyzer, texts: List[str]) -> List[Dict]:
+    # One batched model call when the analyzer supports it
+    analyze_batch = getattr(emotion_analyzer, "analyze_batch", None)
+    if analyze_batch is not None:
+        return list(analyze_batch(texts))
+    return [emotion_analyzer.analyze_text(text) for text in texts]
+
+def _bulk_rows(emotion_analyzer, user_id: int, entries: List[Dict]) -> Tuple[List[Dict], int]:
+    """Analyze the entries lacking emotion_data and build the insert rows."""
+    pending = [
+        index for index, entry in enumerate(entries)
+        if not entry.get("emotion_data") and entry.get("text_content")
+    ]
+    analyzed = _analyze_texts(emotion_analyzer, [entries[index]["text_content"] for index in pending]) if pending else []
+    emotion_results = [entry.get("emotion_data") for entry in entries]
+    for index, emotion_data in zip(pending, analyzed):
+        emotion_results[index] = emotion_data
+    
+    now = datetime.utcnow()
+    rows = [
+        {
+            "user_id": user_id,
+            # Aware client timestamps would otherwise land in other
+            # daily/hourly buckets than the naive UTC ones
+            "timestamp": to_utc(entry["timestamp"]) if entry.get("timestamp") else now,
+            "text_content": entry.get("text_content"),
+            "voice_file_path": entry.get("voice_file_path"),
+            "emotion_data": emotion_data,
+            **_emotion_columns(emotion_data)
+        }
+        for entry, emotion_data in zip(entries, emotion_results)
+    ]
+    return rows, len(pending)
+
+def _bulk_result(record_ids: List[int], analyzed: int, start_time: float) -> Dict:
+    elapsed = time.perf_counter() - start_time
+    return {
+        "ids": record_ids,
+        "count": len(record_ids),
+        "analyzed": analyzed,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "rows_per_second": round(len(record_ids) / elapsed, 1) if elapsed > 0 else None
+    }
 
 class EmotionTracker:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, emotion_analyzer: Optional[EmotionAnalyzer] = None):
         self.db = db
-        self.emotion_analyzer = EmotionAnalyzer()
+        self.emotion_analyzer = emotion_analyzer or EmotionAnalyzer()
     
     def record_emotion(
         self,
@@ -28,15 +88,54 @@ class EmotionTracker:
             user_id=user_id,
             text_content=text_content,
             voice_file_path=voice_file_path,
-            emotion_data=emotion_data
+            emotion_data=emotion_data,
+            **_emotion_columns(emotion_data)
         )
         
         self.db.add(record)
+        self.db.flush()
+        
+        # Keep the report rollups current in the same transaction
+        apply_record(self.db, user_id, record.timestamp, emotion_data)
         self.db.commit()
         self.db.refresh(record)
+        get_report_cache().invalidate_user(user_id)
+        invalidate_recommendations(user_id)
         
         return record
     
+    def record_emotions_bulk(
+        self,
+        user_id: int,
+        entries: List[Dict]
+    ) -> Dict:
+        """
+        Record many emotion entries for a user in one transaction.
+        
+        Each entry may carry ``text_content``, ``voice_file_path``,
+        ``emotion_data`` and ``timestamp`` (for entries written offline).
+        Entries without ``emotion_data`` are analyzed together in one batch,
+        and all rows are written with a single multi-row INSERT ... RETURNING.
+        
+        Returns the new record IDs, in input order, and the ingest rate.
+        """
+        start_time = time.perf_counter()
+        rows, analyzed = _bulk_rows(self.emotion_analyzer, user_id, entries)
+        
+        record_ids = []
+        if rows:
+            try:
+                record_ids = list(self.db.execute(_BULK_INSERT, rows).scalars())
+                apply_records(self.db, user_id, [(row["timestamp"], row["emotion_data"]) for row in rows])
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            get_report_cache().invalidate_user(user_id)
+            invalidate_recommendations(user_id)
+        
+        return _bulk_result(record_ids, analyzed, start_time)
+    
     def get_user_emotions(
         self,
         user_id: int,
@@ -57,138 +156,251 @@ class EmotionTracker:
         
         return query.order_by(models.EmotionRecord.timestamp).all()
     
+    def get_emotion_points(
+        self,
+        user_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> pd.DataFrame:
+        """
+        Get timestamp, dominant emotion and sentiment score for a date range
+        as a DataFrame, without loading full records
+        """
+        return emotion_queries.emotion_points(self.db, user_id, start_date, end_date)
+    
+    def get_emotion_report(
+        self,
+        user_id: int,
+        days: int = 30
+    ) -> Dict:
+        """
+        Get the emotion report for a user from the report cache, generating
+        it only when the user recorded emotions since it was cached
+        """
+        def build():
+            # The nightly batch report stays valid until the user records again
+            snapshot = batch_reports.load_snapshot(self.db, user_id, days)
+            if snapshot is not None:
+                return snapshot
+            return self.generate_emotion_report(user_id, days)
+        
+        return get_report_cache().get_or_build(user_id, days, build)
+    
     def generate_emotion_report(
         self,
         user_id: int,
         days: int = 30
     ) -> Dict:
         """
-        Generate a comprehensive emotion report for a user
+        Generate a comprehensive emotion report for a user from their
+        daily and hourly rollups
+        """
+        return batch_reports.build_user_report(self.db, user_id, days)
+    
+    def get_emotion_correlations(
+        self,
+        user_id: int,
+        days: int = 30
+    ) -> Dict:
+        """
+        Analyze correlations between emotions and other factors: time of
+        day, day of week, meditation sessions and chat activity
         """
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
         
-        records = self.get_user_emotions(user_id, start_date, end_date)
+        result = correlations.compute_correlations(
+            correlations.load_sources(self.db, start_date, user_ids=[user_id])
+        )
         
-        if not records:
+        if result["per_user"].empty:
             return {
                 "error": "No emotion records found for the specified period"
             }
         
-        # Convert records to DataFrame for analysis
-        df = pd.DataFrame([
-            {
-                "timestamp": record.timestamp,
-                "dominant_emotion": record.emotion_data["dominant_emotion"],
-                "sentiment_score": record.emotion_data["sentiment_score"]
-            }
-            for record in records
-        ])
-        
-        # Calculate daily averages
-        daily_stats = df.groupby(df["timestamp"].dt.date).agg({
-            "sentiment_score": ["mean", "std"],
-            "dominant_emotion": lambda x: x.mode().iloc[0] if not x.empty else None
-        }).reset_index()
-        
-        # Calculate emotion distribution
-        emotion_distribution = df["dominant_emotion"].value_counts(normalize=True).to_dict()
-        
-        # Calculate sentiment trends
-        sentiment_trend = df["sentiment_score"].rolling(window=7).mean().tolist()
+        return {
+            "period": {
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat()
+            },
+            **correlations.describe_user(result["per_user"].iloc[0])
+        }
+    
+    def get_cohort_correlations(
+        self,
+        user_ids: Optional[List[int]] = None,
+        days: int = 30
+    ) -> Dict:
+        """
+        Analyze emotion correlations across a cohort (every user when
+        ``user_ids`` is None), pooled and as the median per-user correlation
+        """
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=days)
         
-        # Generate insights
-        insights = self._generate_insights(df, daily_stats)
+        result = correlations.compute_correlations(
+            correlations.load_sources(self.db, start_date, user_ids=user_ids)
+        )
         
         return {
             "period": {
                 "start_date": start_date.isoformat(),
                 "end_date": end_date.isoformat()
             },
-            "summary": {
-                "total_records": len(records),
-                "average_sentiment": df["sentiment_score"].mean(),
-                "most_common_emotion": df["dominant_emotion"].mode().iloc[0],
-                "emotion_distribution": emotion_distribution
-            },
-            "trends": {
-                "daily_stats": daily_stats.to_dict(orient="records"),
-                "sentiment_trend": sentiment_trend
-            },
-            "insights": insights
+            **result["cohort"]
         }
+
+class AsyncEmotionTracker:
+    """
+    EmotionTracker for async endpoints, on an AsyncSession: queries await
+    the database instead of blocking the event loop, so one worker keeps
+    many of them in flight. Model inference runs in a worker thread.
+    """
     
-    def _generate_insights(
+    def __init__(self, db: AsyncSession, emotion_analyzer: Optional[EmotionAnalyzer] = None):
+        self.db = db
+        self.emotion_analyzer = emotion_analyzer or EmotionAnalyzer()
+    
+    async def record_emotion(
         self,
-        df: pd.DataFrame,
-        daily_stats: pd.DataFrame
-    ) -> List[Dict]:
-        """
-        Generate insights from emotion data
-        """
-        insights = []
-        
-        # Sentiment trend insight
-        recent_sentiment = df["sentiment_score"].tail(7).mean()
-        overall_sentiment = df["sentiment_score"].mean()
-        
-        if recent_sentiment > overall_sentiment:
-            insights.append({
-                "type": "positive_trend",
-                "message": "Your emotional state has been more positive recently"
-            })
-        elif recent_sentiment < overall_sentiment:
-            insights.append({
-                "type": "negative_trend",
-                "message": "Your emotional state has been more challenging recently"
-            })
-        
-        # Emotion consistency insight
-        emotion_consistency = df["dominant_emotion"].nunique() / len(df)
-        if emotion_consistency < 0.3:
-            insights.append({
-                "type": "emotion_consistency",
-                "message": "You've been experiencing consistent emotions recently"
-            })
-        
-        # Daily pattern insight
-        daily_patterns = df.groupby(df["timestamp"].dt.hour)["sentiment_score"].mean()
-        best_hour = daily_patterns.idxmax()
-        worst_hour = daily_patterns.idxmin()
-        
-        insights.append({
-            "type": "daily_pattern",
-            "message": f"You tend to feel best around {best_hour}:00 and most challenged around {worst_hour}:00"
-        })
-        
-        return insights
+        user_id: int,
+        text_content: Optional[str] = None,
+        voice_file_path: Optional[str] = None,
+        emotion_data: Optional[Dict] = None
+    ) -> models.EmotionRecord:
+        """
+        Record a new emotion entry for a user
+        """
+        if not emotion_data and text_content:
+            emotion_data = await asyncio.to_thread(self.emotion_analyzer.analyze_text, text_content)
+        
+        record = models.EmotionRecord(
+            user_id=user_id,
+            text_content=text_content,
+            voice_file_path=voice_file_path,
+            emotion_data=emotion_data,
+            **_emotion_columns(emotion_data)
+        )
+        
+        self.db.add(record)
+        await self.db.flush()
+        await apply_records_async(self.db, user_id, [(record.timestamp, emotion_data)])
+        await self.db.commit()
+        await self.db.refresh(record)
+        await get_report_cache().invalidate_user_async(user_id)
+        invalidate_recommendations(user_id)
+        
+        return record
     
-    def get_emotion_correlations(
+    async def record_emotions_bulk(
+        self,
+        user_id: int,
+        entries: List[Dict]
+    ) -> Dict:
+        """
+        Record many emotion entries for a user in one transaction; see
+        EmotionTracker.record_emotions_bulk()
+        """
+        start_time = time.perf_counter()
+        rows, analyzed = await asyncio.to_thread(_bulk_rows, self.emotion_analyzer, user_id, entries)
+        
+        record_ids = []
+        if rows:
+            try:
+                record_ids = list((await self.db.execute(_BULK_INSERT, rows)).scalars())
+                await apply_records_async(self.db, user_id, [(row["timestamp"], row["emotion_data"]) for row in rows])
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                raise
+            await get_report_cache().invalidate_user_async(user_id)
+            invalidate_recommendations(user_id)
+        
+        return _bulk_result(record_ids, analyzed, start_time)
+    
+    async def get_user_emotions(
+        self,
+        user_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> List[models.EmotionRecord]:
+        """
+        Get emotion records for a user within a date range
+        """
+        stmt = select(models.EmotionRecord).where(models.EmotionRecord.user_id == user_id)
+        if start_date:
+            stmt = stmt.where(models.EmotionRecord.timestamp >= start_date)
+        if end_date:
+            stmt = stmt.where(models.EmotionRecord.timestamp <= end_date)
+        
+        result = await self.db.execute(stmt.order_by(models.EmotionRecord.timestamp))
+        return list(result.scalars())
+    
+    async def get_emotion_points(
+        self,
+        user_id: int,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> pd.DataFrame:
+        """
+        Get timestamp, dominant emotion and sentiment score for a date range
+        as a DataFrame, without loading full records
+        """
+        return await emotion_queries.emotion_points_async(self.db, user_id, start_date, end_date)
+    
+    async def get_emotion_report(
         self,
         user_id: int,
         days: int = 30
     ) -> Dict:
         """
-        Analyze correlations between emotions and other factors
+        Get the emotion report for a user from the report cache, generating
+        it only when the user recorded emotions since it was cached
+        """
+        async def build():
+            snapshot = await batch_reports.load_snapshot_async(self.db, user_id, days)
+            if snapshot is not None:
+                return snapshot
+            return await self.generate_emotion_report(user_id, days)
+        
+        return await get_report_cache().get_or_build_async(user_id, days, build)
+    
+    async def generate_emotion_report(
+        self,
+        user_id: int,
+        days: int = 30
+    ) -> Dict:
+        """
+        Generate a comprehensive emotion report for a user from their
+        daily and hourly rollups
+        """
+        return await batch_reports.build_user_report_async(self.db, user_id, days)
+    
+    async def get_emotion_correlations(
+        self,
+        user_id: int,
+        days: int = 30
+    ) -> Dict:
+        """
+        Analyze correlations between emotions and other factors: time of
+        day, day of week, meditation sessions and chat activity
         """
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
         
-        records = self.get_user_emotions(user_id, start_date, end_date)
+        result = correlations.compute_correlations(
+            await correlations.load_sources_async(self.db, start_date, user_ids=[user_id])
+        )
         
-        if not records:
+        if result["per_user"].empty:
             return {
                 "error": "No emotion records found for the specified period"
             }
         
-        # TODO: Implement correlation analysis with other factors
-        # This could include:
-        # - Time of day
-        # - Day of week
-        # - Weather
-        # - Activity levels
-        # - Sleep patterns
-        
         return {
-            "message": "Correlation analysis not yet implemented"
-        } 
\ No newline at end of file
+            "period": {
+                "start_date": start_date.isoformat(),
+                "end_date": end_date.isoformat()
+            },
+            **correlations.describe_user(result["per_user"].iloc[0])
+        }
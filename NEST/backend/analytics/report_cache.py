@@ -0,0 +1,324 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+from threading import Lock
+import asyncio
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _CachedReport:
+    def __init__(self, report: Dict, version: int, created_at: float):
+        self.report = report
+        self.version = version
+        self.created_at = created_at
+
+class MemoryReportStore:
+    """
+    In-process LRU of reports plus per-user versions.
+
+    Only correct when a single process serves the API: invalidations made
+    by other processes are not seen (see get_report_cache()).
+
+    Versions come from one store-wide counter, so a bump always moves a
+    user past every version handed out before. That lets the version table
+    be an LRU of ``max_versions`` users: users not in it get the counter's
+    value at the last eviction, which is never lower than a version they
+    had, so a report built before an invalidation can never look current.
+    """
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_entries: int = 4096, max_versions: int = 65536):
+        self.max_entries = max_entries
+        self.max_versions = max_versions
+        self._reports: "OrderedDict[Tuple[int, int], _CachedReport]" = OrderedDict()
+        self._versions: "OrderedDict[int, int]" = OrderedDict()
+        self._counter = 0
+        self._evicted_version = 0
+        self._lock = Lock()
+
+    def bump(self, user_id: int):
+        with self._lock:
+            self._counter += 1
+            self._versions[user_id] = self._counter
+            self._versions.move_to_end(user_id)
+            while len(self._versions) > self.max_versions:
+                self._versions.popitem(last=False)
+                self._evicted_version = self._counter
+
+    def get(self, user_id: int, days: int) -> Tuple[Optional[_CachedReport], int]:
+        """Return the cached report (possibly outdated) and the user's current version."""
+        with self._lock:
+            cached = self._reports.get((user_id, days))
+            if cached is not None:
+                self._reports.move_to_end((user_id, days))
+            return cached, self._versions.get(user_id, self._evicted_version)
+
+    def put(self, user_id: int, days: int, cached: _CachedReport):
+        with self._lock:
+            self._reports[(user_id, days)] = cached
+            self._reports.move_to_end((user_id, days))
+            while len(self._reports) > self.max_entries:
+                self._reports.popitem(last=False)
+
+    def size(self) -> Optional[int]:
+        with self._lock:
+            return len(self._reports)
+
+class MongoReportStore:
+    """
+    Reports shared by every API process, one MongoDB document per user.
+
+    The document holds the user's version counter and their cached reports,
+    so a lookup is a single find_one and an invalidation a single $inc.
+    Reports are stored as JSON text because they contain NaN and numpy
+    values that BSON does not accept.
+    """
+
+    name = "mongo"
+    blocking = True
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def bump(self, user_id: int):
+        self.collection.update_one({"_id": user_id}, {"$inc": {"version": 1}}, upsert=True)
+
+    def get(self, user_id: int, days: int) -> Tuple[Optional[_CachedReport], int]:
+        doc = self.collection.find_one({"_id": user_id})
+        if not doc:
+            return None, 0
+        entry = doc.get("reports", {}).get(str(days))
+        cached = None
+        if entry is not None:
+            cached = _CachedReport(json.loads(entry["report"]), entry["version"], entry["created_at"])
+        return cached, doc.get("version", 0)
+
+    def put(self, user_id: int, days: int, cached: _CachedReport):
+        self.collection.update_one(
+            {"_id": user_id},
+            {"$set": {f"reports.{days}": {
+                "report": json.dumps(cached.report, default=str),
+                "version": cached.version,
+                "created_at": cached.created_at
+            }}},
+            upsert=True
+        )
+
+    def size(self) -> Optional[int]:
+        return None
+
+class ReportCache:
+    """
+    Cache of emotion reports keyed by ``(user_id, days)``.
+
+    Every user has a version counter that invalidate_user() increments
+    whenever they record an emotion; a report is fresh while it was built
+    at the current version and is younger than ``max_age`` seconds (the
+    report window moves with the clock). Only one caller rebuilds a given
+    report at a time: concurrent callers get the previous, stale report if
+    there is one (stale-while-revalidate) and otherwise wait for the
+    rebuild instead of running their own.
+    """
+
+    def __init__(self, store=None, max_age: float = 3600.0):
+        self.store = store or MemoryReportStore()
+        self.max_age = max_age
+        self._inflight: Dict[Tuple[int, int], Future] = {}
+        self._lock = Lock()
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "stale_served": 0,
+            "waits": 0,
+            "rebuilds": 0,
+            "invalidations": 0,
+            "errors": 0
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def _claim(self, key: Tuple[int, int], cached: Optional[_CachedReport], version: int):
+        """
+        Decide how to answer a lookup. Returns ``(report, inflight, future)``
+        with exactly one set: a report to return, another caller's rebuild
+        to wait for, or a future the caller must complete by building.
+        """
+        if (
+            cached is not None
+            and cached.version == version
+            and time.time() - cached.created_at < self.max_age
+        ):
+            self._count("hits")
+            return cached.report, None, None
+
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                future: Future = Future()
+                self._inflight[key] = future
+                self._metrics["misses"] += 1
+                return None, None, future
+            if cached is not None:
+                self._metrics["stale_served"] += 1
+                return cached.report, None, None
+            self._metrics["waits"] += 1
+            return None, inflight, None
+
+    def _store_report(self, user_id: int, days: int, version: int, report: Dict):
+        self._count("rebuilds")
+        # Tagged with the version read before building: if the user
+        # recorded an emotion meanwhile, the entry is already outdated
+        try:
+            self.store.put(user_id, days, _CachedReport(report, version, time.time()))
+        except Exception as e:
+            logger.error(f"Error writing report cache: {str(e)}")
+            self._count("errors")
+
+    def _release(self, key: Tuple[int, int], future: Future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def get_or_build(self, user_id: int, days: int, build: Callable[[], Dict]) -> Dict:
+        """Return the cached report, calling ``build()`` when it is missing or outdated."""
+        key = (user_id, days)
+        try:
+            cached, version = self.store.get(user_id, days)
+        except Exception as e:
+            # A shared-store outage degrades to building every report
+            logger.error(f"Error reading report cache: {str(e)}")
+            self._count("errors")
+            return build()
+
+        report, inflight, future = self._claim(key, cached, version)
+        if future is None:
+            if inflight is None:
+                return report
+            try:
+                return inflight.result()
+            except CancelledError:
+                # The request building it was cancelled: build it ourselves
+                return self.get_or_build(user_id, days, build)
+
+        try:
+            report = build()
+            self._store_report(user_id, days, version, report)
+            future.set_result(report)
+            return report
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._release(key, future)
+
+    async def _run_store(self, fn: Callable, *args):
+        # Stores doing network I/O run in a thread to keep the event loop free
+        if getattr(self.store, "blocking", False):
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def get_or_build_async(self, user_id: int, days: int, build: Callable[[], Awaitable[Dict]]) -> Dict:
+        """get_or_build() for async callers: ``build`` is a coroutine function."""
+        key = (user_id, days)
+        try:
+            cached, version = await self._run_store(self.store.get, user_id, days)
+        except Exception as e:
+            logger.error(f"Error reading report cache: {str(e)}")
+            self._count("errors")
+            return await build()
+
+        report, inflight, future = self._claim(key, cached, version)
+        if future is None:
+            if inflight is None:
+                return report
+            try:
+                # Shielded so a cancelled waiter does not cancel the shared future
+                return await asyncio.shield(asyncio.wrap_future(inflight))
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The request building it was cancelled: build it ourselves
+                return await self.get_or_build_async(user_id, days, build)
+
+        try:
+            report = await build()
+            await self._run_store(self._store_report, user_id, days, version, report)
+            future.set_result(report)
+            return report
+        except asyncio.CancelledError:
+            # Only this request was cancelled: release the claim so waiters
+            # retry the build instead of receiving the cancellation
+            self._release(key, future)
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._release(key, future)
+
+    def invalidate_user(self, user_id: int):
+        """Mark every cached report of ``user_id`` as outdated."""
+        try:
+            self.store.bump(user_id)
+            self._count("invalidations")
+        except Exception as e:
+            logger.error(f"Error invalidating report cache for user {user_id}: {str(e)}")
+            self._count("errors")
+
+    async def invalidate_user_async(self, user_id: int):
+        """invalidate_user() for async callers."""
+        await self._run_store(self.invalidate_user, user_id)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return hit-rate and rebuild counters."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["inflight"] = len(self._inflight)
+        lookups = metrics["hits"] + metrics["misses"] + metrics["stale_served"] + metrics["waits"]
+        metrics["hit_rate"] = (metrics["hits"] + metrics["stale_served"]) / lookups if lookups else 0.0
+        metrics["backend"] = self.store.name
+        metrics["entries"] = self.store.size()
+        metrics["max_age"] = self.max_age
+        return metrics
+
+_report_cache: Optional[ReportCache] = None
+_report_cache_lock = Lock()
+
+def get_report_cache() -> ReportCache:
+    """
+    Return the process-wide report cache.
+
+    REPORT_CACHE_BACKEND=mongo shares reports and invalidations between
+    processes through the ``emotion_report_cache`` collection; =memory
+    keeps them in process memory, which is only correct for a single API
+    process. Deployments with several replicas must set mongo (the
+    Kubernetes manifest does). Unset, the backend is mongo when uvicorn
+    runs several workers (WEB_CONCURRENCY > 1) and memory otherwise, and
+    memory is refused with several workers.
+    """
+    global _report_cache
+    if _report_cache is None:
+        with _report_cache_lock:
+            if _report_cache is None:
+                max_age = float(os.getenv("REPORT_CACHE_MAX_AGE", "3600"))
+                workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+                backend = os.getenv("REPORT_CACHE_BACKEND", "mongo" if workers > 1 else "memory").lower()
+                if backend == "memory" and workers > 1:
+                    logger.warning(f"REPORT_CACHE_BACKEND=memory is per process; using mongo for {workers} workers")
+                    backend = "mongo"
+                if backend == "mongo":
+                    from database import get_mongo_db
+                    store = MongoReportStore(get_mongo_db()["emotion_report_cache"])
+                else:
+                    store = MemoryReportStore(int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "4096")))
+                _report_cache = ReportCache(store, max_age=max_age)
+    return _report_cache
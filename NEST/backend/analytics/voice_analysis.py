@@ -0,0 +1,486 @@
+"""
+Background analysis of uploaded voice recordings.
+
+Completed uploads create an EmotionRecord with ``voice_file_path`` set
+and ``emotion_data`` NULL. VoiceAnalysisPipeline picks such records up in
+batches on a worker thread:
+
+1. decode each recording to 16 kHz mono (WAV natively, other formats
+   through ffmpeg),
+2. extract acoustic features for the whole batch at once (energy, zero
+   crossings, spectral centroid, pitch, voiced ratio),
+3. run emotion analysis in one call: the analyzer's
+   ``analyze_voice_batch`` when it has one, otherwise the transcripts
+   through the text model,
+4. write all results with one executemany UPDATE plus the rollup upserts.
+
+Steps 1-3 run outside any transaction. A batch is first claimed in a
+short one: SELECT ... FOR UPDATE SKIP LOCKED picks rows no other replica
+is claiming and ``voice_claimed_until`` is set to a lease ``lease``
+seconds ahead, so several replicas can run the pipeline without
+analyzing a record twice and no connection is held while decoding.
+Results are written only to rows still carrying this claim. Recordings
+that cannot be decoded get a ``voice_error`` and are done; transient
+failures (a decoder timeout, a file that is not in place yet) leave the
+record pending, to be retried once the lease runs out. So does a missing
+ffmpeg binary: that is a deployment problem, not one of the recording. The queue is only
+a hint: records that were never queued (full queue, restart, lapsed
+lease) are found again by recover(), which runs at start and every
+``recover_interval`` seconds.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Event, Lock, Thread
+import queue
+import shutil
+import subprocess
+import time
+import wave
+import numpy as np
+from sqlalchemy import bindparam, or_, select, update
+import models
+from analytics.emotion_rollups import apply_records
+from analytics.emotion_tracker import _analyze_texts
+from analytics.report_cache import get_report_cache
+from exercises.recommender import invalidate_recommendations
+import logging
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+FRAME_LENGTH = 400  # 25 ms
+HOP_LENGTH = 160  # 10 ms
+FFT_SIZE = 1024
+# Pitch search range; lags are in samples at SAMPLE_RATE
+MIN_PITCH_HZ = 60
+MAX_PITCH_HZ = 400
+# Only the start of long recordings is analyzed, which bounds memory per batch
+MAX_SECONDS = 120
+# Frames per FFT block when processing a batch
+FRAME_BLOCK = 8192
+
+_WAV_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+class UnsupportedAudio(Exception):
+    pass
+
+class DecoderUnavailable(Exception):
+    """ffmpeg is not installed, so non-WAV recordings cannot be decoded."""
+
+# Failures worth retrying later; anything else means the recording is unusable
+_TRANSIENT_ERRORS = (subprocess.TimeoutExpired, OSError)
+
+def _read_wav(path: Path) -> Tuple[np.ndarray, int]:
+    with wave.open(str(path), "rb") as f:
+        width = f.getsampwidth()
+        if width not in _WAV_DTYPES:
+            raise UnsupportedAudio(f"{width * 8}-bit WAV is not supported")
+        rate = f.getframerate()
+        channels = f.getnchannels()
+        frames = f.readframes(min(f.getnframes(), MAX_SECONDS * rate))
+    samples = np.frombuffer(frames, dtype=_WAV_DTYPES[width]).astype(np.float32)
+    if width == 1:
+        samples = samples - 128.0
+    samples /= float(2 ** (8 * width - 1))
+    return samples.reshape(-1, channels).mean(axis=1), rate
+
+def _read_ffmpeg(path: Path) -> np.ndarray:
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise DecoderUnavailable(f"Decoding {path.suffix} files needs ffmpeg")
+    result = subprocess.run(
+        [ffmpeg, "-v", "error", "-t", str(MAX_SECONDS), "-i", str(path),
+         "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"],
+        capture_output=True,
+        timeout=60
+    )
+    if result.returncode != 0:
+        raise UnsupportedAudio(result.stderr.decode("utf-8", "replace").strip() or "ffmpeg failed")
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+def decode_audio(path: Path) -> np.ndarray:
+    """Mono float32 samples at SAMPLE_RATE (at most MAX_SECONDS of them)."""
+    if not path.exists():
+        # Checked here so ffmpeg's error for a missing input is never
+        # mistaken for an undecodable recording
+        raise FileNotFoundError(f"No such file: {path}")
+    if path.suffix.lower() != ".wav":
+        return _read_ffmpeg(path)
+    samples, rate = _read_wav(path)
+    if rate != SAMPLE_RATE and len(samples):
+        # Linear resampling is plenty for these features
+        positions = np.arange(0, len(samples), rate / SAMPLE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+def _frames(samples: np.ndarray) -> np.ndarray:
+    if len(samples) < FRAME_LENGTH:
+        samples = np.pad(samples, (0, FRAME_LENGTH - len(samples)))
+    return np.lib.stride_tricks.sliding_window_view(samples, FRAME_LENGTH)[::HOP_LENGTH]
+
+def extract_features(recordings: List[np.ndarray]) -> List[Dict[str, Optional[float]]]:
+    """
+    Acoustic features of each recording. The frames of the whole batch are
+    stacked and processed together, FRAME_BLOCK frames per FFT.
+    """
+    frames = [_frames(samples) for samples in recordings]
+    counts = np.array([len(f) for f in frames])
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    total = int(offsets[-1])
+
+    rms = np.empty(total, dtype=np.float32)
+    zcr = np.empty(total, dtype=np.float32)
+    centroid = np.empty(total, dtype=np.float32)
+    pitch = np.empty(total, dtype=np.float32)
+    window = np.hanning(FRAME_LENGTH).astype(np.float32)
+    freqs = np.fft.rfftfreq(FFT_SIZE, 1.0 / SAMPLE_RATE).astype(np.float32)
+    min_lag, max_lag = SAMPLE_RATE // MAX_PITCH_HZ, SAMPLE_RATE // MIN_PITCH_HZ
+
+    stacked = [(start, f) for start, f in zip(offsets[:-1], frames)]
+    block_start = 0
+    while block_start < total:
+        block_end = min(block_start + FRAME_BLOCK, total)
+        parts = []
+        for start, f in stacked:
+            lo, hi = max(block_start - start, 0), min(block_end - start, len(f))
+            if lo < hi:
+                parts.append(f[lo:hi])
+        block = np.concatenate(parts).astype(np.float32)
+        block = block - block.mean(axis=1, keepdims=True)
+
+        rms[block_start:block_end] = np.sqrt(np.mean(block ** 2, axis=1))
+        zcr[block_start:block_end] = np.mean(np.abs(np.diff(np.signbit(block), axis=1)), axis=1)
+        spectrum = np.abs(np.fft.rfft(block * window, n=FFT_SIZE, axis=1)) ** 2
+        power = spectrum.sum(axis=1)
+        centroid[block_start:block_end] = np.divide(spectrum @ freqs, power, out=np.zeros_like(power), where=power > 0)
+        # Autocorrelation is the inverse FFT of the power spectrum
+        autocorr = np.fft.irfft(spectrum, n=FFT_SIZE, axis=1)[:, min_lag:max_lag]
+        pitch[block_start:block_end] = SAMPLE_RATE / (min_lag + np.argmax(autocorr, axis=1))
+        block_start = block_end
+
+    results = []
+    for index, samples in enumerate(recordings):
+        start, end = offsets[index], offsets[index + 1]
+        frame_rms = rms[start:end]
+        # Voiced: clearly above the recording's noise floor, or for
+        # recordings without pauses, at least half the loudest level
+        threshold = max(min(float(np.percentile(frame_rms, 10)) * 3.0, float(frame_rms.max()) * 0.5), 1e-3)
+        voiced = frame_rms > threshold
+        voiced_pitch = pitch[start:end][voiced]
+        results.append({
+            "duration_seconds": round(len(samples) / SAMPLE_RATE, 2),
+            "rms_mean": round(float(frame_rms.mean()), 5),
+            "rms_std": round(float(frame_rms.std()), 5),
+            "zero_crossing_rate": round(float(zcr[start:end].mean()), 5),
+            "spectral_centroid_hz": round(float(centroid[start:end][voiced].mean()), 1) if voiced.any() else None,
+            "pitch_mean_hz": round(float(voiced_pitch.mean()), 1) if voiced.any() else None,
+            "pitch_std_hz": round(float(voiced_pitch.std()), 1) if voiced.any() else None,
+            "voiced_ratio": round(float(voiced.mean()), 3)
+        })
+    return results
+
+def analyze_recordings(emotion_analyzer, items: List[Dict]) -> List[Optional[Dict]]:
+    """
+    ``emotion_data`` for each ``{"path", "text_content"}`` item. A
+    recording that cannot be decoded gets ``{"voice_error": ...}`` so it
+    is not picked up again; one that failed for a transient reason gets
+    None. A missing file counts as transient unless the item has
+    ``"missing_is_final": True``. Without ffmpeg, non-WAV recordings get
+    None as well.
+    """
+    decoded, errors, transient = [], {}, set()
+    decoder_error = None
+    for index, item in enumerate(items):
+        try:
+            decoded.append((index, decode_audio(item["path"])))
+        except DecoderUnavailable as e:
+            decoder_error = e
+            transient.add(index)
+        except _TRANSIENT_ERRORS as e:
+            if isinstance(e, FileNotFoundError) and item.get("missing_is_final"):
+                errors[index] = str(e)
+            else:
+                logger.warning(f"Retrying {item['path']} later: {str(e)}")
+                transient.add(index)
+        except Exception as e:
+            errors[index] = str(e) or type(e).__name__
+    if decoder_error is not None:
+        logger.error(f"Leaving voice recordings pending: {str(decoder_error)}")
+
+    features = dict(zip([index for index, _ in decoded], extract_features([samples for _, samples in decoded]))) if decoded else {}
+
+    analyzed: Dict[int, Dict] = {}
+    analyze_voice_batch = getattr(emotion_analyzer, "analyze_voice_batch", None)
+    if analyze_voice_batch is not None and features:
+        indexes = list(features)
+        analyzed = dict(zip(indexes, analyze_voice_batch(
+            [features[index] for index in indexes],
+            [items[index].get("text_content") for index in indexes]
+        )))
+    else:
+        # Transcribed on the device: analyze the text in one batch
+        indexes = [index for index, item in enumerate(items) if item.get("text_content") and index not in transient]
+        if indexes:
+            analyzed = dict(zip(indexes, _analyze_texts(emotion_analyzer, [items[index]["text_content"] for index in indexes])))
+
+    results = []
+    for index in range(len(items)):
+        if index in transient:
+            results.append(None)
+            continue
+        emotion_data = dict(analyzed.get(index) or {})
+        emotion_data["source"] = "voice"
+        if index in features:
+            emotion_data["voice_features"] = features[index]
+        if index in errors:
+            emotion_data["voice_error"] = errors[index]
+        results.append(emotion_data)
+    return results
+
+_FILL_RECORD = (
+    update(models.EmotionRecord.__table__)
+    .where(models.EmotionRecord.__table__.c.id == bindparam("b_id"))
+    .values(
+        emotion_data=bindparam("b_emotion_data"),
+        dominant_emotion=bindparam("b_dominant_emotion"),
+        sentiment_score=bindparam("b_sentiment_score"),
+        voice_claimed_until=None
+    )
+)
+
+def _pending(now: datetime, *columns):
+    # Voice records the pipeline has not filled in (emotion_data is SQL NULL)
+    # and no worker holds a current claim on
+    record = models.EmotionRecord
+    return select(*columns).where(
+        record.voice_file_path.isnot(None),
+        record.emotion_data.is_(None),
+        or_(record.voice_claimed_until.is_(None), record.voice_claimed_until < now)
+    )
+
+class VoiceAnalysisPipeline:
+    """Batches pending voice records through analysis; see the module docstring."""
+
+    def __init__(
+        self,
+        analyzer_factory: Callable,
+        base_dir: Path,
+        session_factory: Optional[Callable] = None,
+        batch_size: int = 16,
+        max_wait: float = 2.0,
+        max_queue: int = 1000,
+        recover_interval: float = 300.0,
+        lease: float = 600.0,
+        missing_file_grace: float = 24 * 3600
+    ):
+        self.analyzer_factory = analyzer_factory
+        self.base_dir = Path(base_dir)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.recover_interval = recover_interval
+        self.lease = lease
+        # A record is committed just before its upload is moved into place
+        # and an interrupted upload can be completed until it expires, so
+        # only older records with no file are given up on
+        self.missing_file_grace = missing_file_grace
+        self._session_factory = session_factory
+        self._queue: "queue.Queue[int]" = queue.Queue(maxsize=max_queue)
+        self._lock = Lock()
+        self._batch_ms: deque = deque(maxlen=256)
+        self._metrics = {
+            "queued": 0,
+            "dropped_queue_full": 0,
+            "recovered": 0,
+            "batches": 0,
+            "analyzed": 0,
+            "decode_errors": 0,
+            "retried": 0,
+            "failed_batches": 0
+        }
+        if shutil.which("ffmpeg") is None:
+            logger.error("ffmpeg is not installed; only WAV recordings will be analyzed")
+        self._stopped = Event()
+        self._recovered_at = 0.0
+        self._thread = Thread(target=self._worker, name="voice-analysis", daemon=True)
+        self._thread.start()
+
+    def _new_db_session(self):
+        if self._session_factory is None:
+            from database import get_session_factory
+            self._session_factory = get_session_factory()
+        return self._session_factory()
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._metrics[name] += n
+
+    def submit(self, record_id: int) -> bool:
+        """Queue a record for analysis; False when the queue is full (recover() finds it later)."""
+        try:
+            self._queue.put_nowait(record_id)
+        except queue.Full:
+            self._count("dropped_queue_full")
+            return False
+        self._count("queued")
+        return True
+
+    def recover(self) -> int:
+        """Queue pending records that are not queued yet, oldest first."""
+        self._recovered_at = time.monotonic()
+        free = self._queue.maxsize - self._queue.qsize()
+        if free <= 0:
+            return 0
+        db = self._new_db_session()
+        try:
+            record_ids = db.execute(
+                _pending(datetime.utcnow(), models.EmotionRecord.id).order_by(models.EmotionRecord.id).limit(free)
+            ).scalars().all()
+        finally:
+            db.close()
+        queued = sum(self.submit(record_id) for record_id in record_ids)
+        self._count("recovered", queued)
+        return queued
+
+    def _next_batch(self) -> List[int]:
+        # Wait for the first record, then give others up to max_wait to join
+        try:
+            record_ids = [self._queue.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(record_ids) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                record_ids.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return record_ids
+
+    def _claim(self, record_ids: List[int]) -> Tuple[List, datetime]:
+        # Short transaction: lock what no other replica is claiming, stamp
+        # it with our lease and commit before any decoding starts
+        record = models.EmotionRecord
+        now = datetime.utcnow()
+        claimed_until = now + timedelta(seconds=self.lease)
+        db = self._new_db_session()
+        try:
+            rows = db.execute(
+                _pending(now, record.id, record.user_id, record.timestamp, record.voice_file_path, record.text_content)
+                .where(record.id.in_(set(record_ids)))
+                .with_for_update(skip_locked=True)
+            ).all()
+            if rows:
+                db.execute(
+                    update(record.__table__)
+                    .where(record.__table__.c.id.in_([row.id for row in rows]))
+                    .values(voice_claimed_until=claimed_until)
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return rows, claimed_until
+
+    def process_batch(self, record_ids: List[int]) -> int:
+        """Analyze and fill in the given records that are still pending; returns how many."""
+        started = time.perf_counter()
+        rows, claimed_until = self._claim(record_ids)
+        if not rows:
+            return 0
+
+        now = datetime.utcnow()
+        items = [
+            {
+                "path": self.base_dir / row.voice_file_path,
+                "text_content": row.text_content,
+                "missing_is_final": row.timestamp is None or (now - row.timestamp).total_seconds() > self.missing_file_grace
+            }
+            for row in rows
+        ]
+        results = analyze_recordings(self.analyzer_factory(), items)
+        done = [(row, emotion_data) for row, emotion_data in zip(rows, results) if emotion_data is not None]
+        self._count("retried", len(rows) - len(done))
+
+        by_user: Dict[int, List] = {}
+        if done:
+            record = models.EmotionRecord
+            db = self._new_db_session()
+            try:
+                # Only rows still under our claim: a lapsed lease may have
+                # passed a row to another worker
+                ours = set(db.execute(
+                    select(record.id)
+                    .where(
+                        record.id.in_([row.id for row, _ in done]),
+                        record.voice_claimed_until == claimed_until,
+                        record.emotion_data.is_(None)
+                    )
+                    .with_for_update()
+                ).scalars().all())
+                done = [(row, emotion_data) for row, emotion_data in done if row.id in ours]
+                if done:
+                    db.execute(_FILL_RECORD, [
+                        {
+                            "b_id": row.id,
+                            "b_emotion_data": emotion_data,
+                            "b_dominant_emotion": emotion_data.get("dominant_emotion"),
+                            "b_sentiment_score": emotion_data.get("sentiment_score")
+                        }
+                        for row, emotion_data in done
+                    ])
+                    for row, emotion_data in done:
+                        by_user.setdefault(row.user_id, []).append((row.timestamp, emotion_data))
+                    for user_id, user_records in by_user.items():
+                        apply_records(db, user_id, user_records)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        for user_id in by_user:
+            get_report_cache().invalidate_user(user_id)
+            invalidate_recommendations(user_id)
+        with self._lock:
+            self._metrics["batches"] += 1
+            self._metrics["analyzed"] += len(done)
+            self._metrics["decode_errors"] += sum("voice_error" in emotion_data for _, emotion_data in done)
+            self._batch_ms.append((time.perf_counter() - started) * 1000)
+        return len(done)
+
+    def _worker(self):
+        while not self._stopped.is_set():
+            try:
+                if time.monotonic() - self._recovered_at >= self.recover_interval:
+                    self.recover()
+                record_ids = self._next_batch()
+                if record_ids:
+                    self.process_batch(record_ids)
+            except Exception as e:
+                # The records stay pending and are recovered once their lease ends
+                self._count("failed_batches")
+                logger.error(f"Error analyzing voice recordings: {str(e)}")
+                self._stopped.wait(1.0)
+
+    def close(self, timeout: float = 10.0):
+        """Stop the worker; queued records stay pending in the database."""
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def get_metrics(self) -> Dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            batch_ms = sorted(self._batch_ms)
+        metrics["queue_size"] = self._queue.qsize()
+        metrics["batch_ms"] = {
+            "avg": round(sum(batch_ms) / len(batch_ms), 3) if batch_ms else 0.0,
+            "p95": round(batch_ms[int(len(batch_ms) * 0.95)], 3) if batch_ms else 0.0
+        }
+        return metrics
@@ -0,0 +1,146 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import List, Dict, Any, Optional
+from threading import Lock
+from ml.chat_bot import ChatBot
+from ml.model_registry import warm_up
+from ..services.generation_pool import (
+    DeadlineExceeded,
+    GenerationPool,
+    PoolSaturated,
+    UserConcurrencyExceeded
+)
+import json
+import os
+import time
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+_chat_bot: Optional[ChatBot] = None
+_chat_bot_lock = Lock()
+
+# Generation runs on these worker threads, never on the event loop
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("CHAT_REQUEST_TIMEOUT", "120"))
+generation_pool = GenerationPool(
+    worker_count=int(os.getenv("CHAT_POOL_WORKERS", "1")),
+    max_queue_size=int(os.getenv("CHAT_POOL_QUEUE_SIZE", "16")),
+    max_per_user=int(os.getenv("CHAT_POOL_MAX_PER_USER", "2"))
+)
+
+class ChatRequest(BaseModel):
+    message: str
+    conversation_history: Optional[List[Dict[str, str]]] = None
+    emotion_context: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
+    user_id: Optional[str] = None
+
+def get_chat_bot() -> ChatBot:
+    """Return the shared ChatBot, loading the model on first use."""
+    global _chat_bot
+    if _chat_bot is None:
+        with _chat_bot_lock:
+            if _chat_bot is None:
+                _chat_bot = ChatBot()
+    return _chat_bot
+
+@router.on_event("startup")
+def warm_up_chat_model():
+    """Load the chat model at startup instead of on the first request."""
+    if os.getenv("CHAT_WARMUP", "false").lower() == "true":
+        warm_up()
+        get_chat_bot()
+
+def _format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _user_key(request: ChatRequest, http_request: Request) -> str:
+    if request.user_id:
+        return request.user_id
+    return http_request.client.host if http_request.client else "anonymous"
+
+def _rejection(error: Exception) -> HTTPException:
+    if isinstance(error, PoolSaturated):
+        return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": "5"})
+    return HTTPException(status_code=429, detail=str(error))
+
+@router.post("/")
+async def chat(request: ChatRequest, http_request: Request):
+    """Generate a complete AI response on the generation worker pool."""
+    deadline = time.monotonic() + REQUEST_TIMEOUT_SECONDS
+
+    def _generate():
+        return get_chat_bot().generate_response(
+            request.message,
+            conversation_history=request.conversation_history,
+            emotion_context=request.emotion_context,
+            session_id=request.session_id,
+            deadline=deadline
+        )
+
+    try:
+        return await generation_pool.run(_user_key(request, http_request), _generate, deadline)
+    except (PoolSaturated, UserConcurrencyExceeded) as e:
+        raise _rejection(e)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+@router.post("/stream")
+async def stream_chat(request: ChatRequest, http_request: Request):
+    """Stream the AI response as Server-Sent Events.
+
+    Emits ``token`` events while the response is generated and a final
+    ``done`` event with the full response, safety result and metrics.
+    """
+    deadline = time.monotonic() + REQUEST_TIMEOUT_SECONDS
+
+    def _generate():
+        return get_chat_bot().stream_response(
+            request.message,
+            conversation_history=request.conversation_history,
+            emotion_context=request.emotion_context,
+            session_id=request.session_id,
+            deadline=deadline
+        )
+
+    try:
+        events = generation_pool.stream(_user_key(request, http_request), _generate, deadline)
+    except (PoolSaturated, UserConcurrencyExceeded) as e:
+        raise _rejection(e)
+
+    def event_source():
+        try:
+            for event in events:
+                yield _format_sse(event.pop("event"), event)
+        except DeadlineExceeded as e:
+            yield _format_sse("error", {"detail": str(e)})
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
+            yield _format_sse("error", {"detail": "Failed to generate response"})
+        finally:
+            events.close()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/metrics")
+async def get_chat_metrics():
+    """Get worker pool, cache and batching metrics for the chat model."""
+    metrics = {"pool": generation_pool.get_metrics()}
+    if _chat_bot is None:
+        metrics["status"] = "not_loaded"
+        return metrics
+    metrics.update({
+        "status": "loaded",
+        "model": _chat_bot.model_handle.info(),
+        "safety_rules_version": _chat_bot.safety_filters.version,
+        "prefix_cache": _chat_bot.prefix_cache.get_metrics() if _chat_bot.prefix_cache else None,
+        "response_cache": _chat_bot.response_cache.get_metrics() if _chat_bot.response_cache else None,
+        "scheduler": _chat_bot.scheduler.get_metrics() if _chat_bot.scheduler else None
+    })
+    return metrics
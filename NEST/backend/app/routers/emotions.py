@@ -0,0 +1,318 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta
+from threading import Lock
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_db
+from analytics.emotion_tracker import AsyncEmotionTracker, EmotionTracker
+from analytics.report_cache import get_report_cache
+from analytics.emotion_events import RESOLUTIONS, get_emotion_event_store
+from analytics.voice_analysis import VoiceAnalysisPipeline
+from app.services.audio_streaming import audio_response, resolve_media_path
+from app.services.voice_uploads import (
+    VOICE_RECORDINGS_DIR,
+    UploadNotFound,
+    UploadOffsetMismatch,
+    UploadTooLarge,
+    get_upload_store
+)
+import models
+from ml.emotion_analyzer import EmotionAnalyzer
+import os
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+MAX_BULK_ENTRIES = int(os.getenv("EMOTION_BULK_MAX_ENTRIES", "1000"))
+MAX_EVENT_BATCH = int(os.getenv("EMOTION_EVENT_MAX_BATCH", "5000"))
+
+_emotion_analyzer: Optional[EmotionAnalyzer] = None
+_emotion_analyzer_lock = Lock()
+_voice_pipeline: Optional[VoiceAnalysisPipeline] = None
+_voice_pipeline_lock = Lock()
+
+class EmotionEntry(BaseModel):
+    text_content: Optional[str] = None
+    voice_file_path: Optional[str] = None
+    emotion_data: Optional[Dict[str, Any]] = None
+    timestamp: Optional[datetime] = None
+
+class BulkEmotionRequest(BaseModel):
+    user_id: int
+    entries: List[EmotionEntry]
+
+class BulkEmotionResponse(BaseModel):
+    ids: List[int]
+    count: int
+    analyzed: int
+    elapsed_ms: float
+    rows_per_second: Optional[float] = None
+
+class EmotionEvent(BaseModel):
+    user_id: int
+    sentiment_score: float
+    dominant_emotion: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    source: Optional[str] = None
+
+class EmotionEventBatch(BaseModel):
+    events: List[EmotionEvent]
+
+class VoiceUploadRequest(BaseModel):
+    user_id: int
+    size: int  # Total bytes of the recording
+    extension: str = "m4a"
+    text_content: Optional[str] = None  # Transcript made on the device, if any
+
+def get_emotion_analyzer() -> EmotionAnalyzer:
+    """Return the shared EmotionAnalyzer, loading it on first use."""
+    global _emotion_analyzer
+    if _emotion_analyzer is None:
+        with _emotion_analyzer_lock:
+            if _emotion_analyzer is None:
+                _emotion_analyzer = EmotionAnalyzer()
+    return _emotion_analyzer
+
+def get_voice_pipeline() -> VoiceAnalysisPipeline:
+    """Return the shared voice analysis pipeline, starting it on first use."""
+    global _voice_pipeline
+    if _voice_pipeline is None:
+        with _voice_pipeline_lock:
+            if _voice_pipeline is None:
+                _voice_pipeline = VoiceAnalysisPipeline(
+                    get_emotion_analyzer,
+                    VOICE_RECORDINGS_DIR,
+                    batch_size=int(os.getenv("VOICE_ANALYSIS_BATCH_SIZE", "16")),
+                    max_wait=float(os.getenv("VOICE_ANALYSIS_MAX_WAIT", "2"))
+                )
+    return _voice_pipeline
+
+def get_emotion_tracker(db: Session = Depends(get_db)) -> EmotionTracker:
+    return EmotionTracker(db, emotion_analyzer=get_emotion_analyzer())
+
+def get_async_emotion_tracker(db: AsyncSession = Depends(get_async_db)) -> AsyncEmotionTracker:
+    return AsyncEmotionTracker(db, emotion_analyzer=get_emotion_analyzer())
+
+@router.post("/bulk", response_model=BulkEmotionResponse)
+def record_emotions_bulk(
+    request: BulkEmotionRequest,
+    tracker: EmotionTracker = Depends(get_emotion_tracker)
+):
+    """Record a batch of emotion entries (journal imports, offline sync) in one transaction."""
+    if not request.entries:
+        raise HTTPException(status_code=400, detail="No entries provided")
+    if len(request.entries) > MAX_BULK_ENTRIES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BULK_ENTRIES} entries per request"
+        )
+    
+    try:
+        result = tracker.record_emotions_bulk(
+            request.user_id,
+            [entry.model_dump() for entry in request.entries]
+        )
+        logger.info(f"Recorded {result['count']} emotion entries for user {request.user_id} "
+                    f"({result['rows_per_second']} rows/s)")
+        return result
+    except Exception as e:
+        logger.error(f"Error recording emotion entries: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to record emotion entries")
+
+def _check_days(days: int):
+    if days < 1 or days > 365:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 365")
+
+@router.get("/report/{user_id}")
+async def get_emotion_report(
+    user_id: int,
+    days: int = 30,
+    tracker: AsyncEmotionTracker = Depends(get_async_emotion_tracker)
+):
+    """Get the emotion report for the last ``days`` days (cached until the user records again)."""
+    _check_days(days)
+    return await tracker.get_emotion_report(user_id, days)
+
+@router.get("/correlations/{user_id}")
+async def get_emotion_correlations(
+    user_id: int,
+    days: int = 30,
+    tracker: AsyncEmotionTracker = Depends(get_async_emotion_tracker)
+):
+    """Get how the user's sentiment relates to time of day, weekday, meditation and chat activity."""
+    _check_days(days)
+    return await tracker.get_emotion_correlations(user_id, days)
+
+@router.get("/report-cache/metrics")
+async def get_report_cache_metrics():
+    """Get hit-rate and rebuild metrics for the emotion report cache."""
+    return get_report_cache().get_metrics()
+
+@router.post("/events")
+def record_emotion_events(batch: EmotionEventBatch):
+    """Store high-frequency emotion samples (e.g. per chat message) in hourly buckets."""
+    if len(batch.events) > MAX_EVENT_BATCH:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_EVENT_BATCH} events per request"
+        )
+    
+    try:
+        return get_emotion_event_store().record_events(event.model_dump() for event in batch.events)
+    except Exception as e:
+        logger.error(f"Error recording emotion events: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to record emotion events")
+
+@router.get("/events/{user_id}")
+def get_emotion_events(
+    user_id: int,
+    days: int = 7,
+    resolution: str = "hour"
+):
+    """Get per-hour or per-day emotion sample statistics for the last ``days`` days."""
+    _check_days(days)
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {sorted(RESOLUTIONS)}")
+    
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=days)
+    return {
+        "period": {
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat()
+        },
+        "resolution": resolution,
+        "buckets": get_emotion_event_store().get_summary(user_id, start_date, end_date, resolution)
+    }
+
+@router.api_route("/records/{record_id}/voice", methods=["GET", "HEAD"])
+def stream_voice_recording(record_id: int, request: Request, db: Session = Depends(get_db)):
+    """Stream the voice recording of an emotion record, with byte-range support."""
+    record = db.get(models.EmotionRecord, record_id)
+    if record is None or not record.voice_file_path:
+        raise HTTPException(status_code=404, detail="Voice recording not found")
+    # Stored paths may be absolute; either way they must lie in the recordings directory
+    path = resolve_media_path(VOICE_RECORDINGS_DIR, record.voice_file_path)
+    return audio_response(request, path, cache_control="private, max-age=3600")
+
+def _upload_state(upload: Dict[str, Any], status_code: int = 200, **extra) -> JSONResponse:
+    return JSONResponse(
+        {"upload_id": upload["upload_id"], "offset": upload["offset"], "size": upload["size"], **extra},
+        status_code=status_code,
+        headers={
+            "upload-offset": str(upload["offset"]),
+            "upload-length": str(upload["size"]),
+            "cache-control": "no-store"
+        }
+    )
+
+@router.post("/voice/uploads")
+def create_voice_upload(request: VoiceUploadRequest):
+    """
+    Start a resumable voice upload. Send the bytes with PATCH requests
+    carrying an ``Upload-Offset`` header; after an interruption, HEAD the
+    upload for the offset to continue from.
+    """
+    store = get_upload_store()
+    try:
+        upload = store.create(request.user_id, request.size, request.extension, request.text_content)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return _upload_state(upload, 201, max_chunk_size=store.max_chunk_size)
+
+@router.api_route("/voice/uploads/{upload_id}", methods=["GET", "HEAD"])
+def get_voice_upload(upload_id: str):
+    """Get how many bytes of the upload have been received."""
+    try:
+        return _upload_state(get_upload_store().status(upload_id))
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+@router.patch("/voice/uploads/{upload_id}")
+async def upload_voice_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Append the request body at ``Upload-Offset``. The body is streamed to
+    disk, never held in memory whole. The last chunk creates the emotion
+    record, which is analyzed in the background; if that fails, an empty
+    PATCH at the final offset retries it.
+    """
+    store = get_upload_store()
+    content_length = request.headers.get("content-length")
+    if content_length and int(content_length) > store.max_chunk_size:
+        raise HTTPException(status_code=413, detail=f"Chunks are limited to {store.max_chunk_size} bytes")
+
+    async def record_upload(upload: Dict[str, Any]) -> int:
+        # Completing again after a failed response must not add a second record
+        # (user_id, timestamp) is indexed; records of this upload are newer than it
+        record_id = (await db.execute(
+            select(models.EmotionRecord.id).where(
+                models.EmotionRecord.user_id == upload["user_id"],
+                models.EmotionRecord.timestamp >= datetime.utcfromtimestamp(upload["created_at"]),
+                models.EmotionRecord.voice_file_path == upload["voice_file_path"]
+            )
+        )).scalars().first()
+        if record_id is None:
+            record = models.EmotionRecord(
+                user_id=upload["user_id"],
+                voice_file_path=upload["voice_file_path"],
+                text_content=upload["text_content"]
+            )
+            db.add(record)
+            await db.commit()
+            record_id = record.id
+        return record_id
+
+    try:
+        upload = await store.write_chunk(upload_id, upload_offset, request.stream(), on_complete=record_upload)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"upload-offset": str(e.offset)})
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        # The upload stays open: an empty PATCH at the final offset retries this
+        logger.error(f"Error recording voice upload {upload_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to record voice recording")
+
+    if "completed" not in upload:
+        return _upload_state(upload, complete=False)
+    get_voice_pipeline().submit(upload["completed"])
+    return _upload_state(upload, complete=True, record_id=upload["completed"])
+
+@router.delete("/voice/uploads/{upload_id}")
+def cancel_voice_upload(upload_id: str):
+    """Abort an unfinished upload and delete what was received."""
+    try:
+        get_upload_store().delete(upload_id)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"upload_id": upload_id, "cancelled": True}
+
+@router.get("/voice/pipeline/metrics")
+def get_voice_pipeline_metrics():
+    """Get queue and batch metrics of the voice analysis pipeline."""
+    return get_voice_pipeline().get_metrics()
+
+@router.on_event("startup")
+def start_voice_pipeline():
+    """Start analyzing voice records left pending by earlier runs."""
+    if os.getenv("VOICE_ANALYSIS_ENABLED", "true").lower() == "true":
+        get_voice_pipeline()
+
+@router.on_event("shutdown")
+def stop_voice_pipeline():
+    if _voice_pipeline is not None:
+        _voice_pipeline.close()
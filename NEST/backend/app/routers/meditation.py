@@ -0,0 +1,89 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import RedirectResponse
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+from pathlib import Path
+import os
+from exercises.catalog import get_exercise_catalog
+from exercises.sessions import SessionBufferFull, close_session_service, get_session_service
+from exercises.recommender import get_recommender
+from app.services.audio_streaming import audio_response, resolve_media_path
+
+router = APIRouter()
+
+MEDITATION_AUDIO_DIR = Path(os.getenv("MEDITATION_AUDIO_DIR", "/app/data/meditation_audio"))
+
+class SessionStart(BaseModel):
+    user_id: int
+    exercise_id: str
+
+class SessionCompletion(BaseModel):
+    user_id: int
+    notes: Optional[str] = None
+
+@router.api_route("/audio/{file_path:path}", methods=["GET", "HEAD"])
+def stream_meditation_audio(file_path: str, request: Request):
+    """
+    Stream a meditation audio file with byte-range support, so players can
+    start and seek without downloading the whole file.
+    """
+    return audio_response(request, resolve_media_path(MEDITATION_AUDIO_DIR, file_path))
+
+@router.api_route("/exercises/{exercise_id}/audio", methods=["GET", "HEAD"])
+def stream_exercise_audio(exercise_id: str, request: Request):
+    """Stream the audio of an exercise (``audio_url`` relative to the audio directory)."""
+    exercise = get_exercise_catalog().get(exercise_id)
+    if exercise is None:
+        raise HTTPException(status_code=404, detail="Exercise not found")
+    if not exercise.audio_url:
+        raise HTTPException(status_code=404, detail="Exercise has no audio")
+    if exercise.audio_url.startswith(("http://", "https://")):
+        # Hosted elsewhere (e.g. a CDN)
+        return RedirectResponse(exercise.audio_url)
+    return audio_response(request, resolve_media_path(MEDITATION_AUDIO_DIR, exercise.audio_url))
+
+@router.post("/sessions")
+def start_session(request: SessionStart) -> Dict[str, Any]:
+    """Start a session; it is saved in the background within about a second."""
+    try:
+        return get_session_service().start_session(request.user_id, request.exercise_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except SessionBufferFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+@router.post("/sessions/{session_id}/complete")
+def complete_session(session_id: str, request: SessionCompletion) -> Dict[str, Any]:
+    """Complete a session and record its actual duration."""
+    try:
+        return get_session_service().complete_session(request.user_id, session_id, request.notes)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/sessions/active/{user_id}")
+def get_active_sessions(user_id: int) -> List[Dict[str, Any]]:
+    """Sessions the user has in progress"""
+    return get_session_service().get_active_sessions(user_id)
+
+@router.get("/sessions/metrics")
+def get_session_metrics() -> Dict[str, Any]:
+    """Write-behind buffer metrics: pending rows, flushes and failures"""
+    return get_session_service().get_metrics()
+
+@router.get("/recommendations/{user_id}")
+def get_recommendations(
+    user_id: int,
+    emotion: Optional[str] = None,
+    duration: Optional[int] = Query(None, ge=1, description="Preferred duration in seconds"),
+    limit: int = Query(5, ge=1, le=50)
+) -> List[Dict[str, Any]]:
+    """
+    Exercises ranked for the user from their recent emotions and session
+    history; ``emotion`` is how they feel right now, if known.
+    """
+    return get_recommender().recommend(user_id, limit, emotion, duration)
+
+@router.on_event("shutdown")
+def flush_sessions():
+    """Write buffered session changes before the process exits."""
+    close_session_service()
@@ -5,6 +5,7 @@ from datetime import datetime
 import json
 import os
 from pathlib import Path
+from database import get_pool_metrics
 
 router = APIRouter()
 
@@ -132,4 +133,13 @@ async def get_metrics(date: str):
 
         return {"metrics": metrics}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+@router.get("/pools")
+async def get_pools():
+    """
+    Connection pool metrics of this process: checkouts, wait time, overflow
+    and timeouts per store, with the pool settings. Each replica (and
+    worker) has its own pools, so query every pod when sizing them.
+    """
+    return get_pool_metrics()
@@ -0,0 +1,198 @@
+from typing import BinaryIO, Dict, Optional, Tuple
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+import mimetypes
+import os
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 256 * 1024
+
+AUDIO_MEDIA_TYPES = {
+    ".mp3": "audio/mpeg",
+    ".m4a": "audio/mp4",
+    ".aac": "audio/aac",
+    ".wav": "audio/wav",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".flac": "audio/flac",
+    ".webm": "audio/webm"
+}
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def resolve_media_path(base_dir: Path, relative_path: str) -> Path:
+    """Resolve ``relative_path`` inside ``base_dir``; 404 for anything outside it or missing."""
+    base = base_dir.resolve()
+    path = (base / relative_path).resolve()
+    if base not in path.parents or not path.is_file():
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    return path
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single ``bytes=`` range into inclusive ``(start, end)``.
+
+    Returns None when the whole file should be sent: no header, a malformed
+    one, or several ranges (which servers may answer with the full body).
+    Raises RangeNotSatisfiable when the range lies beyond the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_text:
+            # Suffix range: the last N bytes
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else max(start, size - 1)
+    except ValueError:
+        return None
+    if start > end:
+        # Syntactically invalid, so ignored
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+class AudioFileResponse(Response):
+    """
+    Streams ``[start, start + length)`` of an open file.
+
+    Uses the ASGI ``http.response.zerocopy`` extension (os.sendfile in the
+    server) when the server offers it; otherwise reads CHUNK_SIZE blocks
+    with os.pread in a worker thread, so memory stays flat and the first
+    bytes go out immediately whatever the file size.
+    """
+
+    def __init__(
+        self,
+        file: Optional[BinaryIO],
+        status_code: int,
+        headers: Dict[str, str],
+        media_type: Optional[str],
+        start: int = 0,
+        length: int = 0,
+        send_body: bool = True
+    ):
+        self.file = file
+        self.start = start
+        self.length = length
+        self.send_body = send_body and file is not None and length > 0
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+
+    def init_headers(self, headers=None):
+        super().init_headers(headers)
+        # The body is streamed, Content-Length is set by audio_response()
+        self.raw_headers = [(name, value) for name, value in self.raw_headers if name != b"content-length"]
+        if self.status_code != 304:
+            self.raw_headers.append((b"content-length", str(self.length).encode("latin-1")))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers
+            })
+            if not self.send_body:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": self.file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False
+                })
+                return
+
+            fd = self.file.fileno()
+            offset, remaining = self.start, self.length
+            while remaining > 0:
+                chunk = await run_in_threadpool(os.pread, fd, min(CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank while streaming; end the response cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if self.file is not None:
+                self.file.close()
+
+def _etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _range_applies(request: Request, etag: str, last_modified: str) -> bool:
+    # If-Range: only honour Range while the client's copy is current
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+def audio_response(request: Request, path: Path, cache_control: str = "public, max-age=86400") -> Response:
+    """
+    Serve an audio file with byte ranges (206/416), ETag and Last-Modified
+    validation (304) and HEAD support.
+    """
+    try:
+        file = open(path, "rb")
+    except OSError:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    try:
+        stat = os.fstat(file.fileno())
+        size = stat.st_size
+        etag = _etag(stat)
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        media_type = AUDIO_MEDIA_TYPES.get(path.suffix.lower()) or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+            "cache-control": cache_control
+        }
+
+        if _not_modified(request, etag, stat.st_mtime):
+            file.close()
+            return AudioFileResponse(None, 304, headers, None)
+
+        byte_range = None
+        if _range_applies(request, etag, last_modified):
+            try:
+                byte_range = parse_range(request.headers.get("range"), size)
+            except RangeNotSatisfiable:
+                file.close()
+                headers["content-range"] = f"bytes */{size}"
+                return AudioFileResponse(None, 416, headers, media_type)
+
+        send_body = request.method != "HEAD"
+        if byte_range is None:
+            return AudioFileResponse(file, 200, headers, media_type, 0, size, send_body)
+        start, end = byte_range
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        return AudioFileResponse(file, 206, headers, media_type, start, end - start + 1, send_body)
+    except Exception:
+        file.close()
+        raise
@@ -0,0 +1,216 @@
+from typing import Any, Callable, Dict, Iterator
+from collections import deque
+from concurrent.futures import Future
+from threading import Event, Lock, Thread
+import asyncio
+import queue
+import time
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PoolSaturated(Exception):
+    """The request queue is full; callers should answer 503."""
+
+class UserConcurrencyExceeded(Exception):
+    """The user already has the maximum number of requests in flight."""
+
+class DeadlineExceeded(Exception):
+    """The request did not finish before its deadline."""
+
+_END_OF_STREAM = object()
+
+class _Job:
+    def __init__(self, user_id: str, fn: Callable, deadline: float, streaming: bool):
+        self.user_id = user_id
+        self.fn = fn
+        self.deadline = deadline
+        self.streaming = streaming
+        self.future: Future = Future()
+        self.events: "queue.Queue[Any]" = queue.Queue()
+        self.cancelled = Event()
+        self.enqueued_at = time.monotonic()
+
+class GenerationPool:
+    """
+    Runs chat generation on dedicated worker threads, off the event loop.
+
+    Admission control happens before a job is queued: a full queue raises
+    PoolSaturated and a user over ``max_per_user`` in-flight requests raises
+    UserConcurrencyExceeded, so overload is rejected immediately instead of
+    piling up. Jobs carry a deadline; expired jobs are dropped before they
+    start, and callers pass the same deadline into generation so it stops
+    early.
+    """
+
+    def __init__(self, worker_count: int = 1, max_queue_size: int = 16, max_per_user: int = 2):
+        self.worker_count = worker_count
+        self.max_per_user = max_per_user
+        self._queue: "queue.Queue[_Job]" = queue.Queue(maxsize=max_queue_size)
+        self._user_counts: Dict[str, int] = {}
+        self._lock = Lock()
+        self._busy_workers = 0
+        self._wait_times_ms: deque = deque(maxlen=1000)
+        self._metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "expired": 0,
+            "cancelled": 0,
+            "rejected_saturated": 0,
+            "rejected_user_limit": 0
+        }
+        self._threads = []
+        for index in range(worker_count):
+            thread = Thread(target=self._worker, name=f"generation-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _admit(self, job: _Job):
+        with self._lock:
+            in_flight = self._user_counts.get(job.user_id, 0)
+            if in_flight >= self.max_per_user:
+                self._metrics["rejected_user_limit"] += 1
+                raise UserConcurrencyExceeded(
+                    f"At most {self.max_per_user} concurrent chat requests per user"
+                )
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._metrics["rejected_saturated"] += 1
+                raise PoolSaturated("Chat generation queue is full")
+            self._user_counts[job.user_id] = in_flight + 1
+            self._metrics["submitted"] += 1
+
+    def _release(self, job: _Job, outcome: str):
+        with self._lock:
+            remaining = self._user_counts.get(job.user_id, 1) - 1
+            if remaining > 0:
+                self._user_counts[job.user_id] = remaining
+            else:
+                self._user_counts.pop(job.user_id, None)
+            self._metrics[outcome] += 1
+
+    def submit(self, user_id: str, fn: Callable[[], Any], deadline: float) -> Future:
+        """Queue ``fn`` for execution; ``deadline`` is a time.monotonic() timestamp."""
+        job = _Job(user_id, fn, deadline, streaming=False)
+        self._admit(job)
+        return job.future
+
+    async def run(self, user_id: str, fn: Callable[[], Any], deadline: float) -> Any:
+        """Run ``fn`` on the pool and await its result without blocking the event loop."""
+        future = self.submit(user_id, fn, deadline)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future),
+                timeout=max(deadline - time.monotonic(), 0)
+            )
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Chat generation timed out")
+
+    def stream(self, user_id: str, fn: Callable[[], Iterator[Any]], deadline: float) -> Iterator[Any]:
+        """
+        Run a generator on the pool and iterate its items from the caller.
+
+        Admission is checked here, so a rejection raises before any item is
+        produced. Closing the returned iterator cancels the job.
+        """
+        job = _Job(user_id, fn, deadline, streaming=True)
+        self._admit(job)
+
+        def _items():
+            try:
+                while True:
+                    timeout = job.deadline - time.monotonic()
+                    if timeout <= 0:
+                        raise DeadlineExceeded("Chat generation timed out")
+                    try:
+                        item = job.events.get(timeout=timeout)
+                    except queue.Empty:
+                        raise DeadlineExceeded("Chat generation timed out")
+                    if item is _END_OF_STREAM:
+                        break
+                    yield item
+                # Surface errors raised inside the worker
+                job.future.result()
+            finally:
+                job.cancelled.set()
+
+        return _items()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            except Exception as e:
+                # Never let one job take the worker down with it
+                logger.error(f"Unexpected error in generation worker: {str(e)}")
+
+    def _process(self, job: _Job):
+        now = time.monotonic()
+        # False when the caller already cancelled the future (asyncio.wait_for
+        # timing out while the job was queued); once claimed it cannot be
+        # cancelled, so the set_* calls below cannot race the caller
+        claimed = job.future.set_running_or_notify_cancel()
+        if not claimed or job.cancelled.is_set() or now >= job.deadline:
+            outcome = "expired" if claimed and not job.cancelled.is_set() else "cancelled"
+            try:
+                if claimed:
+                    job.future.set_exception(DeadlineExceeded("Request expired while queued"))
+            finally:
+                job.events.put(_END_OF_STREAM)
+                self._release(job, outcome)
+            return
+
+        with self._lock:
+            self._wait_times_ms.append((now - job.enqueued_at) * 1000)
+            self._busy_workers += 1
+        outcome = "failed"
+        try:
+            if job.streaming:
+                self._run_stream(job)
+                job.future.set_result(None)
+            else:
+                job.future.set_result(job.fn())
+            outcome = "completed"
+        except Exception as e:
+            logger.error(f"Error in generation worker: {str(e)}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            job.events.put(_END_OF_STREAM)
+            self._release(job, outcome)
+            with self._lock:
+                self._busy_workers -= 1
+
+    def _run_stream(self, job: _Job):
+        items = job.fn()
+        try:
+            for item in items:
+                if job.cancelled.is_set() or time.monotonic() >= job.deadline:
+                    break
+                job.events.put(item)
+        finally:
+            # Closing the generator stops the underlying model.generate call
+            items.close()
+
+    def get_metrics(self) -> Dict:
+        """Return queue depth, wait-time percentiles and rejection counters."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            wait_times = np.array(self._wait_times_ms)
+            metrics.update({
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "busy_workers": self._busy_workers,
+                "workers": self.worker_count,
+                "users_in_flight": len(self._user_counts)
+            })
+        metrics["wait_time_ms"] = {
+            "p50": round(float(np.percentile(wait_times, 50)), 1) if wait_times.size else 0.0,
+            "p95": round(float(np.percentile(wait_times, 95)), 1) if wait_times.size else 0.0,
+            "max": round(float(wait_times.max()), 1) if wait_times.size else 0.0
+        }
+        return metrics
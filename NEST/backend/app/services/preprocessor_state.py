@@ -0,0 +1,221 @@
+from typing import Dict, Any, Iterator, Tuple
+from collections.abc import Mapping
+import json
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+import logging
+
+logger = logging.getLogger(__name__)
+
+# On-disk layout (all integers little-endian, arrays 8-byte aligned):
+#
+#   magic     8 bytes   b"NESTTFI\0"
+#   version   uint32
+#   hdr_len   uint32
+#   header    hdr_len bytes of UTF-8 JSON (vectorizer params, section offsets)
+#   idf       float64[n_terms]
+#   offsets   uint64[n_terms + 1]   byte offsets of each term in the string table
+#   slots     uint32[n_slots]       hash index: term index + 1, 0 for empty
+#   strings   UTF-8 terms, sorted, concatenated without separators
+#
+# Terms are sorted by their UTF-8 bytes, which matches the code point order
+# sklearn uses when it assigns feature indices, so a term's position in the
+# string table is its column in the TF-IDF matrix. The hash index is an
+# open-addressing table (CRC-32 of the term's bytes, linear probing, at most
+# half full) so lookups go straight to the term.
+MAGIC = b"NESTTFI\0"
+FORMAT_VERSION = 2
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 8
+
+# Vectorizer parameters that are persisted; callables are not supported.
+_PERSISTED_PARAMS = (
+    "input", "encoding", "decode_error", "strip_accents", "lowercase",
+    "analyzer", "stop_words", "token_pattern", "ngram_range", "max_df",
+    "min_df", "max_features", "binary", "norm", "use_idf", "smooth_idf",
+    "sublinear_tf",
+)
+
+
+class MappedVocabulary(Mapping):
+    """Read-only term -> feature index mapping backed by the mapped file.
+
+    Lookups probe the hash index and compare against the string table in
+    place, so the vocabulary costs no per-process Python objects and its
+    pages are shared between workers. Pickles as a plain dict.
+    """
+
+    def __init__(self, strings: memoryview, offsets: memoryview, slots: memoryview):
+        self._strings = strings
+        self._offsets = offsets
+        self._slots = slots
+        self._mask = len(slots) - 1
+        self._size = len(offsets) - 1
+
+    def __getitem__(self, term: str) -> int:
+        if not isinstance(term, str):
+            raise KeyError(term)
+        key = term.encode("utf-8", "surrogatepass")
+        offsets, slots, mask = self._offsets, self._slots, self._mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            entry = slots[slot]
+            if entry == 0:
+                raise KeyError(term)
+            if self._strings[offsets[entry - 1]:offsets[entry]] == key:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def __iter__(self) -> Iterator[str]:
+        offsets = np.asarray(self._offsets).tolist()
+        strings = bytes(self._strings[:offsets[-1]])
+        for start, end in zip(offsets, offsets[1:]):
+            yield strings[start:end].decode("utf-8")
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __reduce__(self):
+        # Memory views cannot be pickled; a plain dict is all a copy needs
+        return (dict, ({term: index for index, term in enumerate(self)},))
+
+
+def _pad(size: int) -> int:
+    return (-size) % _ALIGNMENT
+
+
+def _hash_index(terms) -> np.ndarray:
+    slots = np.zeros(1 << max(len(terms) * 2 - 1, 1).bit_length(), dtype="<u4")
+    mask = len(slots) - 1
+    for index, term in enumerate(terms):
+        slot = zlib.crc32(term) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = index + 1
+    return slots
+
+
+def _serializable_params(vectorizer: TfidfVectorizer) -> Dict[str, Any]:
+    params = vectorizer.get_params()
+    for name in ("preprocessor", "tokenizer", "vocabulary"):
+        if params.get(name) is not None:
+            raise ValueError(f"Cannot persist TfidfVectorizer with a custom '{name}'")
+    if callable(params.get("analyzer")):
+        raise ValueError("Cannot persist TfidfVectorizer with a callable analyzer")
+
+    persisted = {name: params[name] for name in _PERSISTED_PARAMS}
+    if isinstance(persisted["stop_words"], (set, frozenset)):
+        persisted["stop_words"] = sorted(persisted["stop_words"])
+    persisted["ngram_range"] = list(persisted["ngram_range"])
+    persisted["dtype"] = np.dtype(params["dtype"]).name
+    return persisted
+
+
+def save_state(path: str, vectorizer: TfidfVectorizer, is_fitted: bool):
+    """Write the vectorizer state to ``path`` in the mmap-able format.
+
+    The file is written next to the destination and renamed into place, so
+    workers that have the previous version mapped keep reading a consistent copy.
+    """
+    params = _serializable_params(vectorizer)
+
+    if is_fitted:
+        terms = sorted(
+            (term.encode("utf-8") for term in vectorizer.vocabulary_),
+        )
+        idf = np.ascontiguousarray(vectorizer.idf_, dtype="<f8")
+    else:
+        terms = []
+        idf = np.zeros(0, dtype="<f8")
+
+    offsets = np.zeros(len(terms) + 1, dtype="<u8")
+    if terms:
+        offsets[1:] = np.cumsum([len(term) for term in terms])
+    strings = b"".join(terms)
+    slots = _hash_index(terms)
+
+    header = {
+        "is_fitted": is_fitted,
+        "n_terms": len(terms),
+        "n_slots": len(slots),
+        "params": params,
+    }
+    # Section offsets depend on the header length, so size the header with
+    # placeholder offsets first and then fill in the real values.
+    sections = {"idf_offset": 0, "offsets_offset": 0, "slots_offset": 0, "strings_offset": 0}
+    header.update({key: 2 ** 62 for key in sections})
+    header_size = len(json.dumps(header).encode("utf-8"))
+    start = _PREAMBLE.size + header_size
+    start += _pad(start)
+    sections["idf_offset"] = start
+    sections["offsets_offset"] = start + idf.nbytes
+    sections["slots_offset"] = sections["offsets_offset"] + offsets.nbytes
+    sections["strings_offset"] = sections["slots_offset"] + slots.nbytes
+    header.update(sections)
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_size)
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b"\0" * (sections["idf_offset"] - f.tell()))
+            f.write(idf.tobytes())
+            f.write(offsets.tobytes())
+            f.write(slots.tobytes())
+            f.write(strings)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def is_state_file(path: str) -> bool:
+    """Return True if ``path`` starts with the preprocessor state magic."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_state(path: str) -> Tuple[TfidfVectorizer, bool]:
+    """Memory-map a state file and rebuild a ready-to-use vectorizer.
+
+    Returns the vectorizer and whether it was fitted when saved.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, header_len = _PREAMBLE.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a preprocessor state file")
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported preprocessor state version {version} "
+            f"(expected {FORMAT_VERSION})"
+        )
+    header = json.loads(bytes(mapped[_PREAMBLE.size:_PREAMBLE.size + header_len]))
+
+    params = dict(header["params"])
+    params["ngram_range"] = tuple(params["ngram_range"])
+    params["dtype"] = np.dtype(params["dtype"]).type
+    vectorizer = TfidfVectorizer(**params)
+
+    is_fitted = header["is_fitted"]
+    if is_fitted:
+        n_terms = header["n_terms"]
+        view = memoryview(mapped)
+        offsets_start = header["offsets_offset"]
+        offsets = view[offsets_start:offsets_start + 8 * (n_terms + 1)].cast("Q")
+        slots_start = header["slots_offset"]
+        slots = view[slots_start:slots_start + 4 * header["n_slots"]].cast("I")
+        strings = view[header["strings_offset"]:]
+        vectorizer.vocabulary_ = MappedVocabulary(strings, offsets, slots)
+        vectorizer.idf_ = np.frombuffer(
+            mapped, dtype="<f8", count=n_terms, offset=header["idf_offset"]
+        )
+
+    return vectorizer, is_fitted
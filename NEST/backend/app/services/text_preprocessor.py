@@ -1,32 +1,113 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional
+import os
 import re
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
+import threading
 import emoji
-from transformers import AutoTokenizer
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 import logging
-
-# Download required NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-    nltk.data.find('corpora/stopwords')
-    nltk.data.find('corpora/wordnet')
-except LookupError:
-    nltk.download('punkt')
-    nltk.download('stopwords')
-    nltk.download('wordnet')
+from . import preprocessor_state
 
 logger = logging.getLogger(__name__)
 
+# NLTK corpora and the BERT tokenizer are loaded lazily, once per process, and
+# shared by every TextPreprocessor instance. Set PREPROCESSOR_OFFLINE=1 (or
+# HF_HUB_OFFLINE=1) to forbid downloads and fail fast when data is missing.
+TOKENIZER_NAME = os.getenv("PREPROCESSOR_TOKENIZER", "bert-base-uncased")
+
+NLTK_RESOURCES = {
+    "punkt": "tokenizers/punkt",
+    "stopwords": "corpora/stopwords",
+    "wordnet": "corpora/wordnet",
+}
+
+_resources: Dict[str, Any] = {}
+_resources_lock = threading.Lock()
+
+
+def is_offline() -> bool:
+    """Return True when resource downloads are forbidden."""
+    return any(
+        os.getenv(name, "").lower() in ("1", "true", "yes")
+        for name in ("PREPROCESSOR_OFFLINE", "HF_HUB_OFFLINE")
+    )
+
+
+def _ensure_nltk_data(name: str):
+    """Make sure an NLTK corpus is available, downloading it only when allowed."""
+    import nltk
+
+    try:
+        nltk.data.find(NLTK_RESOURCES[name])
+    except LookupError:
+        if is_offline():
+            raise LookupError(
+                f"NLTK resource '{name}' is not installed and offline mode is enabled"
+            )
+        logger.info(f"Downloading NLTK resource '{name}'")
+        if not nltk.download(name, quiet=True):
+            raise LookupError(f"Failed to download NLTK resource '{name}'")
+
+
+def _load_stop_words():
+    _ensure_nltk_data("stopwords")
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+def _load_lemmatizer():
+    _ensure_nltk_data("wordnet")
+    from nltk.stem import WordNetLemmatizer
+    lemmatizer = WordNetLemmatizer()
+    # WordNet is itself a lazy corpus; touch it so the load happens here
+    lemmatizer.lemmatize("warmup")
+    return lemmatizer
+
+
+def _load_word_tokenize():
+    _ensure_nltk_data("punkt")
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
+
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(
+        TOKENIZER_NAME,
+        local_files_only=is_offline()
+    )
+
+
+_RESOURCE_LOADERS = {
+    "stop_words": _load_stop_words,
+    "lemmatizer": _load_lemmatizer,
+    "word_tokenize": _load_word_tokenize,
+    "tokenizer": _load_tokenizer,
+}
+
+
+def get_resource(name: str) -> Any:
+    """Return a shared preprocessing resource, loading it on first use."""
+    resource = _resources.get(name)
+    if resource is not None:
+        return resource
+
+    with _resources_lock:
+        resource = _resources.get(name)
+        if resource is None:
+            resource = _RESOURCE_LOADERS[name]()
+            _resources[name] = resource
+    return resource
+
+
+def warm_up(resources: Optional[Iterable[str]] = None):
+    """Load preprocessing resources ahead of time (e.g. at worker startup)."""
+    for name in resources or _RESOURCE_LOADERS:
+        get_resource(name)
+
+
 class TextPreprocessor:
     def __init__(self):
-        self.stop_words = set(stopwords.words('english'))
-        self.lemmatizer = WordNetLemmatizer()
-        self.tokenizer = AutoTokenizer.from_pretrained('bert-base-uncased')
         self.tfidf_vectorizer = TfidfVectorizer(
             max_features=10000,
             ngram_range=(1, 2),
@@ -35,6 +116,18 @@ class TextPreprocessor:
         )
         self.is_fitted = False
 
+    @property
+    def stop_words(self) -> frozenset:
+        return get_resource("stop_words")
+
+    @property
+    def lemmatizer(self):
+        return get_resource("lemmatizer")
+
+    @property
+    def tokenizer(self):
+        return get_resource("tokenizer")
+
     def preprocess_text(self, text: str) -> str:
         """Apply basic text preprocessing."""
         try:
@@ -63,13 +156,15 @@ class TextPreprocessor:
         """Tokenize and lemmatize text."""
         try:
             # Tokenize
-            tokens = word_tokenize(text)
+            tokens = get_resource("word_tokenize")(text)
             
             # Remove stopwords and lemmatize
+            stop_words = self.stop_words
+            lemmatizer = self.lemmatizer
             tokens = [
-                self.lemmatizer.lemmatize(token)
+                lemmatizer.lemmatize(token)
                 for token in tokens
-                if token not in self.stop_words and len(token) > 2
+                if token not in stop_words and len(token) > 2
             ]
             
             return tokens
@@ -152,26 +247,30 @@ class TextPreprocessor:
             return {}
 
     def save_preprocessor(self, path: str):
-        """Save the preprocessor state."""
+        """Save the preprocessor state in the versioned, mmap-able format."""
         try:
-            import pickle
-            with open(path, 'wb') as f:
-                pickle.dump({
-                    'tfidf_vectorizer': self.tfidf_vectorizer,
-                    'is_fitted': self.is_fitted
-                }, f)
+            preprocessor_state.save_state(path, self.tfidf_vectorizer, self.is_fitted)
         except Exception as e:
             logger.error(f"Error saving preprocessor: {str(e)}")
             raise
 
     def load_preprocessor(self, path: str):
-        """Load the preprocessor state."""
+        """Load the preprocessor state.
+
+        State files are memory-mapped so worker processes share their pages.
+        Legacy pickle files written by older versions are still accepted.
+        """
         try:
+            if preprocessor_state.is_state_file(path):
+                self.tfidf_vectorizer, self.is_fitted = preprocessor_state.load_state(path)
+                return
+
             import pickle
+            logger.warning(f"Loading legacy pickled preprocessor state from {path}")
             with open(path, 'rb') as f:
                 state = pickle.load(f)
                 self.tfidf_vectorizer = state['tfidf_vectorizer']
                 self.is_fitted = state['is_fitted']
         except Exception as e:
             logger.error(f"Error loading preprocessor: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
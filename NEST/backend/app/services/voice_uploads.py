@@ -0,0 +1,244 @@
+"""
+Resumable, chunked uploads of voice recordings.
+
+A client creates an upload with the total size, then sends the bytes in
+chunks, each tagged with the offset it starts at. Chunks are streamed
+from the request body to ``<upload_id>.part`` in ``.uploads`` under the
+recordings directory through a buffer of ``write_buffer`` bytes, so a
+worker holds at most that much of an upload in memory however large the
+recording is. After a dropped connection the client asks for the current
+offset (the size of the part file) and continues from there. When the
+last byte arrives the caller's ``on_complete`` callback records the
+upload (the emotion record) and only then is the part file moved to
+``<user_id>/<upload_id>.<ext>`` and the upload removed. If recording
+fails the upload stays complete but open: repeating the last PATCH, or
+sending an empty one at the final offset, completes it again, so
+``on_complete`` must be idempotent.
+
+Upload state lives on disk only, so it survives restarts; with several
+replicas the directory must be shared or uploads routed to one replica.
+Uploads left unfinished for ``expire_after`` seconds are deleted.
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+from pathlib import Path
+import asyncio
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+import logging
+from starlette.concurrency import run_in_threadpool
+from app.services.audio_streaming import AUDIO_MEDIA_TYPES
+
+logger = logging.getLogger(__name__)
+
+VOICE_RECORDINGS_DIR = Path(os.getenv("VOICE_RECORDINGS_DIR", "/app/data/voice_recordings"))
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+class UploadNotFound(Exception):
+    pass
+
+class UploadOffsetMismatch(Exception):
+    """The chunk does not start where the upload currently ends."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+class UploadTooLarge(Exception):
+    pass
+
+class VoiceUploadStore:
+    """Disk-backed resumable uploads; see the module docstring."""
+
+    def __init__(
+        self,
+        base_dir: Path = VOICE_RECORDINGS_DIR,
+        max_size: int = 50 * 1024 * 1024,
+        max_chunk_size: int = 8 * 1024 * 1024,
+        write_buffer: int = 1024 * 1024,
+        expire_after: float = 24 * 3600
+    ):
+        self.base_dir = Path(base_dir)
+        self.upload_dir = self.base_dir / ".uploads"
+        self.max_size = max_size
+        self.max_chunk_size = max_chunk_size
+        self.write_buffer = write_buffer
+        self.expire_after = expire_after
+        # One writer per upload at a time (within this process)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _paths(self, upload_id: str):
+        if not _UPLOAD_ID.match(upload_id):
+            raise UploadNotFound(upload_id)
+        return self.upload_dir / f"{upload_id}.json", self.upload_dir / f"{upload_id}.part"
+
+    def _load(self, upload_id: str) -> Dict:
+        meta_path, part_path = self._paths(upload_id)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                upload = json.load(f)
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        try:
+            upload["offset"] = part_path.stat().st_size
+        except FileNotFoundError:
+            # Moved into place, but removing the upload did not happen
+            if not (self.base_dir / self.recording_path(upload)).exists():
+                raise UploadNotFound(upload_id)
+            upload["offset"] = upload["size"]
+        return upload
+
+    @staticmethod
+    def recording_path(upload: Dict) -> str:
+        """Where the finished recording goes, relative to the recordings
+        directory (what EmotionRecord.voice_file_path holds)."""
+        return f"{upload['user_id']}/{upload['upload_id']}.{upload['extension']}"
+
+    def create(self, user_id: int, size: int, extension: str, text_content: Optional[str] = None) -> Dict:
+        """Start an upload of ``size`` bytes; raises ValueError or UploadTooLarge."""
+        extension = extension.lower().lstrip(".")
+        if f".{extension}" not in AUDIO_MEDIA_TYPES:
+            raise ValueError(f"Unsupported audio format: {extension}")
+        if size <= 0:
+            raise ValueError("size must be positive")
+        if size > self.max_size:
+            raise UploadTooLarge(f"Recordings are limited to {self.max_size} bytes")
+
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self.purge_expired()
+        upload = {
+            "upload_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "size": size,
+            "extension": extension,
+            "text_content": text_content,
+            "created_at": time.time()
+        }
+        meta_path, part_path = self._paths(upload["upload_id"])
+        part_path.touch()
+        # Metadata last and atomically: an upload exists once its .json does
+        fd, tmp_path = tempfile.mkstemp(dir=self.upload_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(upload, f)
+        os.replace(tmp_path, meta_path)
+        return dict(upload, offset=0)
+
+    def status(self, upload_id: str) -> Dict:
+        """The upload with its current ``offset``; raises UploadNotFound."""
+        return self._load(upload_id)
+
+    async def write_chunk(
+        self,
+        upload_id: str,
+        offset: int,
+        chunks: AsyncIterator[bytes],
+        on_complete: Optional[Callable[[Dict], Awaitable[Any]]] = None
+    ) -> Dict:
+        """
+        Append the streamed chunk, which must start at the current offset.
+        Raises UploadNotFound, UploadOffsetMismatch or UploadTooLarge (chunk
+        over ``max_chunk_size`` or past the declared size). Bytes received
+        before an error or a dropped connection are kept.
+
+        Once all bytes are in, the returned upload carries
+        ``voice_file_path`` and ``on_complete(upload)`` is awaited, still
+        holding the upload's lock; its result is returned as ``completed``
+        and the upload is then moved into place. An exception from
+        ``on_complete`` propagates and leaves the upload open.
+        """
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            upload = self._load(upload_id)
+            if offset != upload["offset"]:
+                raise UploadOffsetMismatch(upload["offset"])
+            _, part_path = self._paths(upload_id)
+
+            # None when all bytes are in and only finishing is left (any
+            # bytes sent anyway are past the declared size)
+            f = await run_in_threadpool(open, part_path, "ab") if offset < upload["size"] else None
+            received = 0
+            buffer = bytearray()
+            try:
+                async for chunk in chunks:
+                    received += len(chunk)
+                    if received > self.max_chunk_size:
+                        raise UploadTooLarge(f"Chunks are limited to {self.max_chunk_size} bytes")
+                    if offset + received > upload["size"]:
+                        raise UploadTooLarge(f"Upload is {upload['size']} bytes")
+                    buffer += chunk
+                    if len(buffer) >= self.write_buffer:
+                        await run_in_threadpool(f.write, bytes(buffer))
+                        buffer.clear()
+            finally:
+                if f is not None:
+                    if buffer:
+                        await run_in_threadpool(f.write, bytes(buffer))
+                    await run_in_threadpool(f.close)
+            upload["offset"] = offset + received
+            if upload["offset"] == upload["size"]:
+                upload["voice_file_path"] = self.recording_path(upload)
+                if on_complete is not None:
+                    upload["completed"] = await on_complete(upload)
+                await run_in_threadpool(self._finish, upload)
+            return upload
+
+    def _finish(self, upload: Dict):
+        meta_path, part_path = self._paths(upload["upload_id"])
+        destination = self.base_dir / upload["voice_file_path"]
+        if part_path.exists():
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            with open(part_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(part_path, destination)
+        meta_path.unlink(missing_ok=True)
+        self._locks.pop(upload["upload_id"], None)
+
+    def delete(self, upload_id: str):
+        meta_path, part_path = self._paths(upload_id)
+        if not meta_path.exists() or not part_path.exists():
+            # Missing, or already moved into place (it may be recorded)
+            raise UploadNotFound(upload_id)
+        meta_path.unlink()
+        part_path.unlink(missing_ok=True)
+        self._locks.pop(upload_id, None)
+
+    def purge_expired(self) -> int:
+        """
+        Delete uploads older than ``expire_after`` that never completed, or
+        that completed without being recorded; returns how many.
+        """
+        cutoff = time.time() - self.expire_after
+        purged = 0
+        for path in self.upload_dir.glob("*.json"):
+            part_path = path.with_suffix(".part")
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    continue
+                # Not part_path.stat(): a moved upload only leaves its metadata
+                if part_path.exists() and part_path.stat().st_mtime >= cutoff:
+                    continue
+                part_path.unlink(missing_ok=True)
+                path.unlink()
+                self._locks.pop(path.stem, None)
+                purged += 1
+            except FileNotFoundError:
+                continue
+        if purged:
+            logger.info(f"Purged {purged} expired voice uploads")
+        return purged
+
+_upload_store: Optional[VoiceUploadStore] = None
+
+def get_upload_store() -> VoiceUploadStore:
+    """Return the process-wide voice upload store."""
+    global _upload_store
+    if _upload_store is None:
+        _upload_store = VoiceUploadStore(
+            max_size=int(os.getenv("VOICE_UPLOAD_MAX_SIZE", str(50 * 1024 * 1024))),
+            max_chunk_size=int(os.getenv("VOICE_UPLOAD_MAX_CHUNK", str(8 * 1024 * 1024)))
+        )
+    return _upload_store
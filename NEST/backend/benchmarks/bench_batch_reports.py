@@ -0,0 +1,80 @@
+"""
+Benchmark nightly report generation on a synthetic user base.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_batch_reports --users 100000 --days 30 --workers 4
+
+Rollup rows with the shape the nightly job streams from Postgres are
+generated lazily, user by user, and fed through the same chunked pipeline
+(generate_reports()); the sink only counts the JSON it would store, so
+the numbers cover report building, not database I/O.
+"""
+import argparse
+import json
+from datetime import date, datetime, timedelta
+import numpy as np
+from analytics.batch_reports import generate_reports
+
+EMOTIONS = ["joy", "sadness", "anger", "fear", "surprise", "neutral"]
+
+def daily_rows(users: int, days: int, block: int = 1000, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    dates = [date(2024, 1, 1) + timedelta(days=offset) for offset in range(days)]
+    for first in range(1, users + 1, block):
+        # Each user writes on about 70% of days, 1-5 entries a day
+        user_ids, offsets = np.nonzero(rng.random((min(block, users + 1 - first), days)) < 0.7)
+        counts = rng.integers(1, 6, len(user_ids))
+        sentiment = rng.normal(0, 0.4, len(user_ids))
+        histograms = rng.multinomial(counts, [1 / len(EMOTIONS)] * len(EMOTIONS))
+        for user_id, offset, count, mean, histogram in zip(
+            (user_ids + first).tolist(), offsets.tolist(), counts.tolist(), sentiment.tolist(), histograms.tolist()
+        ):
+            yield (
+                user_id,
+                dates[offset],
+                count,
+                mean * count,
+                (mean * mean + 0.1) * count,
+                {emotion: n for emotion, n in zip(EMOTIONS, histogram) if n}
+            )
+
+def hourly_rows(users: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    # Eight distinct hours per user
+    hours = np.sort(rng.random((users, 24)).argsort(axis=1)[:, :8], axis=1)
+    counts = rng.integers(1, 10, (users, 8))
+    sums = rng.normal(0, 0.3, (users, 8)) * counts
+    for index in range(users):
+        for hour, count, total in zip(hours[index].tolist(), counts[index].tolist(), sums[index].tolist()):
+            yield index + 1, hour, count, total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-users", type=int, default=5000)
+    args = parser.parse_args()
+
+    stored = {"reports": 0, "bytes": 0}
+
+    def sink(results):
+        stored["reports"] += len(results)
+        stored["bytes"] += sum(len(report) for _, report in results)
+
+    end_date = datetime(2024, 1, 1) + timedelta(days=args.days)
+    metrics = generate_reports(
+        daily_rows(args.users, args.days),
+        hourly_rows(args.users),
+        datetime(2024, 1, 1),
+        end_date,
+        sink,
+        chunk_users=args.chunk_users,
+        workers=args.workers
+    )
+    assert stored["reports"] == args.users, "missing reports"
+    metrics["report_mb"] = round(stored["bytes"] / 2 ** 20, 1)
+    print(json.dumps(metrics))
+
+if __name__ == "__main__":
+    main()
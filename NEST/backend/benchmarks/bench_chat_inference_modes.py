@@ -0,0 +1,58 @@
+"""
+Compare chat model memory and decoding speed across inference modes.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_chat_inference_modes --model TinyLlama/TinyLlama-1.1B-Chat-v1.0 --modes fp32 bf16 int8
+
+Each mode is loaded fresh, then a fixed prompt is decoded greedily for
+``--new-tokens`` tokens. Reported memory is the size of the weights and
+buffers (quantized weights counted at their packed size).
+"""
+import argparse
+import os
+import time
+import torch
+from ml.model_registry import INFERENCE_MODES, load_chat_model
+
+PROMPT = "I have been feeling anxious about work lately and I can't sleep."
+
+def bench_mode(model_name: str, mode: str, new_tokens: int, runs: int):
+    handle = load_chat_model(model_name, mode)
+    encoded = handle.tokenizer(PROMPT, return_tensors="pt").to(handle.device)
+    inputs = {"input_ids": encoded["input_ids"], "attention_mask": encoded["attention_mask"]}
+    generate_kwargs = {
+        "max_new_tokens": new_tokens,
+        "min_new_tokens": new_tokens,
+        "do_sample": False,
+        "pad_token_id": handle.tokenizer.eos_token_id
+    }
+
+    with torch.no_grad():
+        handle.model.generate(**inputs, max_new_tokens=2, do_sample=False,
+                              pad_token_id=handle.tokenizer.eos_token_id)
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            handle.model.generate(**inputs, **generate_kwargs)
+            timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    result = handle.info()
+    result["tokens_per_second"] = round(new_tokens / best, 1)
+    print(result)
+    del handle
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.getenv("BENCH_CHAT_MODEL", "TinyLlama/TinyLlama-1.1B-Chat-v1.0"))
+    parser.add_argument("--modes", nargs="+", default=["fp32", "bf16", "int8"], choices=INFERENCE_MODES)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"model={args.model} threads={torch.get_num_threads()}")
+    for mode in args.modes:
+        bench_mode(args.model, mode, args.new_tokens, args.runs)
+
+if __name__ == "__main__":
+    main()
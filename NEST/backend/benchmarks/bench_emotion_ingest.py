@@ -0,0 +1,72 @@
+"""
+Compare per-record and bulk emotion ingestion throughput.
+
+Usage (from the backend directory, against a scratch Postgres database
+with the application tables created):
+    python -m benchmarks.bench_emotion_ingest --entries 2000 --user-id 1
+
+Entries carry precomputed emotion_data so the numbers measure database
+work only. Rows written by the benchmark are deleted afterwards, and the
+user's rollups are rebuilt.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+import models
+from analytics.emotion_rollups import rebuild_rollups
+from analytics.emotion_tracker import EmotionTracker
+from database import SessionLocal
+
+EMOTIONS = ["joy", "sadness", "anger", "fear", "surprise", "neutral"]
+
+def make_entries(count: int):
+    now = datetime.utcnow()
+    return [
+        {
+            "text_content": "benchmark entry",
+            "timestamp": now - timedelta(minutes=random.randint(0, 60 * 24 * 30)),
+            "emotion_data": {
+                "dominant_emotion": random.choice(EMOTIONS),
+                "sentiment_score": random.uniform(-1, 1)
+            }
+        }
+        for _ in range(count)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--user-id", type=int, default=1)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    # Precomputed emotion_data means the analyzer is never called
+    tracker = EmotionTracker(db, emotion_analyzer=object())
+    entries = make_entries(args.entries)
+    created_ids = []
+    try:
+        start = time.perf_counter()
+        for entry in entries:
+            record = tracker.record_emotion(
+                args.user_id,
+                text_content=entry["text_content"],
+                emotion_data=entry["emotion_data"]
+            )
+            created_ids.append(record.id)
+        single = time.perf_counter() - start
+        print(f"record_emotion:       {args.entries / single:.0f} rows/s")
+
+        result = tracker.record_emotions_bulk(args.user_id, entries)
+        created_ids.extend(result["ids"])
+        print(f"record_emotions_bulk: {result['rows_per_second']:.0f} rows/s")
+    finally:
+        db.query(models.EmotionRecord).filter(
+            models.EmotionRecord.id.in_(created_ids)
+        ).delete(synchronize_session=False)
+        db.commit()
+        rebuild_rollups(db, args.user_id)
+        db.close()
+
+if __name__ == "__main__":
+    main()
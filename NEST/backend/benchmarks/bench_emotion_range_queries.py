@@ -0,0 +1,127 @@
+"""
+Compare per-user range-query latency on emotion_records before and after
+the typed columns and composite index.
+
+Usage (from the backend directory, against a scratch Postgres database):
+    python -m benchmarks.bench_emotion_range_queries --rows 1000000 --users 1000
+
+A synthetic table (``bench_emotion_records``, dropped afterwards unless
+``--keep`` is given) is filled with ``--rows`` rows spread over
+``--users`` users and ``--days`` days. The same 30-day daily-average
+query is then timed for random users:
+
+- before: JSON extraction from emotion_data, only the primary key index
+- after:  typed columns with the (user_id, timestamp) INCLUDE index
+"""
+import argparse
+import random
+import statistics
+import time
+from sqlalchemy import create_engine, text
+
+TABLE = "bench_emotion_records"
+
+SETUP = [
+    f"DROP TABLE IF EXISTS {TABLE}",
+    f"""
+    CREATE TABLE {TABLE} (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER,
+        timestamp TIMESTAMP,
+        emotion_data JSON,
+        text_content VARCHAR,
+        voice_file_path VARCHAR
+    )
+    """,
+    f"""
+    INSERT INTO {TABLE} (user_id, timestamp, emotion_data, text_content)
+    SELECT
+        (random() * (:users - 1))::int + 1,
+        now() - random() * make_interval(days => :days),
+        json_build_object(
+            'dominant_emotion', (ARRAY['joy', 'sadness', 'anger', 'fear', 'surprise', 'neutral'])[1 + (random() * 5)::int],
+            'sentiment_score', random() * 2 - 1,
+            'emotion_scores', json_build_object('joy', random(), 'sadness', random(), 'anger', random())
+        ),
+        repeat('journal entry ', 10 + (random() * 40)::int)
+    FROM generate_series(1, :rows)
+    """,
+    f"ANALYZE {TABLE}"
+]
+
+MIGRATE = [
+    f"ALTER TABLE {TABLE} ADD COLUMN dominant_emotion VARCHAR(32), ADD COLUMN sentiment_score DOUBLE PRECISION",
+    f"""
+    UPDATE {TABLE}
+    SET dominant_emotion = emotion_data->>'dominant_emotion',
+        sentiment_score = (emotion_data->>'sentiment_score')::float
+    """,
+    f"CREATE INDEX ON {TABLE} (user_id, timestamp) INCLUDE (sentiment_score, dominant_emotion)",
+    f"VACUUM ANALYZE {TABLE}"
+]
+
+QUERY_BEFORE = f"""
+SELECT date_trunc('day', timestamp), AVG((emotion_data->>'sentiment_score')::float),
+       mode() WITHIN GROUP (ORDER BY emotion_data->>'dominant_emotion')
+FROM {TABLE}
+WHERE user_id = :user_id AND timestamp >= now() - interval '30 days'
+GROUP BY 1
+"""
+
+QUERY_AFTER = f"""
+SELECT date_trunc('day', timestamp), AVG(sentiment_score),
+       mode() WITHIN GROUP (ORDER BY dominant_emotion)
+FROM {TABLE}
+WHERE user_id = :user_id AND timestamp >= now() - interval '30 days'
+GROUP BY 1
+"""
+
+def time_queries(conn, query: str, user_ids) -> dict:
+    timings = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        conn.execute(text(query), {"user_id": user_id}).all()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+        "max_ms": round(timings[-1], 2)
+    }
+
+def main():
+    from database import SQLALCHEMY_DATABASE_URL
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=SQLALCHEMY_DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    user_ids = [random.randint(1, args.users) for _ in range(args.queries)]
+    params = {"rows": args.rows, "users": args.users, "days": args.days}
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        start = time.perf_counter()
+        for statement in SETUP:
+            conn.execute(text(statement), params)
+        print(f"rows={args.rows} users={args.users} days={args.days} setup={time.perf_counter() - start:.1f}s")
+
+        print("before:", time_queries(conn, QUERY_BEFORE, user_ids))
+
+        start = time.perf_counter()
+        for statement in MIGRATE:
+            conn.execute(text(statement))
+        print(f"migration={time.perf_counter() - start:.1f}s")
+
+        print("after: ", time_queries(conn, QUERY_AFTER, user_ids))
+
+        if not args.keep:
+            conn.execute(text(f"DROP TABLE {TABLE}"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Benchmark the vectorized exercise recommender on a synthetic catalog.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_exercise_recommender --exercises 10000 --users 1000
+
+The catalog is written to a temporary JSON file and synthetic user
+profiles replace the database reads, so the timings cover feature
+building, scoring, top-k selection and the per-user cache. A sample of
+rankings is checked against scoring each exercise in a Python loop.
+"""
+import argparse
+import json
+import math
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from exercises.catalog import ExerciseCatalog
+from exercises.recommender import (
+    DIFFICULTY_LEVELS,
+    EMOTION_TAG_ALIASES,
+    WEIGHTS,
+    ExerciseRecommender,
+    UserProfile,
+    score_exercises
+)
+
+TAGS = ["anxiety", "stress", "anger", "sadness", "sleep", "focus", "grief", "loneliness"]
+EMOTIONS = ["joy", "sadness", "anger", "fear", "surprise", "neutral"]
+TYPES = ["meditation", "breathing"]
+
+def make_catalog(count: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    difficulties = list(DIFFICULTY_LEVELS)
+    return {
+        f"exercise_{i}": {
+            "id": f"exercise_{i}",
+            "title": f"Exercise {i}",
+            "description": "Synthetic exercise",
+            "duration": int(rng.integers(2, 61)) * 60,
+            "type": TYPES[int(rng.integers(len(TYPES)))],
+            "difficulty": difficulties[int(rng.integers(len(difficulties)))],
+            "audio_url": None,
+            "instructions": [],
+            "benefits": [],
+            "emotion_tags": [str(tag) for tag in rng.choice(TAGS, int(rng.integers(1, 4)), replace=False)]
+        }
+        for i in range(count)
+    }
+
+def make_profile(rng, exercise_ids, now: datetime) -> UserProfile:
+    shares = rng.dirichlet(np.ones(len(EMOTIONS)))
+    history = {}
+    for exercise_id in rng.choice(exercise_ids, int(rng.integers(0, 40)), replace=False):
+        started = int(rng.integers(1, 6))
+        completed = int(rng.integers(0, started + 1))
+        last = now - timedelta(hours=float(rng.uniform(1, 24 * 60))) if completed else None
+        history[str(exercise_id)] = (started, completed, last)
+    types = {}
+    for exercise_type in TYPES:
+        started = int(rng.integers(0, 50))
+        types[exercise_type] = (started, int(rng.integers(0, started + 1)))
+    return UserProfile(dict(zip(EMOTIONS, shares)), history, types, float(rng.integers(5, 30)) * 60)
+
+def reference_scores(exercises, profile: UserProfile, now: datetime):
+    """Reference: the same score computed one exercise at a time."""
+    distribution = {}
+    for emotion, share in profile.emotions.items():
+        tag = EMOTION_TAG_ALIASES.get(emotion, emotion)
+        distribution[tag] = distribution.get(tag, 0.0) + share
+    total = sum(share for tag, share in distribution.items() if tag in TAGS)
+    level = 0.0 if profile.completed < 10 else 1.0 if profile.completed < 40 else 2.0
+    scores = []
+    for exercise in exercises:
+        tags = exercise["emotion_tags"]
+        emotion = sum(distribution.get(tag, 0.0) for tag in tags) / math.sqrt(len(tags)) / total if total else 0.0
+        duration = math.exp(-((math.log(exercise["duration"]) - math.log(profile.typical_duration)) ** 2) / 0.5)
+        started, completed, last = profile.exercise_history.get(exercise["id"], (None, None, None))
+        history = (completed + 1.0) / (started + 2.0) - 0.5 if started is not None else 0.0
+        repeat = 1.0 if last is not None and now - last < timedelta(days=1) else 0.0
+        type_started, type_completed = profile.type_history.get(exercise["type"], (None, None))
+        type_preference = (type_completed + 1.0) / (type_started + 2.0) - 0.5 if type_started is not None else 0.0
+        difficulty = -abs(DIFFICULTY_LEVELS[exercise["difficulty"]] - level)
+        scores.append(
+            WEIGHTS["emotion"] * emotion + WEIGHTS["duration"] * duration + WEIGHTS["history"] * history
+            + WEIGHTS["type"] * type_preference + WEIGHTS["difficulty"] * difficulty - WEIGHTS["repeat"] * repeat
+        )
+    return np.array(scores)
+
+def percentile_ms(samples, q: float) -> float:
+    return float(np.percentile(samples, q)) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exercises", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--check-sample", type=int, default=20)
+    args = parser.parse_args()
+
+    data = make_catalog(args.exercises)
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    try:
+        catalog = ExerciseCatalog(path)
+    finally:
+        os.unlink(path)
+
+    now = datetime.utcnow()
+    rng = np.random.default_rng(1)
+    exercise_ids = list(data)
+    profiles = {user_id: make_profile(rng, exercise_ids, now) for user_id in range(args.users)}
+
+    recommender = ExerciseRecommender(catalog=catalog, max_users=args.users)
+    recommender.load_profile = profiles.__getitem__
+
+    start = time.perf_counter()
+    features = recommender.features()
+    print(f"exercises={args.exercises} users={args.users} k={args.k}")
+    print(f"feature matrix: {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({features.emotion.shape[0]}x{features.emotion.shape[1]} tags)")
+
+    timings = {"cold": [], "cached": []}
+    for kind in timings:
+        for user_id in range(args.users):
+            started = time.perf_counter()
+            recommender.recommend(user_id, args.k)
+            timings[kind].append(time.perf_counter() - started)
+    for kind, samples in timings.items():
+        print(f"{kind:>6}: p50 {percentile_ms(samples, 50):.3f} ms  p99 {percentile_ms(samples, 99):.3f} ms")
+
+    exercises = list(data.values())
+    loop = []
+    for user_id in range(args.check_sample):
+        started = time.perf_counter()
+        expected = reference_scores(exercises, profiles[user_id], now)
+        loop.append(time.perf_counter() - started)
+        actual = score_exercises(features, profiles[user_id], now=now)
+        assert np.allclose(actual, expected, atol=1e-4), "scores differ"
+    print(f"per-exercise loop: p50 {percentile_ms(loop, 50):.1f} ms (scores match on {args.check_sample} users)")
+    print("metrics:", recommender.get_metrics())
+
+if __name__ == "__main__":
+    main()
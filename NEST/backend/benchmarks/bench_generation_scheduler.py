@@ -0,0 +1,113 @@
+"""
+Benchmark continuous batching against one-request-at-a-time generation.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_generation_scheduler --model sshleifer/tiny-gpt2
+
+Both modes serve the same prompts from ``--concurrency`` client threads. The
+baseline serializes ``model.generate`` calls behind a lock, which is what
+concurrent ChatBot.generate_response calls do today.
+"""
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import argparse
+import os
+import time
+import numpy as np
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from ml.generation_scheduler import GenerationScheduler, SamplingParams
+
+PROMPTS = [
+    "I have been feeling anxious about work lately",
+    "I can't sleep at night",
+    "Today was a good day and I feel happy",
+    "My friends don't understand me",
+    "How can I calm down before an exam?",
+    "I feel lonely in the evenings",
+]
+
+def _summarize(name: str, latencies: List[float], tokens: int, wall: float) -> Dict:
+    latencies_ms = np.array(latencies) * 1000
+    result = {
+        "mode": name,
+        "requests": len(latencies),
+        "tokens_per_second": round(tokens / wall, 1),
+        "p50_latency_ms": round(float(np.percentile(latencies_ms, 50)), 1),
+        "p95_latency_ms": round(float(np.percentile(latencies_ms, 95)), 1),
+        "wall_time_s": round(wall, 2)
+    }
+    print(result)
+    return result
+
+def run_sequential(model, tokenizer, prompts: List[List[int]], concurrency: int, max_new_tokens: int) -> Dict:
+    lock = Lock()
+
+    def _request(input_ids: List[int]):
+        start = time.perf_counter()
+        with lock, torch.no_grad():
+            inputs = torch.tensor([input_ids])
+            outputs = model.generate(
+                inputs,
+                attention_mask=torch.ones_like(inputs),
+                max_new_tokens=max_new_tokens,
+                min_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.eos_token_id
+            )
+        return time.perf_counter() - start, outputs.shape[1] - len(input_ids)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(_request, prompts))
+    wall = time.perf_counter() - start
+    return _summarize("sequential", [r[0] for r in results], sum(r[1] for r in results), wall)
+
+def run_batched(model, tokenizer, prompts: List[List[int]], concurrency: int, max_new_tokens: int) -> Dict:
+    scheduler = GenerationScheduler(
+        model,
+        tokenizer,
+        max_batch_size=concurrency,
+        max_queue_size=len(prompts)
+    )
+    params = SamplingParams(max_new_tokens=max_new_tokens, do_sample=False, ignore_eos=True)
+
+    def _request(input_ids: List[int]):
+        start = time.perf_counter()
+        result = scheduler.generate(input_ids, params)
+        return time.perf_counter() - start, result["generated_tokens"]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(_request, prompts))
+    wall = time.perf_counter() - start
+    scheduler.stop()
+    summary = _summarize("continuous_batching", [r[0] for r in results], sum(r[1] for r in results), wall)
+    print({"average_batch_size": round(scheduler.get_metrics()["average_batch_size"], 2)})
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.getenv("BENCH_CHAT_MODEL", "sshleifer/tiny-gpt2"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model)
+    model.eval()
+
+    prompts = [
+        tokenizer(PROMPTS[i % len(PROMPTS)])["input_ids"]
+        for i in range(args.requests)
+    ]
+    print(f"model={args.model} concurrency={args.concurrency} requests={args.requests} "
+          f"max_new_tokens={args.max_new_tokens} threads={torch.get_num_threads()}")
+    run_sequential(model, tokenizer, prompts, args.concurrency, args.max_new_tokens)
+    run_batched(model, tokenizer, prompts, args.concurrency, args.max_new_tokens)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from typing import Any, Callable, Dict, Optional
+from collections import deque
+from threading import Lock, RLock, local
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from pymongo import MongoClient
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from pymongo import MongoClient, monitoring
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,8 +22,13 @@ POSTGRES_DB = os.getenv("POSTGRES_DB", "nest")
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async engine for async endpoints: queries await the driver instead of
+# blocking the event loop. ASYNC_DATABASE_URL overrides the URL, e.g.
+# sqlite+aiosqlite:///./test.db for local tests.
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+)
 
 Base = declarative_base()
 
@@ -25,16 +36,280 @@ Base = declarative_base()
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB = os.getenv("MONGO_DB", "nest")
 
-mongo_client = MongoClient(MONGO_URI)
-mongo_db = mongo_client[MONGO_DB]
+def _env_int(name: str, default: Optional[str]) -> Optional[int]:
+    value = os.getenv(name, default)
+    return int(value) if value not in (None, "") else None
+
+def _sql_pool_settings(prefix: str) -> Dict[str, Any]:
+    # ASYNC_DB_* settings fall back to the DB_* ones
+    def setting(name: str, default: str) -> str:
+        return os.getenv(f"{prefix}_{name}", os.getenv(f"DB_{name}", default))
+
+    return {
+        "pool_size": int(setting("POOL_SIZE", "5")),
+        "max_overflow": int(setting("MAX_OVERFLOW", "10")),
+        "pool_timeout": float(setting("POOL_TIMEOUT", "30")),
+        "pool_recycle": int(setting("POOL_RECYCLE", "1800")),
+        "pool_pre_ping": setting("POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    }
+
+def _mongo_pool_settings() -> Dict[str, Any]:
+    settings = {
+        "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE", "100"),
+        "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE", "0"),
+        # Connections being established at once (the burst above idle ones)
+        "maxConnecting": _env_int("MONGO_MAX_CONNECTING", "2"),
+        # Idle connections are closed and reopened, like pool_recycle
+        "maxIdleTimeMS": _env_int("MONGO_MAX_IDLE_TIME_MS", "300000"),
+        "waitQueueTimeoutMS": _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", None),
+        # How often servers are checked, the closest thing to pre-ping
+        "heartbeatFrequencyMS": _env_int("MONGO_HEARTBEAT_FREQUENCY_MS", "10000"),
+        "serverSelectionTimeoutMS": _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000")
+    }
+    return {name: value for name, value in settings.items() if value is not None}
+
+class PoolStats:
+    """Connection pool counters: checkouts, wait time, overflow and timeouts."""
+
+    def __init__(self, name: str, settings: Dict[str, Any]):
+        self.name = name
+        self.settings = settings
+        self._lock = Lock()
+        self._waits = deque(maxlen=1024)
+        self._counters = {
+            "checkouts": 0,
+            "checked_out": 0,
+            "max_checked_out": 0,
+            "overflow_checkouts": 0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_closed": 0
+        }
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def record_checkout(self, wait_seconds: float, overflow: bool = False):
+        with self._lock:
+            counters = self._counters
+            counters["checkouts"] += 1
+            counters["checked_out"] += 1
+            counters["max_checked_out"] = max(counters["max_checked_out"], counters["checked_out"])
+            if overflow:
+                counters["overflow_checkouts"] += 1
+            self._waits.append(wait_seconds)
+            self._wait_total += wait_seconds
+            self._wait_max = max(self._wait_max, wait_seconds)
+
+    def record_checkin(self):
+        with self._lock:
+            self._counters["checked_out"] = max(self._counters["checked_out"] - 1, 0)
+
+    def record(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def snapshot(self, pool_status: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._counters)
+            waits = sorted(self._waits)
+            wait_total, wait_max = self._wait_total, self._wait_max
+        checkouts = metrics["checkouts"]
+        metrics["wait_ms"] = {
+            "avg": round(wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+            "p95": round(waits[int(len(waits) * 0.95)] * 1000, 3) if waits else 0.0,
+            "max": round(wait_max * 1000, 3)
+        }
+        metrics["settings"] = self.settings
+        if pool_status:
+            metrics["pool"] = pool_status
+        return metrics
+
+class _InstrumentedPoolMixin:
+    """Times pool.connect(), i.e. the wait for a free (or new) connection."""
+
+    stats: Optional[PoolStats] = None
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.record("timeouts")
+            raise
+        if self.stats is not None:
+            # overflow() counts connections above pool_size
+            self.stats.record_checkout(time.perf_counter() - started, overflow=self.overflow() > 0)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() replaces the pool; keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+def _instrument_engine(sync_engine, stats: PoolStats):
+    sync_engine.pool.stats = stats
+    # Engine-level pool listeners carry over to recreated pools
+    event.listen(sync_engine, "checkin", lambda *args: stats.record_checkin())
+    event.listen(sync_engine, "connect", lambda *args: stats.record("connections_created"))
+    event.listen(sync_engine, "close", lambda *args: stats.record("connections_closed"))
+
+def _sql_pool_status(sync_engine) -> Dict[str, Any]:
+    pool = sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0)
+    }
+
+class _MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Feeds pymongo connection pool events into PoolStats."""
+
+    def __init__(self, stats: PoolStats):
+        self.stats = stats
+        # Checkout started/finished events are published on the calling thread
+        self._started = local()
+
+    def connection_check_out_started(self, event):
+        self._started.at = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._started, "at", None)
+        self.stats.record_checkout(time.perf_counter() - started if started is not None else 0.0)
+
+    def connection_check_out_failed(self, event):
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            self.stats.record("timeouts")
+
+    def connection_checked_in(self, event):
+        self.stats.record_checkin()
+
+    def connection_created(self, event):
+        self.stats.record("connections_created")
+
+    def connection_closed(self, event):
+        self.stats.record("connections_closed")
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+# Engines and clients are created on first use, so importing this module
+# (models, analytics, training workers) opens no connections
+_resources: Dict[str, Any] = {}
+_pool_stats: Dict[str, PoolStats] = {}
+# Reentrant: factories get the resources they build on (SessionLocal -> engine)
+_resources_lock = RLock()
+
+def _lazy(name: str, factory: Callable[[], Any]) -> Any:
+    resource = _resources.get(name)
+    if resource is None:
+        with _resources_lock:
+            resource = _resources.get(name)
+            if resource is None:
+                resource = _resources[name] = factory()
+    return resource
+
+def _create_engine():
+    settings = _sql_pool_settings("DB")
+    sync_engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, **settings)
+    _pool_stats["postgres"] = PoolStats("postgres", settings)
+    _instrument_engine(sync_engine, _pool_stats["postgres"])
+    return sync_engine
+
+def _create_async_engine():
+    if ASYNC_SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+        # SQLite picks its own pool; there is nothing to size
+        return create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+    settings = _sql_pool_settings("ASYNC_DB")
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **settings)
+    _pool_stats["postgres_async"] = PoolStats("postgres_async", settings)
+    _instrument_engine(async_engine.sync_engine, _pool_stats["postgres_async"])
+    return async_engine
+
+def _create_mongo_client():
+    settings = _mongo_pool_settings()
+    _pool_stats["mongo"] = PoolStats("mongo", settings)
+    return MongoClient(MONGO_URI, event_listeners=[_MongoPoolListener(_pool_stats["mongo"])], **settings)
+
+def get_engine():
+    return _lazy("engine", _create_engine)
+
+def get_async_engine():
+    return _lazy("async_engine", _create_async_engine)
+
+def get_session_factory():
+    return _lazy("SessionLocal", lambda: sessionmaker(autocommit=False, autoflush=False, bind=get_engine()))
+
+def get_async_session_factory():
+    # Objects stay usable after commit; reloading them would need another await
+    return _lazy("AsyncSessionLocal", lambda: async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False))
+
+def get_mongo_client():
+    return _lazy("mongo_client", _create_mongo_client)
+
+# `from database import engine` (or SessionLocal, mongo_db, ...) still works
+# and creates the resource at that point
+_LAZY_ATTRIBUTES = {
+    "engine": get_engine,
+    "async_engine": get_async_engine,
+    "SessionLocal": get_session_factory,
+    "AsyncSessionLocal": get_async_session_factory,
+    "mongo_client": get_mongo_client,
+    "mongo_db": lambda: get_mongo_db()
+}
+
+def __getattr__(name: str):
+    factory = _LAZY_ATTRIBUTES.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return factory()
 
 # Database Dependency
 def get_db():
-    db = SessionLocal()
+    db = get_session_factory()()
     try:
         yield db
     finally:
         db.close()
 
+async def get_async_db():
+    async with get_async_session_factory()() as db:
+        yield db
+
 def get_mongo_db():
-    return mongo_db 
\ No newline at end of file
+    return get_mongo_client()[MONGO_DB]
+
+def get_pool_metrics() -> Dict[str, Any]:
+    """
+    Metrics of the pools this process has opened so far (pools are created
+    lazily, so unused stores are absent).
+    """
+    metrics = {"pid": os.getpid()}
+    engines = {"postgres": _resources.get("engine"), "postgres_async": _resources.get("async_engine")}
+    for name, stats in list(_pool_stats.items()):
+        pool_status = None
+        bound = engines.get(name)
+        if bound is not None:
+            pool_status = _sql_pool_status(getattr(bound, "sync_engine", bound))
+        metrics[name] = stats.snapshot(pool_status)
+    return metrics
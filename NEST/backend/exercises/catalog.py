@@ -0,0 +1,219 @@
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from threading import Lock
+import json
+import os
+import time
+import logging
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Next to this module, so loading does not depend on the working directory
+DEFAULT_CATALOG_PATH = Path(__file__).with_name("meditation_exercises.json")
+
+class Exercise(BaseModel):
+    id: str
+    title: str
+    description: str
+    duration: int  # in seconds
+    type: str  # "meditation" or "breathing"
+    difficulty: str  # "beginner", "intermediate", "advanced"
+    audio_url: Optional[str]
+    instructions: List[str]
+    benefits: List[str]
+    emotion_tags: List[str] = []  # emotions the exercise helps with, e.g. "anxiety"
+
+# Used when no catalog file exists
+DEFAULT_EXERCISES = {
+    "mindfulness_breathing": {
+        "id": "mindfulness_breathing",
+        "title": "Mindfulness Breathing",
+        "description": "A simple breathing exercise to help you focus and relax",
+        "duration": 300,  # 5 minutes
+        "type": "breathing",
+        "difficulty": "beginner",
+        "audio_url": None,
+        "instructions": [
+            "Find a comfortable position",
+            "Close your eyes",
+            "Breathe in slowly through your nose for 4 counts",
+            "Hold your breath for 2 counts",
+            "Exhale slowly through your mouth for 6 counts",
+            "Repeat for the duration of the exercise"
+        ],
+        "benefits": [
+            "Reduces stress and anxiety",
+            "Improves focus and concentration",
+            "Promotes relaxation"
+        ],
+        "emotion_tags": ["anxiety", "stress", "anger"]
+    },
+    "body_scan": {
+        "id": "body_scan",
+        "title": "Body Scan Meditation",
+        "description": "A guided meditation to help you become aware of physical sensations",
+        "duration": 600,  # 10 minutes
+        "type": "meditation",
+        "difficulty": "beginner",
+        "audio_url": None,
+        "instructions": [
+            "Lie down in a comfortable position",
+            "Close your eyes",
+            "Focus on your breath for a few moments",
+            "Slowly scan your body from head to toe",
+            "Notice any sensations without judgment",
+            "Return to your breath when finished"
+        ],
+        "benefits": [
+            "Increases body awareness",
+            "Reduces physical tension",
+            "Promotes relaxation"
+        ],
+        "emotion_tags": ["anxiety", "stress", "sadness"]
+    }
+}
+
+def _index(exercises: Iterable[Exercise], keys) -> Dict[str, FrozenSet[str]]:
+    index: Dict[str, set] = {}
+    for exercise in exercises:
+        for key in keys(exercise):
+            index.setdefault(key, set()).add(exercise.id)
+    return {key: frozenset(ids) for key, ids in index.items()}
+
+class CatalogSnapshot:
+    """
+    One immutable version of the catalog with its secondary indexes.
+
+    Readers take a snapshot reference once per query, so a reload swapping
+    in a new snapshot never exposes a half-built index.
+    """
+
+    def __init__(self, exercises: Dict[str, Exercise], signature: Optional[Tuple[int, int]] = None):
+        self.exercises = exercises
+        self.signature = signature
+        self.position = {exercise_id: i for i, exercise_id in enumerate(exercises)}
+        values = list(exercises.values())
+        self.by_type = _index(values, lambda exercise: [exercise.type])
+        self.by_difficulty = _index(values, lambda exercise: [exercise.difficulty])
+        self.by_emotion = _index(values, lambda exercise: exercise.emotion_tags)
+        # Sorted (duration, id) pairs for range lookups with bisect
+        by_duration = sorted((exercise.duration, exercise.id) for exercise in values)
+        self._durations = [duration for duration, _ in by_duration]
+        self._duration_ids = [exercise_id for _, exercise_id in by_duration]
+
+    def ids_in_duration_range(self, min_duration: Optional[int], max_duration: Optional[int]) -> FrozenSet[str]:
+        lo = bisect_left(self._durations, min_duration) if min_duration is not None else 0
+        hi = bisect_right(self._durations, max_duration) if max_duration is not None else len(self._durations)
+        return frozenset(self._duration_ids[lo:hi])
+
+    def query(
+        self,
+        exercise_type: Optional[str] = None,
+        difficulty: Optional[str] = None,
+        emotion: Optional[str] = None,
+        min_duration: Optional[int] = None,
+        max_duration: Optional[int] = None
+    ) -> List[Exercise]:
+        """Exercises matching every given filter, in catalog order."""
+        candidates: List[FrozenSet[str]] = []
+        if exercise_type is not None:
+            candidates.append(self.by_type.get(exercise_type, frozenset()))
+        if difficulty is not None:
+            candidates.append(self.by_difficulty.get(difficulty, frozenset()))
+        if emotion is not None:
+            candidates.append(self.by_emotion.get(emotion, frozenset()))
+        if min_duration is not None or max_duration is not None:
+            candidates.append(self.ids_in_duration_range(min_duration, max_duration))
+
+        if not candidates:
+            return list(self.exercises.values())
+
+        # Intersect starting from the most selective index
+        candidates.sort(key=len)
+        ids = set(candidates[0])
+        for other in candidates[1:]:
+            if not ids:
+                break
+            ids &= other
+        return [self.exercises[exercise_id] for exercise_id in sorted(ids, key=self.position.__getitem__)]
+
+class ExerciseCatalog:
+    """
+    Meditation and breathing exercises loaded from a JSON file
+    (``{exercise_id: exercise}``), indexed by type, difficulty, emotion tag
+    and duration.
+
+    The file's modification time and size are checked at most every
+    ``check_interval`` seconds; when they change, a new snapshot is built
+    and swapped in atomically. A file that fails to parse or validate is
+    logged and the previous snapshot stays in use.
+    """
+
+    def __init__(self, path: Optional[str] = None, check_interval: float = 2.0):
+        self.path = Path(path or os.getenv("MEDITATION_EXERCISES_FILE", DEFAULT_CATALOG_PATH))
+        self.check_interval = check_interval
+        self._reload_lock = Lock()
+        self._checked_at = 0.0
+        self._failed_signature = None
+        self._snapshot = self._load(self._signature())
+
+    def _signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self, signature: Optional[Tuple[int, int]]) -> CatalogSnapshot:
+        if signature is None:
+            data = DEFAULT_EXERCISES
+        else:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        exercises = {exercise_id: Exercise(**exercise_data) for exercise_id, exercise_data in data.items()}
+        return CatalogSnapshot(exercises, signature)
+
+    def reload(self, force: bool = False) -> bool:
+        """Rebuild the snapshot if the file changed; returns whether it did."""
+        with self._reload_lock:
+            self._checked_at = time.monotonic()
+            signature = self._signature()
+            if not force and signature in (self._snapshot.signature, self._failed_signature):
+                return False
+            try:
+                snapshot = self._load(signature)
+            except Exception as e:
+                # Not retried until the file changes again
+                self._failed_signature = signature
+                logger.error(f"Error reloading exercise catalog {self.path}: {str(e)}")
+                return False
+            self._snapshot = snapshot
+        logger.info(f"Loaded {len(snapshot.exercises)} exercises from {self.path if signature else 'defaults'}")
+        return True
+
+    def snapshot(self) -> CatalogSnapshot:
+        """The current snapshot, reloading first if the file may have changed."""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        return self._snapshot
+
+    def get(self, exercise_id: str) -> Optional[Exercise]:
+        return self.snapshot().exercises.get(exercise_id)
+
+    def query(self, **filters) -> List[Exercise]:
+        """See CatalogSnapshot.query()."""
+        return self.snapshot().query(**filters)
+
+_catalog: Optional[ExerciseCatalog] = None
+_catalog_lock = Lock()
+
+def get_exercise_catalog() -> ExerciseCatalog:
+    """Return the process-wide exercise catalog."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ExerciseCatalog()
+    return _catalog
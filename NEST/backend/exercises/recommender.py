@@ -0,0 +1,369 @@
+"""
+Personalized exercise recommendations.
+
+The catalog is turned into a feature matrix once per catalog snapshot:
+emotion tags (one row per exercise, L2-normalized), type, difficulty
+level and log duration. A user is described by their emotion
+distribution over the last ``emotion_days`` days (from the daily
+rollups) and their meditation session history: completion rates per
+exercise and per type, recent completions and their typical duration.
+Ranking scores every exercise with a handful of array operations and
+takes the top k with argpartition, so it costs about the same for ten or
+ten thousand exercises.
+
+Profiles and rankings are cached per user until invalidate_user() is
+called (new emotion records, flushed sessions) or ``max_age`` passes,
+which also bounds staleness from writes made by other processes.
+Invalidations are tracked with versions from one recommender-wide
+counter, kept for the ``max_versions`` most recently invalidated users;
+users evicted from that table get the counter's value at the last
+eviction, which is never lower than a version they had, so a profile
+loaded before an invalidation can never look current.
+"""
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+import math
+import time
+import numpy as np
+from sqlalchemy import case, func, select
+import models
+from exercises.catalog import CatalogSnapshot, ExerciseCatalog, get_exercise_catalog
+
+DIFFICULTY_LEVELS = {"beginner": 0, "intermediate": 1, "advanced": 2}
+
+# Analyzer emotions that exercises are tagged under another name
+EMOTION_TAG_ALIASES = {"fear": "anxiety"}
+
+# Rankings cached per user, one per (k, emotion, preferred_duration)
+MAX_RANKINGS_PER_USER = 16
+
+# Relative weight of each score component
+WEIGHTS = {
+    "emotion": 3.0,
+    "duration": 1.0,
+    "history": 1.5,
+    "type": 1.0,
+    "difficulty": 0.5,
+    "repeat": 1.0
+}
+
+class CatalogFeatures:
+    """Feature arrays of one catalog snapshot, row i being exercise ``ids[i]``."""
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.snapshot = snapshot
+        exercises = list(snapshot.exercises.values())
+        self.ids = [exercise.id for exercise in exercises]
+        self.position = snapshot.position
+
+        tags = sorted({tag for exercise in exercises for tag in exercise.emotion_tags})
+        self.tag_columns = {tag: column for column, tag in enumerate(tags)}
+        self.emotion = np.zeros((len(exercises), len(tags)), dtype=np.float32)
+        for row, exercise in enumerate(exercises):
+            for tag in exercise.emotion_tags:
+                self.emotion[row, self.tag_columns[tag]] = 1.0
+        # Exercises tagged for many emotions should not outrank focused ones
+        norms = np.linalg.norm(self.emotion, axis=1, keepdims=True)
+        np.divide(self.emotion, norms, out=self.emotion, where=norms > 0)
+
+        types = sorted({exercise.type for exercise in exercises})
+        self.type_columns = {exercise_type: column for column, exercise_type in enumerate(types)}
+        self.type_index = np.array([self.type_columns[exercise.type] for exercise in exercises], dtype=np.int64)
+        self.difficulty = np.array(
+            [DIFFICULTY_LEVELS.get(exercise.difficulty, 0) for exercise in exercises],
+            dtype=np.float32
+        )
+        self.log_duration = np.log(np.maximum([exercise.duration for exercise in exercises], 1)).astype(np.float32)
+
+    def emotion_vector(self, distribution: Dict[str, float]) -> np.ndarray:
+        vector = np.zeros(len(self.tag_columns), dtype=np.float32)
+        for emotion, share in distribution.items():
+            column = self.tag_columns.get(EMOTION_TAG_ALIASES.get(emotion, emotion))
+            if column is not None:
+                vector[column] += share
+        return vector
+
+class UserProfile:
+    """What ranking needs to know about a user, independent of the catalog."""
+
+    def __init__(
+        self,
+        emotions: Dict[str, float],
+        exercise_history: Dict[str, Tuple[int, int, Optional[datetime]]],
+        type_history: Dict[str, Tuple[int, int]],
+        typical_duration: Optional[float]
+    ):
+        self.emotions = emotions  # emotion -> share of recent records
+        self.exercise_history = exercise_history  # exercise_id -> (started, completed, last completed)
+        self.type_history = type_history  # type -> (started, completed)
+        self.typical_duration = typical_duration  # average completed duration in seconds
+        self.completed = sum(completed for _, completed, _ in exercise_history.values())
+
+def _completion_rate(started: np.ndarray, completed: np.ndarray) -> np.ndarray:
+    # Smoothed towards 0.5 so a single abandoned session is not damning
+    return (completed + 1.0) / (started + 2.0) - 0.5
+
+def score_exercises(
+    features: CatalogFeatures,
+    profile: UserProfile,
+    emotion: Optional[str] = None,
+    preferred_duration: Optional[int] = None,
+    now: Optional[datetime] = None
+) -> np.ndarray:
+    """Score of every exercise for the user, aligned with ``features.ids``."""
+    n = len(features.ids)
+    now = now or datetime.utcnow()
+
+    # Emotional need: recent distribution, with the current emotion (if
+    # given) counting as much as all of it
+    distribution = dict(profile.emotions)
+    if emotion:
+        distribution[emotion] = distribution.get(emotion, 0.0) + 1.0
+    emotion_vector = features.emotion_vector(distribution)
+    total = emotion_vector.sum()
+    emotion_match = features.emotion @ (emotion_vector / total) if total > 0 else np.zeros(n, dtype=np.float32)
+
+    # Gaussian fit on log duration: half the score at ~1.8x or ~0.55x the target
+    target = preferred_duration or profile.typical_duration
+    duration_fit = (
+        np.exp(-((features.log_duration - math.log(max(target, 1))) ** 2) / 0.5)
+        if target else np.zeros(n, dtype=np.float32)
+    )
+
+    # Per-exercise and per-type completion rates
+    history = np.zeros(n, dtype=np.float32)
+    repeat = np.zeros(n, dtype=np.float32)
+    if profile.exercise_history:
+        rows, started, completed, recent = [], [], [], []
+        for exercise_id, (n_started, n_completed, last_completed) in profile.exercise_history.items():
+            row = features.position.get(exercise_id)
+            if row is None:
+                continue
+            rows.append(row)
+            started.append(n_started)
+            completed.append(n_completed)
+            recent.append(last_completed is not None and now - last_completed < timedelta(days=1))
+        rows = np.array(rows, dtype=np.int64)
+        history[rows] = _completion_rate(np.array(started, dtype=np.float32), np.array(completed, dtype=np.float32))
+        # Some variety: exercises completed in the last day rank lower
+        repeat[rows] = np.array(recent, dtype=np.float32)
+
+    type_preference = np.zeros(len(features.type_columns), dtype=np.float32)
+    for exercise_type, (n_started, n_completed) in profile.type_history.items():
+        column = features.type_columns.get(exercise_type)
+        if column is not None:
+            type_preference[column] = (n_completed + 1.0) / (n_started + 2.0) - 0.5
+
+    # Difficulty grows with the number of completed sessions
+    level = 0.0 if profile.completed < 10 else 1.0 if profile.completed < 40 else 2.0
+    difficulty_fit = -np.abs(features.difficulty - level)
+
+    return (
+        WEIGHTS["emotion"] * emotion_match
+        + WEIGHTS["duration"] * duration_fit
+        + WEIGHTS["history"] * history
+        + WEIGHTS["type"] * type_preference[features.type_index]
+        + WEIGHTS["difficulty"] * difficulty_fit
+        - WEIGHTS["repeat"] * repeat
+    )
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (ties in catalog order)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+class _CachedUser:
+    def __init__(self, version: int, profile: UserProfile):
+        self.version = version
+        self.profile = profile
+        self.created_at = time.monotonic()
+        self.snapshot: Optional[CatalogSnapshot] = None
+        self.rankings: Dict[Tuple, List[Dict]] = {}
+
+class ExerciseRecommender:
+    """Ranks the exercise catalog for a user; see the module docstring."""
+
+    def __init__(
+        self,
+        catalog: Optional[ExerciseCatalog] = None,
+        session_factory=None,
+        emotion_days: int = 14,
+        history_days: int = 90,
+        max_age: float = 900.0,
+        max_users: int = 10000,
+        max_versions: int = 65536
+    ):
+        self.catalog = catalog or get_exercise_catalog()
+        self.emotion_days = emotion_days
+        self.history_days = history_days
+        self.max_age = max_age
+        self.max_users = max_users
+        self.max_versions = max_versions
+        self._session_factory = session_factory
+        self._features: Optional[CatalogFeatures] = None
+        self._features_lock = Lock()
+        self._users: "OrderedDict[int, _CachedUser]" = OrderedDict()
+        self._versions: "OrderedDict[int, int]" = OrderedDict()
+        self._version_counter = 0
+        self._evicted_version = 0
+        self._lock = Lock()
+        self._metrics = {"hits": 0, "ranked": 0, "profiles_loaded": 0, "invalidations": 0}
+
+    def features(self) -> CatalogFeatures:
+        """Feature arrays of the current catalog snapshot, rebuilt after a reload."""
+        snapshot = self.catalog.snapshot()
+        features = self._features
+        if features is None or features.snapshot is not snapshot:
+            with self._features_lock:
+                features = self._features
+                if features is None or features.snapshot is not snapshot:
+                    features = self._features = CatalogFeatures(snapshot)
+        return features
+
+    def invalidate_user(self, user_id: int):
+        """Drop the user's cached profile and rankings; call when they have new data."""
+        with self._lock:
+            self._version_counter += 1
+            self._versions[user_id] = self._version_counter
+            self._versions.move_to_end(user_id)
+            while len(self._versions) > self.max_versions:
+                self._versions.popitem(last=False)
+                self._evicted_version = self._version_counter
+            self._users.pop(user_id, None)
+            self._metrics["invalidations"] += 1
+
+    def load_profile(self, user_id: int) -> UserProfile:
+        """Read the user's recent emotions and session history (two queries)."""
+        if self._session_factory is None:
+            from database import get_session_factory
+            self._session_factory = get_session_factory()
+        now = datetime.utcnow()
+        rollups = models.EmotionDailyRollup
+        sessions = models.MeditationSession
+        completed = sessions.end_time.isnot(None)
+
+        db = self._session_factory()
+        try:
+            emotion_rows = db.execute(
+                select(rollups.emotion_counts)
+                .where(rollups.user_id == user_id, rollups.day >= (now - timedelta(days=self.emotion_days)).date())
+            ).scalars().all()
+            session_rows = db.execute(
+                select(
+                    sessions.exercise_id,
+                    sessions.session_type,
+                    func.count().label("started"),
+                    func.count(sessions.end_time).label("completed"),
+                    func.max(sessions.end_time).label("last_completed"),
+                    func.avg(case((completed, sessions.duration))).label("avg_duration")
+                )
+                .where(sessions.user_id == user_id, sessions.start_time >= now - timedelta(days=self.history_days))
+                .group_by(sessions.exercise_id, sessions.session_type)
+            ).all()
+        finally:
+            db.close()
+
+        counts: Dict[str, float] = {}
+        for emotion_counts in emotion_rows:
+            for emotion, count in (emotion_counts or {}).items():
+                counts[emotion] = counts.get(emotion, 0.0) + count
+        total = sum(counts.values())
+        emotions = {emotion: count / total for emotion, count in counts.items()} if total else {}
+
+        exercise_history: Dict[str, Tuple[int, int, Optional[datetime]]] = {}
+        type_history: Dict[str, Tuple[int, int]] = {}
+        duration_sum = duration_weight = 0.0
+        for row in session_rows:
+            if row.exercise_id:
+                exercise_history[row.exercise_id] = (row.started, row.completed, row.last_completed)
+            if row.session_type:
+                type_started, type_completed = type_history.get(row.session_type, (0, 0))
+                type_history[row.session_type] = (type_started + row.started, type_completed + row.completed)
+            if row.avg_duration is not None:
+                duration_sum += float(row.avg_duration) * row.completed
+                duration_weight += row.completed
+        typical_duration = duration_sum / duration_weight if duration_weight else None
+        return UserProfile(emotions, exercise_history, type_history, typical_duration)
+
+    def _cached_user(self, user_id: int) -> _CachedUser:
+        with self._lock:
+            version = self._versions.get(user_id, self._evicted_version)
+            cached = self._users.get(user_id)
+            if cached is not None and cached.version == version and time.monotonic() - cached.created_at < self.max_age:
+                self._users.move_to_end(user_id)
+                return cached
+
+        profile = self.load_profile(user_id)
+        cached = _CachedUser(version, profile)
+        with self._lock:
+            self._metrics["profiles_loaded"] += 1
+            # Only keep it if no invalidation happened while loading
+            if self._versions.get(user_id, self._evicted_version) == version:
+                self._users[user_id] = cached
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        return cached
+
+    def recommend(
+        self,
+        user_id: int,
+        k: int = 5,
+        emotion: Optional[str] = None,
+        preferred_duration: Optional[int] = None
+    ) -> List[Dict]:
+        """The user's top ``k`` exercises as ``{"exercise", "score"}``, best first."""
+        cached = self._cached_user(user_id)
+        features = self.features()
+        key = (k, emotion, preferred_duration)
+
+        with self._lock:
+            if cached.snapshot is features.snapshot and key in cached.rankings:
+                self._metrics["hits"] += 1
+                return cached.rankings[key]
+
+        scores = score_exercises(features, cached.profile, emotion, preferred_duration)
+        exercises = features.snapshot.exercises
+        ranking = [
+            {"exercise": exercises[features.ids[index]], "score": round(float(scores[index]), 4)}
+            for index in top_k(scores, k)
+        ]
+        with self._lock:
+            self._metrics["ranked"] += 1
+            if cached.snapshot is not features.snapshot:
+                # The catalog changed; earlier rankings refer to the old one
+                cached.snapshot = features.snapshot
+                cached.rankings = {}
+            if len(cached.rankings) >= MAX_RANKINGS_PER_USER:
+                cached.rankings.clear()
+            cached.rankings[key] = ranking
+        return ranking
+
+    def get_metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._metrics, cached_users=len(self._users))
+
+_recommender: Optional[ExerciseRecommender] = None
+_recommender_lock = Lock()
+
+def get_recommender() -> ExerciseRecommender:
+    """Return the process-wide exercise recommender."""
+    global _recommender
+    if _recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                _recommender = ExerciseRecommender()
+    return _recommender
+
+def invalidate_recommendations(user_id: int):
+    """Tell the recommender the user has new data, if it is in use in this process."""
+    if _recommender is not None:
+        _recommender.invalidate_user(user_id)
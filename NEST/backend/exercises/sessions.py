@@ -0,0 +1,349 @@
+"""
+Meditation session tracking with a write-behind buffer.
+
+Starting or completing a session only updates in-memory state: the
+session goes into a per-user index of active sessions and a row change
+goes into a pending buffer. A background thread flushes the buffer every
+``flush_interval`` seconds (or as soon as ``max_batch`` changes are
+waiting) as one transaction: a multi-row INSERT for new sessions and an
+executemany UPDATE for completions. A session completed before its start
+was flushed is written by a single INSERT.
+
+A failed flush puts its rows back into the buffer for the next attempt;
+rows the database rejects (constraint or data errors) are isolated and
+dropped one by one so they cannot block the rest. When the buffer holds
+``max_pending`` changes, new sessions are refused with SessionBufferFull
+instead of growing memory without bound. ``close()`` (called on
+shutdown) flushes whatever is left.
+
+The active index is per process. Completing a session this process does
+not know looks it up in the database, so with several replicas a
+completion can only miss a session started elsewhere during that
+replica's last flush interval.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+import time
+import uuid
+import logging
+from sqlalchemy import bindparam, exc, insert, select, update
+import models
+from exercises.meditation import MeditationManager
+from exercises.recommender import invalidate_recommendations
+
+logger = logging.getLogger(__name__)
+
+class SessionBufferFull(Exception):
+    """Too many session changes are waiting to be written; callers should answer 503."""
+
+_SESSIONS = models.MeditationSession.__table__
+
+_COMPLETE = (
+    update(_SESSIONS)
+    .where(_SESSIONS.c.session_key == bindparam("b_session_key"))
+    .values(
+        end_time=bindparam("b_end_time"),
+        duration=bindparam("b_duration"),
+        notes=bindparam("b_notes")
+    )
+)
+
+def _insert_row(session: Dict) -> Dict:
+    return {
+        "session_key": session["session_id"],
+        "user_id": session["user_id"],
+        "exercise_id": session["exercise"].id,
+        "session_type": session["exercise"].type,
+        "start_time": session["start_time"],
+        "planned_duration": session["exercise"].duration,
+        "end_time": None,
+        "duration": None,
+        "notes": None
+    }
+
+def _completion(session: Dict) -> Dict:
+    return {
+        "user_id": session["user_id"],
+        "end_time": session["end_time"],
+        "duration": int(round(session["actual_duration"])),
+        "notes": session.get("notes")
+    }
+
+def _update_params(session_key: str, completion: Dict) -> Dict:
+    return {
+        "b_session_key": session_key,
+        "b_end_time": completion["end_time"],
+        "b_duration": completion["duration"],
+        "b_notes": completion["notes"]
+    }
+
+class MeditationSessionService:
+    """Records meditation session starts and completions; see the module docstring."""
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable] = None,
+        manager: Optional[MeditationManager] = None,
+        flush_interval: float = 1.0,
+        max_batch: int = 500,
+        max_pending: int = 20000,
+        abandon_after: timedelta = timedelta(hours=6)
+    ):
+        self.manager = manager or MeditationManager()
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        # Active sessions older than this (past their expected end) are
+        # forgotten; their rows stay in the database without an end_time
+        self.abandon_after = abandon_after
+        self._session_factory = session_factory
+        self._lock = Lock()
+        # Only one flush runs at a time, so batches reach the database in order
+        self._flush_lock = Lock()
+        self._active: Dict[int, Dict[str, Dict]] = {}
+        self._pending_inserts: Dict[str, Dict] = {}
+        self._pending_updates: Dict[str, Dict] = {}
+        self._flush_times_ms: deque = deque(maxlen=256)
+        self._metrics = {
+            "started": 0,
+            "completed": 0,
+            "rejected_buffer_full": 0,
+            "flushes": 0,
+            "flush_failures": 0,
+            "rows_inserted": 0,
+            "rows_updated": 0,
+            "rows_dropped": 0
+        }
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread = Thread(target=self._flush_loop, name="meditation-session-flusher", daemon=True)
+        self._thread.start()
+
+    def _new_db_session(self):
+        if self._session_factory is None:
+            from database import get_session_factory
+            self._session_factory = get_session_factory()
+        return self._session_factory()
+
+    def _pending_count(self) -> int:
+        return len(self._pending_inserts) + len(self._pending_updates)
+
+    def start_session(self, user_id: int, exercise_id: str, start_time: Optional[datetime] = None) -> Dict:
+        """
+        Start a session and return it; ``session_id`` identifies it for
+        complete_session(). Raises ValueError for an unknown exercise and
+        SessionBufferFull when the write buffer is full.
+        """
+        session = self.manager.create_session(
+            exercise_id,
+            user_id,
+            start_time or datetime.utcnow(),
+            session_id=uuid.uuid4().hex
+        )
+        session["user_id"] = user_id
+        with self._lock:
+            if self._pending_count() >= self.max_pending:
+                self._metrics["rejected_buffer_full"] += 1
+                raise SessionBufferFull("Meditation sessions are not being saved fast enough, try again shortly")
+            self._active.setdefault(user_id, {})[session["session_id"]] = session
+            self._pending_inserts[session["session_id"]] = _insert_row(session)
+            self._metrics["started"] += 1
+            wake = self._pending_count() >= self.max_batch
+        if wake:
+            self._wake.set()
+        return session
+
+    def complete_session(self, user_id: int, session_id: str, notes: Optional[str] = None) -> Dict:
+        """
+        Complete an active session and return it with ``end_time`` and
+        ``actual_duration``. Raises LookupError when the user has no such
+        session in progress.
+        """
+        with self._lock:
+            session = self._active.get(user_id, {}).pop(session_id, None)
+        if session is None:
+            session = self._load_session(user_id, session_id)
+
+        session = self.manager.complete_session(session)
+        session["notes"] = notes
+        completion = _completion(session)
+        with self._lock:
+            pending_insert = self._pending_inserts.get(session_id)
+            if pending_insert is not None:
+                # Not written yet: insert the finished row in one go
+                pending_insert.update(completion)
+            else:
+                self._pending_updates[session_id] = completion
+            if not self._active.get(user_id, True):
+                del self._active[user_id]
+            self._metrics["completed"] += 1
+            wake = self._pending_count() >= self.max_batch
+        if wake:
+            self._wake.set()
+        return session
+
+    def _load_session(self, user_id: int, session_id: str) -> Dict:
+        # Started by another process, or before a restart
+        db = self._new_db_session()
+        try:
+            row = db.execute(
+                select(_SESSIONS.c.exercise_id, _SESSIONS.c.start_time)
+                .where(
+                    _SESSIONS.c.session_key == session_id,
+                    _SESSIONS.c.user_id == user_id,
+                    _SESSIONS.c.end_time.is_(None)
+                )
+            ).first()
+        finally:
+            db.close()
+        if row is None:
+            raise LookupError(f"No meditation session {session_id} in progress")
+        session = self.manager.create_session(row.exercise_id, user_id, row.start_time, session_id=session_id)
+        session["user_id"] = user_id
+        return session
+
+    def get_active_sessions(self, user_id: int) -> List[Dict]:
+        """Sessions of the user in progress in this process, oldest first."""
+        with self._lock:
+            sessions = list(self._active.get(user_id, {}).values())
+        return sorted(sessions, key=lambda session: session["start_time"])
+
+    def _expire_abandoned(self):
+        cutoff = datetime.utcnow() - self.abandon_after
+        with self._lock:
+            for user_id in list(self._active):
+                sessions = self._active[user_id]
+                for session_id in [key for key, session in sessions.items() if session["expected_end_time"] < cutoff]:
+                    del sessions[session_id]
+                if not sessions:
+                    del self._active[user_id]
+
+    def flush(self) -> Tuple[int, int]:
+        """Write the pending changes now; returns (rows inserted, rows updated)."""
+        with self._flush_lock:
+            with self._lock:
+                inserts, self._pending_inserts = self._pending_inserts, {}
+                updates, self._pending_updates = self._pending_updates, {}
+            if not inserts and not updates:
+                return 0, 0
+
+            started = time.perf_counter()
+            try:
+                inserted, updated = self._write(list(inserts.values()), updates)
+            except (exc.IntegrityError, exc.DataError) as e:
+                logger.error(f"Meditation session batch rejected, writing rows one by one: {str(e)}")
+                inserted, updated = self._write_isolated(list(inserts.values()), updates)
+            except Exception as e:
+                self._requeue(inserts, updates)
+                with self._lock:
+                    self._metrics["flush_failures"] += 1
+                logger.error(f"Error flushing {len(inserts) + len(updates)} meditation session changes: {str(e)}")
+                return 0, 0
+
+            with self._lock:
+                self._metrics["flushes"] += 1
+                self._metrics["rows_inserted"] += inserted
+                self._metrics["rows_updated"] += updated
+                self._flush_times_ms.append((time.perf_counter() - started) * 1000)
+            # Recommendations use the session history, which just changed
+            for user_id in {row["user_id"] for row in list(inserts.values()) + list(updates.values())}:
+                invalidate_recommendations(user_id)
+            return inserted, updated
+
+    def _write(self, insert_rows: List[Dict], updates: Dict[str, Dict]) -> Tuple[int, int]:
+        db = self._new_db_session()
+        try:
+            # Inserts first: an update may target a row inserted by a batch
+            # that failed and was put back
+            if insert_rows:
+                db.execute(insert(_SESSIONS), insert_rows)
+            if updates:
+                db.execute(_COMPLETE, [_update_params(key, completion) for key, completion in updates.items()])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return len(insert_rows), len(updates)
+
+    def _write_isolated(self, insert_rows: List[Dict], updates: Dict[str, Dict]) -> Tuple[int, int]:
+        inserted = updated = 0
+        for row in insert_rows:
+            inserted += self._write_one([row], {})
+        for key, completion in updates.items():
+            updated += self._write_one([], {key: completion})
+        return inserted, updated
+
+    def _write_one(self, insert_rows: List[Dict], updates: Dict[str, Dict]) -> int:
+        try:
+            self._write(insert_rows, updates)
+            return 1
+        except (exc.IntegrityError, exc.DataError) as e:
+            with self._lock:
+                self._metrics["rows_dropped"] += 1
+            logger.error(f"Dropping meditation session change {insert_rows or updates}: {str(e)}")
+        except Exception as e:
+            # The database went away meanwhile; retry with the next flush
+            self._requeue({row["session_key"]: row for row in insert_rows}, updates)
+            logger.error(f"Error writing meditation session change: {str(e)}")
+        return 0
+
+    def _requeue(self, inserts: Dict[str, Dict], updates: Dict[str, Dict]):
+        with self._lock:
+            for key, row in inserts.items():
+                # A completion that arrived after the swap went to the
+                # updates buffer; fold it back into the insert
+                completion = self._pending_updates.pop(key, None)
+                if completion is not None:
+                    row.update(completion)
+                self._pending_inserts[key] = row
+            for key, completion in updates.items():
+                self._pending_updates.setdefault(key, completion)
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            self._expire_abandoned()
+
+    def close(self, timeout: float = 10.0):
+        """Stop the background flusher and write the remaining changes."""
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self.flush()
+
+    def get_metrics(self) -> Dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["pending_inserts"] = len(self._pending_inserts)
+            metrics["pending_updates"] = len(self._pending_updates)
+            metrics["active_users"] = len(self._active)
+            metrics["active_sessions"] = sum(len(sessions) for sessions in self._active.values())
+            flush_times = sorted(self._flush_times_ms)
+        metrics["flush_ms"] = {
+            "avg": round(sum(flush_times) / len(flush_times), 3) if flush_times else 0.0,
+            "p95": round(flush_times[int(len(flush_times) * 0.95)], 3) if flush_times else 0.0
+        }
+        return metrics
+
+_session_service: Optional[MeditationSessionService] = None
+_session_service_lock = Lock()
+
+def get_session_service() -> MeditationSessionService:
+    """Return the process-wide meditation session service."""
+    global _session_service
+    if _session_service is None:
+        with _session_service_lock:
+            if _session_service is None:
+                _session_service = MeditationSessionService()
+    return _session_service
+
+def close_session_service():
+    """Flush and stop the process-wide service, if it was started."""
+    if _session_service is not None:
+        _session_service.close()
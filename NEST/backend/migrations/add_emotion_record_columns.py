@@ -0,0 +1,89 @@
+"""
+Add typed dominant_emotion/sentiment_score columns to emotion_records.
+
+Usage (from the backend directory):
+    python -m migrations.add_emotion_record_columns --batch-size 10000
+
+Steps, each safe to re-run:
+1. Add the nullable columns (a metadata-only change, no table rewrite).
+2. Backfill them from emotion_data in id ranges of ``--batch-size`` rows,
+   committing after every batch so locks stay short and an interrupted
+   run resumes where it stopped.
+3. Build the indexes with CREATE INDEX CONCURRENTLY so writes are not
+   blocked while they are built.
+"""
+import argparse
+import time
+import logging
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+ADD_COLUMNS = [
+    "ALTER TABLE emotion_records ADD COLUMN IF NOT EXISTS dominant_emotion VARCHAR(32)",
+    "ALTER TABLE emotion_records ADD COLUMN IF NOT EXISTS sentiment_score DOUBLE PRECISION"
+]
+
+BACKFILL_BATCH = """
+UPDATE emotion_records
+SET dominant_emotion = emotion_data->>'dominant_emotion',
+    sentiment_score = (emotion_data->>'sentiment_score')::float
+WHERE id > :start AND id <= :stop
+  AND sentiment_score IS NULL
+  AND emotion_data->>'sentiment_score' IS NOT NULL
+"""
+
+CREATE_INDEXES = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotion_records_user_id_timestamp "
+    "ON emotion_records (user_id, timestamp) INCLUDE (sentiment_score, dominant_emotion)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotion_records_dominant_emotion "
+    "ON emotion_records (dominant_emotion)"
+]
+
+def add_columns(engine: Engine):
+    with engine.begin() as conn:
+        for statement in ADD_COLUMNS:
+            conn.execute(text(statement))
+
+def backfill(engine: Engine, batch_size: int = 10000) -> int:
+    """Copy the JSON fields into the typed columns; returns the number of rows updated."""
+    with engine.connect() as conn:
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM emotion_records")).scalar_one()
+
+    updated = 0
+    start_time = time.perf_counter()
+    for start in range(0, max_id, batch_size):
+        with engine.begin() as conn:
+            result = conn.execute(text(BACKFILL_BATCH), {"start": start, "stop": start + batch_size})
+            updated += result.rowcount
+        if (start // batch_size) % 10 == 0:
+            logger.info(f"Backfilled up to id {min(start + batch_size, max_id)} of {max_id} "
+                        f"({updated} rows, {time.perf_counter() - start_time:.1f}s)")
+    return updated
+
+def create_indexes(engine: Engine):
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for statement in CREATE_INDEXES:
+            conn.execute(text(statement))
+        conn.execute(text("ANALYZE emotion_records"))
+
+def upgrade(engine: Engine, batch_size: int = 10000):
+    add_columns(engine)
+    updated = backfill(engine, batch_size)
+    create_indexes(engine)
+    logger.info(f"Migration complete, {updated} rows backfilled")
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine, args.batch_size)
+
+if __name__ == "__main__":
+    main()
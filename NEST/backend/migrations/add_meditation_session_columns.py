@@ -0,0 +1,58 @@
+"""
+Add the columns the write-behind session service (exercises.sessions)
+writes to meditation_sessions.
+
+Usage (from the backend directory):
+    python -m migrations.add_meditation_session_columns
+
+Steps, each safe to re-run:
+1. Add the nullable columns (a metadata-only change, no table rewrite).
+2. Build the unique index on session_key with CREATE UNIQUE INDEX
+   CONCURRENTLY so writes are not blocked while it is built.
+"""
+import argparse
+import logging
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+ADD_COLUMNS = [
+    "ALTER TABLE meditation_sessions ADD COLUMN IF NOT EXISTS session_key VARCHAR(32)",
+    "ALTER TABLE meditation_sessions ADD COLUMN IF NOT EXISTS exercise_id VARCHAR",
+    "ALTER TABLE meditation_sessions ADD COLUMN IF NOT EXISTS planned_duration INTEGER"
+]
+
+CREATE_INDEXES = [
+    # Same name as the constraint SQLAlchemy would create for unique=True
+    "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS meditation_sessions_session_key_key "
+    "ON meditation_sessions (session_key)"
+]
+
+def add_columns(engine: Engine):
+    with engine.begin() as conn:
+        for statement in ADD_COLUMNS:
+            conn.execute(text(statement))
+
+def create_indexes(engine: Engine):
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for statement in CREATE_INDEXES:
+            conn.execute(text(statement))
+
+def upgrade(engine: Engine):
+    add_columns(engine)
+    create_indexes(engine)
+    logger.info("Migration complete")
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Add the column the voice analysis pipeline (analytics.voice_analysis)
+claims emotion records with.
+
+Usage (from the backend directory):
+    python -m migrations.add_voice_claim_column
+
+Adding a nullable column is a metadata-only change (no table rewrite) and
+safe to re-run.
+"""
+import argparse
+import logging
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+ADD_COLUMNS = [
+    "ALTER TABLE emotion_records ADD COLUMN IF NOT EXISTS voice_claimed_until TIMESTAMP"
+]
+
+def add_columns(engine: Engine):
+    with engine.begin() as conn:
+        for statement in ADD_COLUMNS:
+            conn.execute(text(statement))
+
+def upgrade(engine: Engine):
+    add_columns(engine)
+    logger.info("Migration complete")
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
+
+if __name__ == "__main__":
+    main()
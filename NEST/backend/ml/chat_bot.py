@@ -1,23 +1,99 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer
+)
 import torch
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
+from threading import Event, Thread
+import time
 from dotenv import load_dotenv
 import json
+from ml.generation_scheduler import GenerationScheduler, SamplingParams, to_legacy_cache
+from ml.prefix_cache import PrefixCache
+from ml.context_manager import ContextWindowManager
+from ml.model_registry import get_chat_model
+from ml.safety_filter import SafetyFilter, get_safety_filter
+from ml.response_cache import ResponseCache
 
 load_dotenv()
 
+SYSTEM_PREFIX_KEY = "system"
+
+SAFETY_FALLBACK_RESPONSE = "I apologize, but I cannot process that input as it may violate our safety guidelines."
+
+class _CountingStreamer(TextIteratorStreamer):
+    """TextIteratorStreamer that also counts the generated tokens."""
+
+    def __init__(self, tokenizer, timeout: Optional[float] = None):
+        super().__init__(tokenizer, skip_prompt=True, timeout=timeout, skip_special_tokens=True)
+        self.token_count = 0
+        self.last_token: Optional[int] = None
+
+    def put(self, value):
+        if not (self.skip_prompt and self.next_tokens_are_prompt):
+            self.token_count += value.numel()
+            self.last_token = int(value.reshape(-1)[-1])
+        super().put(value)
+
+class _StopGeneration(StoppingCriteria):
+    """Stops generation once the event is set or the deadline has passed."""
+
+    def __init__(self, event: Optional[Event] = None, deadline: Optional[float] = None):
+        self.event = event
+        self.deadline = deadline
+        self.fired = False
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if self.event is not None and self.event.is_set():
+            self.fired = True
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.fired = True
+        return self.fired
+
 class ChatBot:
     def __init__(self):
-        self.model_name = os.getenv("CHAT_MODEL", "meta-llama/Llama-2-7b-chat-hf")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        
-        # Load model and tokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            device_map="auto"
+        # The model is loaded once per process and shared by every ChatBot
+        self.model_handle = get_chat_model()
+        self.model_name = self.model_handle.model_name
+        self.device = self.model_handle.device
+        self.tokenizer = self.model_handle.tokenizer
+        self.model = self.model_handle.model
+        
+        # Optionally merge concurrent requests into one decoding batch
+        self.scheduler = None
+        if os.getenv("CHAT_CONTINUOUS_BATCHING", "false").lower() == "true":
+            self.scheduler = GenerationScheduler(
+                self.model,
+                self.tokenizer,
+                max_batch_size=int(os.getenv("CHAT_MAX_BATCH_SIZE", "8")),
+                max_queue_size=int(os.getenv("CHAT_MAX_QUEUE_SIZE", "64"))
+            )
+        
+        # Reuse attention key/value state of the system prompt and session history
+        self.prefix_cache = None
+        prefix_cache_mb = int(os.getenv("CHAT_PREFIX_CACHE_MB", "512"))
+        if prefix_cache_mb > 0:
+            self.prefix_cache = PrefixCache(max_bytes=prefix_cache_mb * 1024 * 1024)
+        
+        # Opt-in cache of complete responses to common opening messages
+        self.response_cache = None
+        if os.getenv("CHAT_RESPONSE_CACHE", "false").lower() == "true":
+            self.response_cache = ResponseCache(
+                max_entries=int(os.getenv("CHAT_RESPONSE_CACHE_SIZE", "1024")),
+                ttl_seconds=float(os.getenv("CHAT_RESPONSE_CACHE_TTL", "3600")),
+                similarity_threshold=float(os.getenv("CHAT_RESPONSE_CACHE_THRESHOLD", "0.9")),
+                fuzzy=os.getenv("CHAT_RESPONSE_CACHE_FUZZY", "false").lower() == "true"
+            )
+        
+        # Keep prompts within the model's context window
+        self.max_new_tokens = int(os.getenv("CHAT_MAX_NEW_TOKENS", "512"))
+        context_length = getattr(self.model.config, "max_position_embeddings", 4096)
+        self.context_manager = ContextWindowManager(
+            self.tokenizer,
+            max_prompt_tokens=int(os.getenv("CHAT_MAX_PROMPT_TOKENS", str(context_length - self.max_new_tokens))),
+            summary_max_tokens=int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "256"))
         )
         
         # Load safety filters
@@ -35,28 +111,126 @@ class ChatBot:
 
 Remember to be compassionate, non-judgmental, and supportive."""
 
-    def _load_safety_filters(self) -> Dict:
+    def _load_safety_filters(self) -> SafetyFilter:
         """Load safety filters for content moderation"""
-        # TODO: Implement proper safety filters
-        return {
-            "harmful_content": True,
-            "medical_advice": True,
-            "personal_information": True
-        }
+        # Shared by every ChatBot; picks up rule file changes without a restart
+        return get_safety_filter()
 
     def _apply_safety_filters(self, text: str) -> bool:
         """
         Apply safety filters to the text.
         Returns True if the text passes all filters.
         """
-        # TODO: Implement proper content filtering
-        return True
+        return self.safety_filters.passes(text)
+
+    def _build_messages(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]] = None,
+        emotion_context: Optional[Dict] = None,
+        session_id: Optional[str] = None
+    ) -> List[Dict]:
+        """Assemble the chat messages sent to the model within the token budget."""
+        tail_messages = []
+        
+        if emotion_context:
+            emotion_prompt = f"Current emotional context: {json.dumps(emotion_context)}"
+            tail_messages.append({"role": "system", "content": emotion_prompt})
+        
+        tail_messages.append({"role": "user", "content": user_input})
+        
+        return self.context_manager.build_messages(
+            self.system_prompt,
+            conversation_history,
+            tail_messages,
+            session_id=session_id
+        )
+
+    def _generation_inputs(self, messages: List[Dict], session_id: Optional[str] = None) -> Dict:
+        """Tokenize the messages and return the keyword arguments for generate()."""
+        inputs = self.tokenizer.apply_chat_template(
+            messages,
+            add_generation_prompt=True,
+            return_tensors="pt"
+        ).to(self.device)
+        
+        generation_kwargs = {
+            "inputs": inputs,
+            "max_new_tokens": self.max_new_tokens,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "do_sample": True,
+            "pad_token_id": self.tokenizer.eos_token_id
+        }
+        
+        # The scheduler prefills prompts itself, so prefix reuse only applies
+        # to direct model.generate calls
+        if self.prefix_cache is not None and self.scheduler is None:
+            past_key_values = self._prefill_prompt(inputs, session_id)
+            if past_key_values is not None:
+                generation_kwargs["past_key_values"] = past_key_values
+                generation_kwargs["attention_mask"] = torch.ones_like(inputs)
+        
+        return generation_kwargs
+
+    def _prefill_prompt(self, inputs: torch.Tensor, session_id: Optional[str]) -> Optional[Tuple]:
+        """
+        Compute the key/value state for every prompt token but the last.
+        
+        The longest cached prefix (this session's previous prompt or the
+        shared system prompt) is reused, so only the new part of the
+        conversation is run through the model. The result is cached for the
+        session's next turn.
+        """
+        input_ids = inputs[0].tolist()
+        prompt_length = len(input_ids) - 1
+        if prompt_length <= 0:
+            return None
+        
+        session_key = f"session:{session_id}" if session_id is not None else None
+        keys = [session_key, SYSTEM_PREFIX_KEY] if session_key else [SYSTEM_PREFIX_KEY]
+        past_key_values, reused, matched_key = self.prefix_cache.lookup(input_ids, keys)
+        
+        if reused < prompt_length:
+            with torch.no_grad():
+                outputs = self.model(
+                    input_ids=inputs[:, reused:prompt_length],
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+            past_key_values = to_legacy_cache(outputs.past_key_values)
+        
+        prompt_ids = input_ids[:prompt_length]
+        if session_key:
+            self.prefix_cache.store(session_key, prompt_ids, past_key_values)
+        
+        # The shared entry starts as the first prompt seen and shrinks to the
+        # prefix that different conversations actually have in common
+        system_length = self.prefix_cache.entry_length(SYSTEM_PREFIX_KEY)
+        if system_length == 0:
+            self.prefix_cache.store(SYSTEM_PREFIX_KEY, prompt_ids, past_key_values)
+        elif matched_key == SYSTEM_PREFIX_KEY and reused < system_length:
+            self.prefix_cache.store(SYSTEM_PREFIX_KEY, prompt_ids[:reused], past_key_values)
+        
+        return past_key_values
+
+    def end_session(self, session_id: str):
+        """Release cached state held for a chat session."""
+        if self.prefix_cache is not None:
+            self.prefix_cache.drop(f"session:{session_id}")
+        self.context_manager.reset_session(session_id)
+
+    def _use_response_cache(self, conversation_history: Optional[List[Dict]]) -> bool:
+        # Later turns depend on the conversation, so only first turns are cached
+        return self.response_cache is not None and not conversation_history
 
     def generate_response(
         self,
         user_input: str,
         conversation_history: Optional[List[Dict]] = None,
-        emotion_context: Optional[Dict] = None
+        emotion_context: Optional[Dict] = None,
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None
     ) -> Dict:
         """
         Generate a response based on user input and context.
@@ -65,6 +239,8 @@ Remember to be compassionate, non-judgmental, and supportive."""
             user_input (str): The user's message
             conversation_history (Optional[List[Dict]]): Previous conversation messages
             emotion_context (Optional[Dict]): Current emotional context
+            session_id (Optional[str]): Chat session, used to reuse cached prompt state
+            deadline (Optional[float]): time.monotonic() timestamp after which generation stops
             
         Returns:
             Dict containing:
@@ -75,43 +251,53 @@ Remember to be compassionate, non-judgmental, and supportive."""
         # Check input safety
         if not self._apply_safety_filters(user_input):
             return {
-                "response": "I apologize, but I cannot process that input as it may violate our safety guidelines.",
+                "response": SAFETY_FALLBACK_RESPONSE,
                 "safety_check": False,
                 "suggested_actions": []
             }
         
-        # Prepare conversation context
-        messages = [{"role": "system", "content": self.system_prompt}]
-        
-        if conversation_history:
-            messages.extend(conversation_history)
-        
-        if emotion_context:
-            emotion_prompt = f"Current emotional context: {json.dumps(emotion_context)}"
-            messages.append({"role": "system", "content": emotion_prompt})
+        use_cache = self._use_response_cache(conversation_history)
+        if use_cache:
+            cached = self.response_cache.get(user_input, emotion_context)
+            if cached is not None:
+                return cached
+        start_time = time.perf_counter()
         
-        messages.append({"role": "user", "content": user_input})
+        # Prepare conversation context
+        messages = self._build_messages(user_input, conversation_history, emotion_context, session_id)
+        generation_kwargs = self._generation_inputs(messages, session_id)
+        prompt_length = generation_kwargs["inputs"].shape[-1]
         
         # Generate response
-        inputs = self.tokenizer.apply_chat_template(
-            messages,
-            return_tensors="pt"
-        ).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model.generate(
-                inputs,
-                max_new_tokens=512,
-                temperature=0.7,
-                top_p=0.9,
-                do_sample=True,
-                pad_token_id=self.tokenizer.eos_token_id
+        if self.scheduler is not None:
+            result = self.scheduler.generate(
+                generation_kwargs["inputs"][0].tolist(),
+                SamplingParams(
+                    max_new_tokens=generation_kwargs["max_new_tokens"],
+                    temperature=generation_kwargs["temperature"],
+                    top_p=generation_kwargs["top_p"],
+                    do_sample=generation_kwargs["do_sample"],
+                    deadline=deadline
+                ),
+                timeout=max(deadline - time.monotonic(), 0) if deadline is not None else None
+            )
+            new_tokens = result["output_ids"]
+            ended_on_eos = result["finish_reason"] == "stop"
+        else:
+            stop = _StopGeneration(deadline=deadline)
+            generation_kwargs["stopping_criteria"] = StoppingCriteriaList([stop])
+            with torch.no_grad():
+                outputs = self.model.generate(**generation_kwargs)
+            new_tokens = outputs[0][prompt_length:]
+            # Replies cut off by the deadline or max_new_tokens are incomplete
+            ended_on_eos = (
+                not stop.fired
+                and len(new_tokens) > 0
+                and int(new_tokens[-1]) == self.tokenizer.eos_token_id
             )
         
-        response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Extract the model's response from the full conversation
-        response = response.split("assistant")[-1].strip()
+        # Decode only the newly generated tokens
+        response = self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
         
         # Check response safety
         safety_check = self._apply_safety_filters(response)
@@ -123,11 +309,165 @@ Remember to be compassionate, non-judgmental, and supportive."""
             emotion_context
         )
         
-        return {
+        result = {
             "response": response,
             "safety_check": safety_check,
             "suggested_actions": suggested_actions
         }
+        if use_cache and safety_check and response and ended_on_eos:
+            self.response_cache.put(
+                user_input,
+                emotion_context,
+                result,
+                (time.perf_counter() - start_time) * 1000
+            )
+        return result
+
+    def stream_response(
+        self,
+        user_input: str,
+        conversation_history: Optional[List[Dict]] = None,
+        emotion_context: Optional[Dict] = None,
+        session_id: Optional[str] = None,
+        deadline: Optional[float] = None
+    ) -> Iterator[Dict]:
+        """
+        Generate a response incrementally, yielding text as it is produced.
+        
+        Yields ``{"event": "token", "text": ...}`` for every decoded chunk and
+        finishes with a ``{"event": "done", ...}`` dict carrying the same keys
+        as generate_response() plus a ``metrics`` dict with time-to-first-token
+        and tokens/sec. The partial response is safety-checked after every
+        chunk and text that could start a blocked phrase is held back until
+        it is resolved; on a violation generation stops and the final event
+        carries ``safety_check: False`` with the fallback response, which
+        clients should display in place of the streamed text.
+        """
+        start_time = time.perf_counter()
+        
+        if not self._apply_safety_filters(user_input):
+            yield {
+                "event": "done",
+                "response": SAFETY_FALLBACK_RESPONSE,
+                "safety_check": False,
+                "suggested_actions": [],
+                "metrics": {}
+            }
+            return
+        
+        use_cache = self._use_response_cache(conversation_history)
+        if use_cache:
+            cached = self.response_cache.get(user_input, emotion_context)
+            if cached is not None:
+                yield {"event": "token", "text": cached["response"]}
+                elapsed_ms = round((time.perf_counter() - start_time) * 1000, 1)
+                yield {
+                    "event": "done",
+                    **cached,
+                    "metrics": {
+                        "cached": True,
+                        "time_to_first_token_ms": elapsed_ms,
+                        "generated_tokens": 0,
+                        "tokens_per_second": None,
+                        "total_time_ms": elapsed_ms
+                    }
+                }
+                return
+        
+        messages = self._build_messages(user_input, conversation_history, emotion_context, session_id)
+        generation_kwargs = self._generation_inputs(messages, session_id)
+        
+        stop_event = Event()
+        streamer = _CountingStreamer(self.tokenizer)
+        stop = _StopGeneration(event=stop_event, deadline=deadline)
+        generation_kwargs["streamer"] = streamer
+        generation_kwargs["stopping_criteria"] = StoppingCriteriaList([stop])
+        
+        errors = []
+        
+        def _generate():
+            try:
+                with torch.no_grad():
+                    self.model.generate(**generation_kwargs)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+        
+        thread = Thread(target=_generate, daemon=True)
+        thread.start()
+        
+        response = ""
+        safety_stream = self.safety_filters.stream()
+        first_token_time = None
+        try:
+            for text in streamer:
+                if not text:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                response += text
+                
+                # Text that may begin a blocked phrase is held back until
+                # later chunks show whether it does
+                safe_text = safety_stream.feed(text)
+                if safety_stream.violation is not None:
+                    stop_event.set()
+                    break
+                
+                if safe_text:
+                    yield {"event": "token", "text": safe_text}
+        finally:
+            # Also reached when the client disconnects and the generator is closed
+            stop_event.set()
+            thread.join()
+        
+        if errors:
+            raise errors[0]
+        
+        end_time = time.perf_counter()
+        decode_time = end_time - (first_token_time or end_time)
+        metrics = {
+            "time_to_first_token_ms": (
+                round((first_token_time - start_time) * 1000, 1)
+                if first_token_time is not None else None
+            ),
+            "generated_tokens": streamer.token_count,
+            "tokens_per_second": (
+                round(streamer.token_count / decode_time, 2)
+                if decode_time > 0 else None
+            ),
+            "total_time_ms": round((end_time - start_time) * 1000, 1)
+        }
+        
+        remaining = safety_stream.finish()
+        if safety_stream.violation is not None:
+            yield {
+                "event": "done",
+                "response": SAFETY_FALLBACK_RESPONSE,
+                "safety_check": False,
+                "suggested_actions": [],
+                "metrics": metrics
+            }
+            return
+        
+        if remaining:
+            yield {"event": "token", "text": remaining}
+        
+        response = response.strip()
+        result = {
+            "response": response,
+            "safety_check": True,
+            "suggested_actions": self._generate_suggested_actions(
+                user_input,
+                response,
+                emotion_context
+            )
+        }
+        # Only complete replies are cached, never ones cut off by the deadline
+        ended_on_eos = not stop.fired and streamer.last_token == self.tokenizer.eos_token_id
+        if use_cache and response and ended_on_eos:
+            self.response_cache.put(user_input, emotion_context, result, metrics["total_time_ms"])
+        yield {"event": "done", **result, "metrics": metrics}
 
     def _generate_suggested_actions(
         self,
@@ -155,9 +495,4 @@ Remember to be compassionate, non-judgmental, and supportive."""
         Returns:
             Dict containing conversation summary and key points
         """
-        # TODO: Implement conversation summarization
-        return {
-            "summary": "Conversation summary placeholder",
-            "key_points": ["Key point 1", "Key point 2"],
-            "suggested_follow_up": "Follow-up suggestion"
-        } 
\ No newline at end of file
+        return self.context_manager.summarize(conversation_history)
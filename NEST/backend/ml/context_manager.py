@@ -0,0 +1,213 @@
+from typing import Dict, List, Optional
+from collections import OrderedDict
+from threading import Lock
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Approximate cost of the role markers a chat template wraps around a message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def _first_sentence(text: str, max_words: int) -> str:
+    sentence = _SENTENCE_END.split(text.strip(), maxsplit=1)[0]
+    words = sentence.split()
+    if len(words) > max_words:
+        return " ".join(words[:max_words]) + "..."
+    return " ".join(words)
+
+class _SessionSummary:
+    """Rolling summary of the turns that no longer fit in the prompt."""
+
+    def __init__(self):
+        # Held while the summary is read or extended
+        self.lock = Lock()
+        self.folded_messages = 0
+        self.points: List[str] = []
+        self.omitted_points = 0
+        self.text = ""
+        self.tokens = 0
+
+class ContextWindowManager:
+    """
+    Keeps chat prompts within a token budget.
+
+    The most recent messages are kept verbatim; older ones are folded into
+    a rolling summary that is appended to the system prompt. The summary is
+    cached per chat session and only the newly folded messages are added to
+    it, so it is never rebuilt from scratch. Folding happens in chunks (down
+    to ``fold_target`` of the budget) so the prompt prefix only changes
+    occasionally, which keeps prefix-cache hits high.
+
+    The result suits strict chat templates such as Llama 2's: one system
+    message first, then user and assistant turns alternating from a user
+    turn. Whole exchanges are folded, so the kept history starts with a
+    user message, and consecutive messages of the same role are merged.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        max_prompt_tokens: int,
+        summary_max_tokens: int = 256,
+        fold_target: float = 0.75,
+        max_sessions: int = 1024,
+        max_point_words: int = 25
+    ):
+        self.tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.fold_target = fold_target
+        self.max_sessions = max_sessions
+        self.max_point_words = max_point_words
+
+        self._summaries: "OrderedDict[str, _SessionSummary]" = OrderedDict()
+        self._token_counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = Lock()
+
+    def count_tokens(self, text: str) -> int:
+        """Token count of a message body, cached by content."""
+        with self._lock:
+            count = self._token_counts.get(text)
+            if count is not None:
+                self._token_counts.move_to_end(text)
+                return count
+
+        count = len(self.tokenizer.encode(text, add_special_tokens=False))
+        with self._lock:
+            self._token_counts[text] = count
+            if len(self._token_counts) > 16 * self.max_sessions:
+                self._token_counts.popitem(last=False)
+        return count
+
+    def _message_tokens(self, message: Dict) -> int:
+        return self.count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def build_messages(
+        self,
+        system_prompt: str,
+        conversation_history: Optional[List[Dict]],
+        tail_messages: List[Dict],
+        session_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Assemble ``system prompt + summary + recent history + tail`` within budget.
+
+        ``tail_messages`` (the emotion context and the new user message) are
+        always included; system messages among them are prepended to the
+        message that follows them. Without a ``session_id`` the summary is
+        built for this call only.
+        """
+        history = conversation_history or []
+        tail, context = [], []
+        for message in tail_messages:
+            if message.get("role") == "system":
+                context.append(message["content"])
+            else:
+                if context:
+                    message = dict(message, content="\n\n".join(context + [message["content"]]))
+                    context = []
+                tail.append(message)
+        system_parts = [system_prompt] + context
+
+        fixed_tokens = sum(self.count_tokens(part) for part in system_parts) + MESSAGE_OVERHEAD_TOKENS
+        fixed_tokens += sum(self._message_tokens(message) for message in tail)
+
+        state = self._get_state(session_id, len(history))
+        budget = self.max_prompt_tokens - fixed_tokens
+
+        with state.lock:
+            # Messages already folded into the summary are never repeated verbatim
+            start = state.folded_messages
+            recent_tokens = sum(self._message_tokens(message) for message in history[start:])
+            summary_cap = self.summary_max_tokens
+
+            if recent_tokens + state.tokens > budget:
+                # Small budgets (long system prompt, short context) get a shorter summary
+                summary_cap = min(self.summary_max_tokens, max(budget, 0) // 2)
+                target = max(budget - summary_cap, 0) * self.fold_target
+                while start < len(history) and recent_tokens > target:
+                    recent_tokens -= self._message_tokens(history[start])
+                    start += 1
+            # The kept history must open with a user turn
+            while start < len(history) and history[start].get("role") != "user":
+                start += 1
+            if start > state.folded_messages:
+                self._fold(state, history[state.folded_messages:start], summary_cap)
+                state.folded_messages = start
+            summary = state.text
+
+        if summary:
+            system_parts.insert(1, summary)
+        messages = [{"role": "system", "content": "\n\n".join(system_parts)}]
+        for message in history[start:] + tail:
+            if messages[-1]["role"] == message.get("role"):
+                messages[-1] = dict(messages[-1], content=messages[-1]["content"] + "\n\n" + message["content"])
+            else:
+                messages.append(message)
+        return messages
+
+    def summarize(self, conversation_history: List[Dict]) -> Dict:
+        """Extractive summary of a whole conversation."""
+        state = _SessionSummary()
+        self._fold(state, conversation_history, self.summary_max_tokens)
+        user_points = [
+            _first_sentence(message["content"], self.max_point_words)
+            for message in conversation_history
+            if message.get("role") == "user" and message.get("content", "").strip()
+        ]
+        return {
+            "summary": state.text,
+            "key_points": user_points[-5:],
+            "suggested_follow_up": (
+                f"Check in on: {user_points[-1]}" if user_points else None
+            )
+        }
+
+    def reset_session(self, session_id: str):
+        with self._lock:
+            self._summaries.pop(session_id, None)
+
+    def _get_state(self, session_id: Optional[str], history_length: int) -> _SessionSummary:
+        if session_id is None:
+            return _SessionSummary()
+
+        with self._lock:
+            state = self._summaries.get(session_id)
+            # A shorter history means the client started over; drop the summary
+            if state is None or state.folded_messages > history_length:
+                state = _SessionSummary()
+                self._summaries[session_id] = state
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+            return state
+
+    def _fold(self, state: _SessionSummary, messages: List[Dict], max_tokens: int):
+        """Add ``messages`` to the summary, dropping its oldest points if it grows too long."""
+        for message in messages:
+            content = message.get("content", "").strip()
+            if not content:
+                continue
+            speaker = "User" if message.get("role") == "user" else "Assistant"
+            state.points.append(f"{speaker}: {_first_sentence(content, self.max_point_words)}")
+
+        state.text = self._render(state)
+        state.tokens = self.count_tokens(state.text) if state.text else 0
+        while state.tokens > max_tokens and state.points:
+            state.points.pop(0)
+            state.omitted_points += 1
+            state.text = self._render(state)
+            state.tokens = self.count_tokens(state.text) if state.text else 0
+
+    @staticmethod
+    def _render(state: _SessionSummary) -> str:
+        if not state.points:
+            return ""
+        lines = ["Summary of the earlier conversation:"]
+        if state.omitted_points:
+            lines.append(f"({state.omitted_points} earlier points omitted)")
+        lines.extend(f"- {point}" for point in state.points)
+        return "\n".join(lines)
@@ -0,0 +1,387 @@
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import Future
+from pydantic import BaseModel
+from threading import Event, Lock, Thread
+import queue
+import time
+import torch
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SchedulerFull(Exception):
+    """Raised when the scheduler's request queue is full."""
+
+class SamplingParams(BaseModel):
+    max_new_tokens: int = 512
+    temperature: float = 0.7
+    top_p: float = 0.9
+    do_sample: bool = True
+    ignore_eos: bool = False
+    # time.monotonic() timestamp after which the sequence stops decoding
+    deadline: Optional[float] = None
+
+class _Sequence:
+    """A single request moving through the scheduler."""
+
+    def __init__(self, input_ids: List[int], params: SamplingParams):
+        self.input_ids = input_ids
+        self.params = params
+        self.future: Future = Future()
+        self.output_ids: List[int] = []
+        self.submitted_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+
+    def expired(self) -> bool:
+        return self.params.deadline is not None and time.monotonic() >= self.params.deadline
+
+    def is_finished(self, eos_token_id: Optional[int]) -> bool:
+        if len(self.output_ids) >= self.params.max_new_tokens or self.expired():
+            return True
+        return (
+            not self.params.ignore_eos
+            and eos_token_id is not None
+            and self.output_ids[-1] == eos_token_id
+        )
+
+def to_legacy_cache(past_key_values) -> Tuple:
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+def _left_pad(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+class GenerationScheduler:
+    """
+    Continuous batching for causal LM generation.
+
+    Requests are queued and merged into one decoding batch. Every step the
+    scheduler admits waiting sequences (after prefilling them individually),
+    decodes one token for every active sequence in a single forward pass and
+    retires the sequences that finished or ran past their deadline.
+    Key/value caches of the active sequences are kept left-padded in one
+    batch tensor per layer.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_batch_size: int = 8,
+        max_queue_size: int = 64
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = next(model.parameters()).device
+        self.eos_token_id = tokenizer.eos_token_id
+        self.max_batch_size = max_batch_size
+
+        self._queue: "queue.Queue[_Sequence]" = queue.Queue(maxsize=max_queue_size)
+        self._active: List[_Sequence] = []
+        self._past: Optional[Tuple] = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._stop_event = Event()
+        self._thread: Optional[Thread] = None
+        # Serializes start/stop so concurrent submits never run two loops
+        # over the same batch state
+        self._thread_lock = Lock()
+        self._lock = Lock()
+
+        self._metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "failed": 0,
+            "expired": 0,
+            "generated_tokens": 0,
+            "decode_steps": 0,
+            "batched_sequences": 0,
+            "busy_seconds": 0.0,
+            "total_latency_ms": 0.0,
+            "total_queue_wait_ms": 0.0
+        }
+
+    def start(self):
+        """Start the background decoding loop unless it is already running."""
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = Thread(target=self._run, name="generation-scheduler", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the decoding loop and fail any outstanding requests."""
+        with self._thread_lock:
+            self._stop_event.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            self._fail_all(RuntimeError("Generation scheduler stopped"))
+
+    def submit(self, input_ids: List[int], params: Optional[SamplingParams] = None) -> Future:
+        """
+        Queue a prompt for generation.
+
+        Returns a Future resolving to a dict with the generated token ids, the
+        reason generation finished ("stop" on EOS, "length" at max_new_tokens,
+        "deadline" when params.deadline passed) and timing information.
+        Raises SchedulerFull when the queue is full; sequences whose deadline
+        passed while queued fail with TimeoutError.
+        """
+        sequence = _Sequence(list(input_ids), params or SamplingParams())
+        try:
+            self._queue.put_nowait(sequence)
+        except queue.Full:
+            with self._lock:
+                self._metrics["rejected"] += 1
+            raise SchedulerFull("Generation queue is full")
+        with self._lock:
+            self._metrics["submitted"] += 1
+        self.start()
+        return sequence.future
+
+    def generate(
+        self,
+        input_ids: List[int],
+        params: Optional[SamplingParams] = None,
+        timeout: Optional[float] = None
+    ) -> Dict:
+        """Submit a prompt and block until it has been generated."""
+        return self.submit(input_ids, params).result(timeout=timeout)
+
+    def get_metrics(self) -> Dict:
+        """Return throughput and latency counters."""
+        with self._lock:
+            metrics = dict(self._metrics)
+        completed = metrics["completed"]
+        metrics.update({
+            "queue_depth": self._queue.qsize(),
+            "active_sequences": len(self._active),
+            "average_batch_size": (
+                metrics["batched_sequences"] / metrics["decode_steps"]
+                if metrics["decode_steps"] else 0.0
+            ),
+            "tokens_per_second": (
+                metrics["generated_tokens"] / metrics["busy_seconds"]
+                if metrics["busy_seconds"] else 0.0
+            ),
+            "average_latency_ms": metrics["total_latency_ms"] / completed if completed else 0.0,
+            "average_queue_wait_ms": metrics["total_queue_wait_ms"] / completed if completed else 0.0
+        })
+        return metrics
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            sequence = None
+            if not self._active:
+                # Idle: block until a request arrives
+                try:
+                    sequence = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+            started = time.perf_counter()
+            try:
+                with torch.no_grad():
+                    if sequence is not None:
+                        self._prefill(sequence)
+                    self._admit()
+                    if self._active:
+                        self._decode_step()
+            except Exception as e:
+                logger.error(f"Error in generation scheduler: {str(e)}")
+                self._fail_all(e)
+            with self._lock:
+                self._metrics["busy_seconds"] += time.perf_counter() - started
+
+    def _admit(self):
+        while len(self._active) < self.max_batch_size:
+            try:
+                sequence = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._prefill(sequence)
+
+    def _prefill(self, sequence: _Sequence):
+        """Run the prompt through the model and add the sequence to the batch."""
+        if not sequence.future.set_running_or_notify_cancel():
+            return
+        if sequence.expired():
+            with self._lock:
+                self._metrics["expired"] += 1
+            sequence.future.set_exception(TimeoutError("Deadline passed before generation started"))
+            return
+        sequence.started_at = time.perf_counter()
+        try:
+            input_ids = torch.tensor([sequence.input_ids], device=self.device)
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+            next_token = self._sample(outputs.logits[:, -1, :], [sequence.params])
+        except Exception as e:
+            logger.error(f"Error prefilling request: {str(e)}")
+            with self._lock:
+                self._metrics["failed"] += 1
+            sequence.future.set_exception(e)
+            return
+
+        past = to_legacy_cache(outputs.past_key_values)
+        mask = torch.ones((1, input_ids.shape[1]), dtype=torch.long, device=self.device)
+        self._append(sequence, past, mask)
+        self._record_token(sequence, int(next_token[0]))
+        self._retire_finished()
+
+    def _append(self, sequence: _Sequence, past: Tuple, mask: torch.Tensor):
+        if not self._active:
+            self._past, self._attention_mask = past, mask
+            self._active.append(sequence)
+            return
+
+        length = max(self._attention_mask.shape[1], mask.shape[1])
+        self._past = tuple(
+            (
+                torch.cat([_left_pad(batch_k, length, 2), _left_pad(k, length, 2)], dim=0),
+                torch.cat([_left_pad(batch_v, length, 2), _left_pad(v, length, 2)], dim=0)
+            )
+            for (batch_k, batch_v), (k, v) in zip(self._past, past)
+        )
+        self._attention_mask = torch.cat(
+            [_left_pad(self._attention_mask, length, 1), _left_pad(mask, length, 1)],
+            dim=0
+        )
+        self._active.append(sequence)
+
+    def _decode_step(self):
+        """Decode one token for every active sequence."""
+        last_tokens = torch.tensor(
+            [[sequence.output_ids[-1]] for sequence in self._active],
+            device=self.device
+        )
+        position_ids = self._attention_mask.sum(dim=1, keepdim=True)
+        attention_mask = torch.cat(
+            [self._attention_mask, torch.ones_like(last_tokens)],
+            dim=1
+        )
+
+        outputs = self.model(
+            input_ids=last_tokens,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=self._past,
+            use_cache=True
+        )
+        self._past = to_legacy_cache(outputs.past_key_values)
+        self._attention_mask = attention_mask
+
+        next_tokens = self._sample(
+            outputs.logits[:, -1, :],
+            [sequence.params for sequence in self._active]
+        )
+        with self._lock:
+            self._metrics["decode_steps"] += 1
+            self._metrics["batched_sequences"] += len(self._active)
+        for sequence, token in zip(self._active, next_tokens.tolist()):
+            self._record_token(sequence, token)
+        self._retire_finished()
+
+    def _record_token(self, sequence: _Sequence, token: int):
+        if sequence.first_token_at is None:
+            sequence.first_token_at = time.perf_counter()
+        sequence.output_ids.append(token)
+        with self._lock:
+            self._metrics["generated_tokens"] += 1
+
+    def _retire_finished(self):
+        keep = []
+        for index, sequence in enumerate(self._active):
+            if sequence.is_finished(self.eos_token_id):
+                self._complete(sequence)
+            else:
+                keep.append(index)
+
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self._active, self._past, self._attention_mask = [], None, None
+            return
+
+        rows = torch.tensor(keep, device=self.device)
+        self._active = [self._active[index] for index in keep]
+        self._attention_mask = self._attention_mask.index_select(0, rows)
+        # Drop leading columns that are padding for every remaining sequence
+        first_column = int(self._attention_mask.any(dim=0).nonzero()[0])
+        self._attention_mask = self._attention_mask[:, first_column:]
+        self._past = tuple(
+            (
+                k.index_select(0, rows)[:, :, first_column:],
+                v.index_select(0, rows)[:, :, first_column:]
+            )
+            for k, v in self._past
+        )
+
+    def _complete(self, sequence: _Sequence):
+        finished_at = time.perf_counter()
+        output_ids = sequence.output_ids
+        finish_reason = "deadline" if sequence.expired() else "length"
+        if not sequence.params.ignore_eos and output_ids and output_ids[-1] == self.eos_token_id:
+            output_ids = output_ids[:-1]
+            finish_reason = "stop"
+
+        queue_wait_ms = (sequence.started_at - sequence.submitted_at) * 1000
+        latency_ms = (finished_at - sequence.submitted_at) * 1000
+        with self._lock:
+            self._metrics["completed"] += 1
+            self._metrics["total_latency_ms"] += latency_ms
+            self._metrics["total_queue_wait_ms"] += queue_wait_ms
+
+        sequence.future.set_result({
+            "output_ids": output_ids,
+            "finish_reason": finish_reason,
+            "generated_tokens": len(sequence.output_ids),
+            "queue_wait_ms": round(queue_wait_ms, 1),
+            "time_to_first_token_ms": round((sequence.first_token_at - sequence.submitted_at) * 1000, 1),
+            "latency_ms": round(latency_ms, 1)
+        })
+
+    def _fail_all(self, error: Exception):
+        pending = list(self._active)
+        self._active, self._past, self._attention_mask = [], None, None
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for sequence in pending:
+            if not sequence.future.done():
+                with self._lock:
+                    self._metrics["failed"] += 1
+                sequence.future.set_exception(error)
+
+    def _sample(self, logits: torch.Tensor, params: List[SamplingParams]) -> torch.Tensor:
+        """Pick the next token for every row using its own sampling parameters."""
+        logits = logits.float()
+        greedy = logits.argmax(dim=-1)
+        do_sample = torch.tensor([p.do_sample for p in params], device=logits.device)
+        if not bool(do_sample.any()):
+            return greedy
+
+        temperature = torch.tensor(
+            [max(p.temperature, 1e-5) for p in params],
+            device=logits.device
+        ).unsqueeze(1)
+        top_p = torch.tensor([p.top_p for p in params], device=logits.device).unsqueeze(1)
+
+        probs = torch.softmax(logits / temperature, dim=-1)
+        sorted_probs, sorted_ids = probs.sort(dim=-1, descending=True)
+        # Nucleus filtering: keep the smallest prefix whose mass reaches top_p
+        outside_nucleus = sorted_probs.cumsum(dim=-1) - sorted_probs > top_p
+        sorted_probs = sorted_probs.masked_fill(outside_nucleus, 0.0)
+        choice = torch.multinomial(sorted_probs, num_samples=1)
+        sampled = sorted_ids.gather(-1, choice).squeeze(1)
+
+        return torch.where(do_sample, sampled, greedy)
@@ -0,0 +1,149 @@
+from transformers import AutoModelForCausalLM, AutoTokenizer
+import torch
+from typing import Dict, Optional, Tuple
+from threading import Lock
+import os
+import time
+from dotenv import load_dotenv
+import logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "auto" keeps the previous behaviour: float16 on GPU, float32 on CPU.
+# "int8" applies dynamic int8 quantization to every Linear layer, which cuts
+# weight memory roughly 4x and speeds up CPU decoding on GPU-less pods.
+INFERENCE_MODES = ("auto", "fp32", "bf16", "fp16", "int8")
+
+# int8 weights are quantized from a float32 load
+_TORCH_DTYPES = {
+    "fp32": torch.float32,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+    "int8": torch.float32
+}
+
+DEFAULT_CHAT_MODEL = "meta-llama/Llama-2-7b-chat-hf"
+
+class ModelHandle:
+    """A loaded tokenizer/model pair shared by every ChatBot in the process."""
+
+    def __init__(self, model_name: str, mode: str, device: str, tokenizer, model, load_seconds: float):
+        self.model_name = model_name
+        self.mode = mode
+        self.device = device
+        self.tokenizer = tokenizer
+        self.model = model
+        self.load_seconds = load_seconds
+
+    @property
+    def memory_bytes(self) -> int:
+        """Size of the model weights and buffers, including quantized packed weights."""
+        total = 0
+        for value in self.model.state_dict().values():
+            tensors = value if isinstance(value, tuple) else (value,)
+            for tensor in tensors:
+                if isinstance(tensor, torch.Tensor):
+                    total += tensor.element_size() * tensor.nelement()
+        return total
+
+    def info(self) -> Dict:
+        return {
+            "model_name": self.model_name,
+            "mode": self.mode,
+            "device": self.device,
+            "memory_mb": round(self.memory_bytes / (1024 * 1024), 1),
+            "load_seconds": round(self.load_seconds, 2)
+        }
+
+_handles: Dict[Tuple[str, str], ModelHandle] = {}
+_handles_lock = Lock()
+
+def resolve_mode(mode: Optional[str], device: str) -> str:
+    mode = (mode or os.getenv("CHAT_INFERENCE_MODE", "auto")).lower()
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode: {mode} (expected one of {', '.join(INFERENCE_MODES)})")
+    if mode == "auto":
+        return "fp16" if device == "cuda" else "fp32"
+    if mode == "int8" and device == "cuda":
+        raise ValueError("int8 inference mode is only supported on CPU")
+    return mode
+
+def load_chat_model(model_name: str, mode: Optional[str] = None) -> ModelHandle:
+    """Load a tokenizer and model in the requested inference mode (uncached)."""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    mode = resolve_mode(mode, device)
+    started = time.perf_counter()
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if device == "cuda":
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=_TORCH_DTYPES[mode],
+            device_map="auto"
+        )
+    else:
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=_TORCH_DTYPES[mode],
+            low_cpu_mem_usage=True
+        )
+        if mode == "int8":
+            model = torch.ao.quantization.quantize_dynamic(
+                model,
+                {torch.nn.Linear},
+                dtype=torch.qint8
+            )
+    model.eval()
+
+    handle = ModelHandle(model_name, mode, device, tokenizer, model, time.perf_counter() - started)
+    logger.info(f"Loaded chat model {model_name} ({mode} on {device}) in {handle.load_seconds:.1f}s, "
+                f"{handle.memory_bytes / (1024 * 1024):.0f} MB")
+    return handle
+
+def get_chat_model(model_name: Optional[str] = None, mode: Optional[str] = None) -> ModelHandle:
+    """
+    Return the process-wide model handle, loading it on first use.
+
+    The model comes from CHAT_MODEL. If it cannot be loaded (not downloaded,
+    no network, out of memory) and CHAT_MODEL_FALLBACK is set, the fallback
+    model is used instead.
+    """
+    model_name = model_name or os.getenv("CHAT_MODEL", DEFAULT_CHAT_MODEL)
+    key = (model_name, (mode or os.getenv("CHAT_INFERENCE_MODE", "auto")).lower())
+
+    handle = _handles.get(key)
+    if handle is not None:
+        return handle
+
+    with _handles_lock:
+        handle = _handles.get(key)
+        if handle is not None:
+            return handle
+
+        try:
+            handle = load_chat_model(model_name, mode)
+        except (OSError, MemoryError, RuntimeError) as e:
+            fallback = os.getenv("CHAT_MODEL_FALLBACK", "")
+            if not fallback or fallback == model_name:
+                raise
+            logger.warning(f"Failed to load chat model {model_name} ({str(e)}), falling back to {fallback}")
+            handle = load_chat_model(fallback, mode)
+
+        _handles[key] = handle
+        return handle
+
+def warm_up(model_name: Optional[str] = None, mode: Optional[str] = None) -> ModelHandle:
+    """Load the chat model ahead of time and run one short generation."""
+    handle = get_chat_model(model_name, mode)
+    encoded = handle.tokenizer("Hello", return_tensors="pt").to(handle.device)
+    with torch.no_grad():
+        handle.model.generate(
+            input_ids=encoded["input_ids"],
+            attention_mask=encoded["attention_mask"],
+            max_new_tokens=1,
+            do_sample=False,
+            pad_token_id=handle.tokenizer.eos_token_id
+        )
+    return handle
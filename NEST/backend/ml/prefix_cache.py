@@ -0,0 +1,158 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+def crop_past(past_key_values: Tuple, length: int, copy: bool = False) -> Tuple:
+    """
+    Keep the key/value state of the first ``length`` tokens.
+
+    The crop is a view of the original tensors unless ``copy`` is set; a
+    view keeps the whole uncropped storage alive, so anything held on to
+    (cache entries) must be copied.
+    """
+    if copy:
+        return tuple(
+            (key[:, :, :length].clone(), value[:, :, :length].clone())
+            for key, value in past_key_values
+        )
+    return tuple(
+        (key[:, :, :length], value[:, :, :length])
+        for key, value in past_key_values
+    )
+
+def past_nbytes(past_key_values: Tuple) -> int:
+    return sum(
+        key.element_size() * key.nelement() + value.element_size() * value.nelement()
+        for key, value in past_key_values
+    )
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    length = min(len(a), len(b))
+    if length == 0:
+        return 0
+    mismatch = np.flatnonzero(np.asarray(a[:length]) != np.asarray(b[:length]))
+    return int(mismatch[0]) if mismatch.size else length
+
+class _Entry:
+    def __init__(self, token_ids: Tuple[int, ...], past_key_values: Tuple):
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+        self.nbytes = past_nbytes(past_key_values)
+
+class PrefixCache:
+    """
+    LRU cache of attention key/value state for prompt prefixes.
+
+    Entries are stored under a key (e.g. the shared system prompt or one chat
+    session) together with the token ids they cover. A lookup reuses the
+    longest common token prefix between a new prompt and the candidate
+    entries, so only the remaining tokens have to be prefilled. The total
+    size of the cached tensors is bounded by ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = Lock()
+        self._bytes = 0
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "reused_tokens": 0,
+            "prefilled_tokens": 0
+        }
+
+    def lookup(
+        self,
+        input_ids: Sequence[int],
+        keys: List[str]
+    ) -> Tuple[Optional[Tuple], int, Optional[str]]:
+        """
+        Find the cached state sharing the longest prefix with ``input_ids``.
+
+        Returns ``(past_key_values, reused_length, key)``; ``past_key_values``
+        is None on a miss. At least the last prompt token is always left
+        uncached so the model has something to run on.
+        """
+        best_key, best_length = None, 0
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                length = min(
+                    common_prefix_length(entry.token_ids, input_ids),
+                    len(input_ids) - 1
+                )
+                if length > best_length:
+                    best_key, best_length = key, length
+
+            if best_key is None:
+                self._metrics["misses"] += 1
+                self._metrics["prefilled_tokens"] += len(input_ids)
+                return None, 0, None
+
+            entry = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self._metrics["hits"] += 1
+            self._metrics["reused_tokens"] += best_length
+            self._metrics["prefilled_tokens"] += len(input_ids) - best_length
+            return crop_past(entry.past_key_values, best_length), best_length, best_key
+
+    def store(self, key: str, token_ids: Sequence[int], past_key_values: Tuple):
+        """Cache the key/value state covering ``token_ids`` under ``key``."""
+        entry = _Entry(
+            tuple(token_ids),
+            crop_past(past_key_values, len(token_ids), copy=True)
+        )
+        if entry.nbytes > self.max_bytes:
+            logger.debug(f"Prefix for {key} exceeds the cache size, not caching")
+            self.drop(key)
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._metrics["evictions"] += 1
+
+    def entry_length(self, key: str) -> int:
+        """Number of tokens cached under ``key`` (0 if absent)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return len(entry.token_ids) if entry is not None else 0
+
+    def drop(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_metrics(self) -> Dict:
+        """Return hit-rate and memory counters."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["entries"] = len(self._entries)
+            metrics["bytes"] = self._bytes
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        total_tokens = metrics["reused_tokens"] + metrics["prefilled_tokens"]
+        metrics["token_reuse_rate"] = metrics["reused_tokens"] / total_tokens if total_tokens else 0.0
+        metrics["max_bytes"] = self.max_bytes
+        return metrics
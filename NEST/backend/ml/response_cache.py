@@ -0,0 +1,248 @@
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+from threading import Lock
+from sklearn.feature_extraction.text import HashingVectorizer
+import numpy as np
+import json
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w\s']+")
+_WHITESPACE = re.compile(r"\s+")
+
+# Messages about self-harm or suicide are never answered from the cache
+_CRISIS = re.compile(
+    r"\b(?:suicid\w*|kill(?:ing)? my ?self|end(?:ing)? (?:my|it) (?:life|all)|self ?harm\w*"
+    r"|hurt(?:ing)? my ?self|cut(?:ting)? my ?self|overdos\w*|want(?:ed)? to die"
+    r"|better off dead|wish i (?:was|were) dead|reason to live"
+    r"|(?:want|wanna|going) to (?:live|be alive|go on|wake up))\b"
+)
+
+# Words that can differ between two messages served the same response
+_FUNCTION_WORDS = frozenset("""
+    a an the i im i'm me my myself you your it its it's this that these those is am are was were be been
+    being do does did have has had and or but so to of in on at for with about just really very
+    quite some any feel feeling bit little kind sort please hi hello hey
+""".split())
+_NEGATIONS = frozenset("""
+    not no never nor none nothing nobody nowhere neither cannot without
+""".split())
+# ``dont`` and friends, typed without the apostrophe
+_CONTRACTED = frozenset("""
+    do does did ca wo is are was were has have had could would should must need ai
+""".split())
+
+def normalize_message(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = text.lower().replace("\u2019", "'")
+    return _WHITESPACE.sub(" ", _NON_WORD.sub(" ", text)).strip()
+
+def is_crisis_message(normalized: str) -> bool:
+    return _CRISIS.search(normalized) is not None
+
+def content_signature(normalized: str) -> Tuple[str, ...]:
+    """
+    The message's content words in order, with every negation (``dont``,
+    ``can't``, ``never``) reduced to ``not``. Fuzzy matches must have the
+    same signature, so they can only differ in function words, spacing
+    and punctuation, never in what is negated or which words carry meaning.
+    """
+    signature = []
+    for word in normalized.split():
+        if word in _NEGATIONS or word.endswith("n't") or (word.endswith("nt") and word[:-2] in _CONTRACTED):
+            signature.append("not")
+        elif word not in _FUNCTION_WORDS:
+            signature.append(word)
+    return tuple(signature)
+
+def context_key(emotion_context: Optional[Dict], precision: int = 1) -> str:
+    """
+    Coarse, order-independent key for an emotion context.
+
+    Numbers are rounded so contexts that differ only slightly (0.81 vs
+    0.84 anxiety) share cached responses.
+    """
+    if not emotion_context:
+        return ""
+
+    def coarse(value: Any) -> Any:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)):
+            return round(float(value), precision)
+        if isinstance(value, dict):
+            return {k: coarse(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [coarse(v) for v in value]
+        return value
+
+    return json.dumps(coarse(emotion_context), sort_keys=True, default=str)
+
+class _Entry:
+    def __init__(self, slot: int, signature: Tuple[str, ...], response: Dict, generation_ms: float, expires_at: float):
+        self.slot = slot
+        self.signature = signature
+        self.response = response
+        self.generation_ms = generation_ms
+        self.expires_at = expires_at
+
+class ResponseCache:
+    """
+    Cache of complete chat responses for repeated opening messages.
+
+    A lookup matches the normalized message (case, punctuation and spacing
+    ignored) with the same emotion context. With ``fuzzy=True`` it then
+    tries the most similar cached message: messages are embedded with
+    hashed character n-grams, the cosine between embeddings must reach
+    ``similarity_threshold`` and both messages must have the same
+    content_signature(). Character n-grams alone score ``keep taking my
+    medication`` and ``stop taking my medication`` above 0.9, so the
+    signature check is what keeps a reply from being served for a message
+    that means something else. The embeddings live in one preallocated
+    matrix, so a lookup is a single matrix-vector product.
+
+    Messages about self-harm or suicide are never cached or answered from
+    the cache. Entries expire after ``ttl_seconds`` and the least recently
+    used one is evicted when the cache is full.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        similarity_threshold: float = 0.9,
+        n_features: int = 4096,
+        fuzzy: bool = False
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.fuzzy = fuzzy
+        self._vectorizer = HashingVectorizer(
+            analyzer="char_wb",
+            ngram_range=(3, 4),
+            n_features=n_features,
+            alternate_sign=False,
+            norm="l2"
+        )
+
+        # Only fuzzy lookups need the embeddings
+        self._vectors = np.zeros((max_entries if fuzzy else 0, n_features), dtype=np.float32)
+        self._slot_keys: list = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        # (context, normalized message) -> entry, in LRU order
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._lock = Lock()
+        self._metrics = {
+            "lookups": 0,
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "crisis_bypassed": 0,
+            "expired": 0,
+            "evictions": 0,
+            "saved_ms": 0.0
+        }
+
+    def _embed(self, normalized: str) -> np.ndarray:
+        return self._vectorizer.transform([normalized]).toarray()[0].astype(np.float32)
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key)
+        if self.fuzzy:
+            self._vectors[entry.slot] = 0.0
+        self._slot_keys[entry.slot] = None
+        self._free_slots.append(entry.slot)
+
+    def get(self, message: str, emotion_context: Optional[Dict] = None) -> Optional[Dict]:
+        """Return a copy of the cached response for a similar message, or None."""
+        normalized = normalize_message(message)
+        context = context_key(emotion_context)
+        if not normalized:
+            return None
+        if is_crisis_message(normalized):
+            with self._lock:
+                self._metrics["crisis_bypassed"] += 1
+            return None
+        now = time.monotonic()
+
+        with self._lock:
+            self._metrics["lookups"] += 1
+            key = (context, normalized)
+            kind = "exact_hits"
+            entry = self._entries.get(key)
+            if entry is None and self.fuzzy and self._entries:
+                kind = "semantic_hits"
+                signature = content_signature(normalized)
+                similarities = self._vectors @ self._embed(normalized)
+                # Only entries with the same emotion context and content words
+                for slot in np.argsort(-similarities):
+                    if similarities[slot] < self.similarity_threshold:
+                        break
+                    slot_key = self._slot_keys[slot]
+                    if slot_key is None or slot_key[0] != context:
+                        continue
+                    if self._entries[slot_key].signature == signature:
+                        key, entry = slot_key, self._entries[slot_key]
+                        break
+
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                self._metrics["expired"] += 1
+                entry = None
+
+            if entry is None:
+                self._metrics["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._metrics[kind] += 1
+            self._metrics["saved_ms"] += entry.generation_ms
+            return dict(entry.response)
+
+    def put(self, message: str, emotion_context: Optional[Dict], response: Dict, generation_ms: float):
+        """Cache ``response``; ``generation_ms`` is what a hit on it saves."""
+        normalized = normalize_message(message)
+        if not normalized or self.max_entries <= 0 or is_crisis_message(normalized):
+            return
+        key = (context_key(emotion_context), normalized)
+        vector = self._embed(normalized) if self.fuzzy else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if not self._free_slots:
+                self._remove(next(iter(self._entries)))
+                self._metrics["evictions"] += 1
+            slot = self._free_slots.pop()
+            if vector is not None:
+                self._vectors[slot] = vector
+            self._slot_keys[slot] = key
+            self._entries[key] = _Entry(
+                slot,
+                content_signature(normalized),
+                dict(response),
+                generation_ms,
+                time.monotonic() + self.ttl_seconds
+            )
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def get_metrics(self) -> Dict:
+        """Return hit-rate, saved latency and size counters."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["entries"] = len(self._entries)
+        hits = metrics["exact_hits"] + metrics["semantic_hits"]
+        metrics["hit_rate"] = hits / metrics["lookups"] if metrics["lookups"] else 0.0
+        metrics["saved_ms"] = round(metrics["saved_ms"], 1)
+        metrics["max_entries"] = self.max_entries
+        metrics["fuzzy"] = self.fuzzy
+        metrics["similarity_threshold"] = self.similarity_threshold
+        return metrics
@@ -0,0 +1,292 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+from threading import Lock
+import json
+import os
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SAFETY_RULES_PATH = os.getenv(
+    "SAFETY_RULES_PATH",
+    str(Path(__file__).parent / "safety_rules.json")
+)
+
+# Used when no rules file is deployed. The rules file, when present,
+# replaces these lists entirely.
+DEFAULT_SAFETY_RULES: Dict[str, List[str]] = {
+    "harmful_content": [
+        "you should kill yourself",
+        "you deserve to die",
+        "ways to kill yourself",
+        "how to hurt yourself",
+        "how to make a bomb"
+    ],
+    "medical_advice": [
+        "stop taking your medication",
+        "increase your dose",
+        "double your dose",
+        "you don't need your medication"
+    ],
+    "personal_information": [
+        "social security number",
+        "credit card number",
+        "my password is"
+    ]
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """Lowercase and collapse whitespace so phrases match regardless of formatting."""
+    return _WHITESPACE.sub(" ", text.lower())
+
+def _trie_pattern(phrases: List[str]) -> str:
+    """
+    Build a regex alternation factored by common prefixes.
+
+    A flat ``a|b|c`` alternation retries every phrase at each position; the
+    trie form only follows branches that match the next character, so the
+    cost per position is bounded by phrase length rather than rule count.
+    """
+    trie: Dict = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict) -> str:
+        branches = [
+            re.escape(char) + build(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A phrase ends here but longer ones continue; prefer the longer match
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+
+    return build(trie)
+
+def _prefix_pattern(phrases: List[str]) -> str:
+    """Like _trie_pattern, but matching any non-empty prefix of a phrase."""
+    trie: Dict = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+
+    def build(node: Dict) -> str:
+        branches = []
+        for char, child in sorted(node.items()):
+            rest = build(child)
+            branches.append(re.escape(char) + ("(?:" + rest + ")?" if rest else ""))
+        if not branches:
+            return ""
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+class SafetyViolation:
+    def __init__(self, category: str, phrase: str):
+        self.category = category
+        self.phrase = phrase
+
+    def to_dict(self) -> Dict:
+        return {"category": self.category, "phrase": self.phrase}
+
+class _CompiledRules:
+    """Immutable compiled rule set; swapped as a whole on reload."""
+
+    def __init__(self, rules: Dict[str, List[str]], version: int):
+        self.version = version
+        self.categories: Dict[str, str] = {}
+        for category, phrases in rules.items():
+            for phrase in phrases:
+                normalized = normalize_text(phrase).strip()
+                if normalized:
+                    self.categories.setdefault(normalized, category)
+
+        self.max_phrase_length = max((len(p) for p in self.categories), default=0)
+        self.pattern = None
+        self.partial_pattern = None
+        if self.categories:
+            self.pattern = re.compile(
+                r"(?<!\w)" + _trie_pattern(list(self.categories)) + r"(?!\w)"
+            )
+            # The start of a phrase (or a whole one) running into the end of the text
+            self.partial_pattern = re.compile(
+                r"(?<!\w)" + _prefix_pattern(list(self.categories)) + r"\Z"
+            )
+
+    def search(self, normalized: str, complete: bool = True) -> Optional[SafetyViolation]:
+        """
+        Return the first violation in already-normalized text.
+
+        With ``complete=False`` a match touching the end of the text is
+        ignored, because more text may follow (``kill`` vs ``killer``).
+        """
+        if self.pattern is None:
+            return None
+        for match in self.pattern.finditer(normalized):
+            if not complete and match.end() == len(normalized):
+                continue
+            phrase = match.group(0)
+            return SafetyViolation(self.categories[phrase], phrase)
+        return None
+
+    def partial_start(self, normalized: str) -> int:
+        """
+        Where a phrase that more text could complete starts in
+        already-normalized text, or ``len(normalized)`` if there is none.
+        """
+        if self.partial_pattern is None:
+            return len(normalized)
+        match = self.partial_pattern.search(normalized)
+        return match.start() if match else len(normalized)
+
+class SafetyStream:
+    """
+    Incremental checker for streamed text.
+
+    feed() returns the part of the text seen so far that is safe to send.
+    Text that could be the start of a phrase (``you should`` before
+    ``kill yourself`` arrives) is held back until later chunks or finish()
+    resolve it, so no part of a violating phrase reaches the client. Only
+    the held text plus a short tail of released text (long enough to hold
+    any phrase) is scanned per call, so checking a whole stream stays linear
+    in its length.
+    """
+
+    def __init__(self, rules: _CompiledRules):
+        self._rules = rules
+        self._tail = ""
+        self._pending = ""
+        self.violation: Optional[SafetyViolation] = None
+
+    def feed(self, chunk: str) -> str:
+        """Add ``chunk``; returns the text now safe to send ("" after a violation)."""
+        if self.violation is not None:
+            return ""
+        self._pending += chunk
+        buffer = normalize_text(self._tail + self._pending)
+        self.violation = self._rules.search(buffer, complete=False)
+        if self.violation is not None:
+            return ""
+
+        held = len(buffer) - self._rules.partial_start(buffer)
+        # Smallest raw suffix of the pending text covering the held part
+        low, high = 0, len(self._pending)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if len(normalize_text(self._pending[middle:])) >= held:
+                low = middle
+            else:
+                high = middle - 1
+        released, self._pending = self._pending[:low], self._pending[low:]
+        self._tail = buffer[:len(buffer) - held][-(self._rules.max_phrase_length + 1):]
+        return released
+
+    def finish(self) -> str:
+        """
+        Check the held text once the stream has ended; returns it when it
+        passes and "" when there is a violation.
+        """
+        if self.violation is None:
+            self.violation = self._rules.search(normalize_text(self._tail + self._pending))
+        if self.violation is not None:
+            return ""
+        released, self._pending = self._pending, ""
+        return released
+
+class SafetyFilter:
+    """
+    Phrase-based content filter compiled into a single regex.
+
+    Rules are read from a JSON file mapping category names to phrase lists.
+    The file is re-checked at most every ``check_interval`` seconds and,
+    when it changed, recompiled and swapped in atomically, so rule updates
+    take effect in running workers without a restart.
+    """
+
+    def __init__(self, rules_path: Optional[str] = None, check_interval: float = 5.0):
+        self.rules_path = Path(rules_path or SAFETY_RULES_PATH)
+        self.check_interval = check_interval
+        self._lock = Lock()
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._rules = self._compile(version=1)
+
+    def _read_rules(self) -> Dict[str, List[str]]:
+        try:
+            with open(self.rules_path, "r", encoding="utf-8") as f:
+                rules = json.load(f)
+            self._mtime = self.rules_path.stat().st_mtime
+        except FileNotFoundError:
+            self._mtime = None
+            return DEFAULT_SAFETY_RULES
+        if not isinstance(rules, dict) or not all(
+            isinstance(phrases, list) and all(isinstance(phrase, str) for phrase in phrases)
+            for phrases in rules.values()
+        ):
+            raise ValueError(f"{self.rules_path} must map categories to lists of phrases")
+        return rules
+
+    def _compile(self, version: int) -> _CompiledRules:
+        rules = _CompiledRules(self._read_rules(), version)
+        logger.info(f"Loaded {len(rules.categories)} safety phrases (version {version})")
+        return rules
+
+    def reload(self):
+        """Recompile the rules from disk now."""
+        with self._lock:
+            try:
+                self._rules = self._compile(self._rules.version + 1)
+            except (OSError, ValueError) as e:
+                # Keep serving the previous rules if the new file is invalid
+                logger.error(f"Error reloading safety rules: {str(e)}")
+
+    def _current(self) -> _CompiledRules:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            try:
+                mtime = self.rules_path.stat().st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._mtime:
+                self.reload()
+        return self._rules
+
+    @property
+    def version(self) -> int:
+        return self._rules.version
+
+    def check(self, text: str) -> Optional[SafetyViolation]:
+        """Return the first violation in ``text``, or None if it passes."""
+        return self._current().search(normalize_text(text))
+
+    def passes(self, text: str) -> bool:
+        return self.check(text) is None
+
+    def stream(self) -> SafetyStream:
+        """Start an incremental check bound to the current rule set."""
+        return SafetyStream(self._current())
+
+_default_filter: Optional[SafetyFilter] = None
+_default_filter_lock = Lock()
+
+def get_safety_filter() -> SafetyFilter:
+    """Return the process-wide safety filter."""
+    global _default_filter
+    if _default_filter is None:
+        with _default_filter_lock:
+            if _default_filter is None:
+                _default_filter = SafetyFilter()
+    return _default_filter
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, JSON
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Date, Float, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -27,9 +28,56 @@ class EmotionRecord(Base):
     emotion_data = Column(JSON)  # Stores emotion analysis results
     text_content = Column(String, nullable=True)
     voice_file_path = Column(String, nullable=True)
+    # Lease of the voice analysis worker analyzing this record (see analytics.voice_analysis)
+    voice_claimed_until = Column(DateTime, nullable=True)
+    
+    # Copied out of emotion_data on write so queries never parse the JSON
+    dominant_emotion = Column(String(32), nullable=True, index=True)
+    sentiment_score = Column(Float, nullable=True)
     
     # Relationships
     user = relationship("User", back_populates="emotion_records")
+    
+    __table_args__ = (
+        # Per-user time-range scans; the included columns make them index-only
+        Index(
+            "ix_emotion_records_user_id_timestamp",
+            "user_id",
+            "timestamp",
+            postgresql_include=["sentiment_score", "dominant_emotion"]
+        ),
+    )
+
+class EmotionDailyRollup(Base):
+    __tablename__ = "emotion_daily_rollups"
+
+    # Per-user, per-day aggregates maintained by analytics.emotion_rollups
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    record_count = Column(Integer, nullable=False, default=0)
+    sentiment_sum = Column(Float, nullable=False, default=0.0)
+    sentiment_sq_sum = Column(Float, nullable=False, default=0.0)
+    emotion_counts = Column(JSONB, nullable=False, default=dict)  # dominant emotion -> count
+
+class EmotionHourlyRollup(Base):
+    __tablename__ = "emotion_hourly_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    hour = Column(DateTime, primary_key=True)  # Truncated to the hour
+    record_count = Column(Integer, nullable=False, default=0)
+    sentiment_sum = Column(Float, nullable=False, default=0.0)
+    sentiment_sq_sum = Column(Float, nullable=False, default=0.0)
+    emotion_counts = Column(JSONB, nullable=False, default=dict)
+
+class EmotionReportSnapshot(Base):
+    __tablename__ = "emotion_report_snapshots"
+
+    # Reports precomputed by the nightly analytics.batch_reports job
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    days = Column(Integer, primary_key=True)
+    generated_at = Column(DateTime, nullable=False)
+    max_record_id = Column(Integer, nullable=False)  # Newest emotion_records.id the job could see
+    report = Column(JSONB, nullable=False)
 
 class MeditationSession(Base):
     __tablename__ = "meditation_sessions"
@@ -42,6 +90,11 @@ class MeditationSession(Base):
     duration = Column(Integer)  # Duration in seconds
     notes = Column(String, nullable=True)
     
+    # Generated when the session starts, before the row is written
+    session_key = Column(String(32), unique=True, nullable=True)
+    exercise_id = Column(String, nullable=True)
+    planned_duration = Column(Integer, nullable=True)  # The exercise's duration in seconds
+    
     # Relationships
     user = relationship("User", back_populates="meditation_sessions")
 